@@ -3,56 +3,57 @@ import logging
 import requests
 import json
 import uuid
-from datetime import datetime, timezone # استخدام timezone aware datetime
+import time
+import base64
 
-from flask import Flask, request, jsonify, render_template
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, DateTime, ForeignKey, select, delete, update, desc, func
-from sqlalchemy.dialects.postgresql import UUID # لاستخدام نوع UUID الأصلي في PostgreSQL
+import click
+from datetime import datetime, timedelta, timezone # استخدام timezone aware datetime
+
+from flask import Blueprint, Flask, request, jsonify, render_template, Response, stream_with_context, current_app, has_app_context
+from sqlalchemy.orm import lazyload
+from sqlalchemy import select, delete, update, desc, func, tuple_, bindparam
 from sqlalchemy.exc import SQLAlchemyError
 
+import circuit_breaker
+import context_builder
+import conversation_export
+import hedging
+import idempotency
+import json_provider
+import message_compression
+import metrics
+import migrations
+import provider_client
+import search
+import tracing
+import write_behind
+from translation_cache import TranslationCache, DatabaseTranslationStore
+from translation_service import TranslationService
+from models import db, Conversation, Message, StoredMessage, TranslationCacheEntry, IdempotencyRecord, PREVIEW_CHARS, message_preview
+
 # --- إعداد التسجيل ---
 # في Render، سيتم التقاط المخرجات إلى stdout/stderr وعرضها في السجلات
 log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- Base Class for SQLAlchemy models (أسلوب حديث) ---
-class Base(DeclarativeBase):
-    pass
-
-# --- تهيئة Flask و SQLAlchemy ---
-app = Flask(__name__)
-
 # --- تحميل الإعدادات الحساسة من متغيرات البيئة (ضروري لـ Render) ---
-app.secret_key = os.environ.get("SESSION_SECRET")
-if not app.secret_key:
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+if not SESSION_SECRET:
     logger.warning("SESSION_SECRET environment variable not set. Using a default insecure key for now.")
-    app.secret_key = "default-insecure-secret-key-for-render" # استخدم هذا فقط إذا فشل تحميل المتغير
+    SESSION_SECRET = "default-insecure-secret-key-for-render" # استخدم هذا فقط إذا فشل تحميل المتغير
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 if not DATABASE_URL:
     logger.error("FATAL: DATABASE_URL environment variable is not set.")
     # قد ترغب في منع بدء التشغيل هنا
     # raise ValueError("DATABASE_URL is required")
-else:
+elif DATABASE_URL.startswith("postgres://"):
     # Render قد يوفر 'postgres://' بدلاً من 'postgresql://'
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-
-# إعدادات اتصال قاعدة البيانات الموصى بها للبيئات السحابية
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 280,  # أقل بقليل من 5 دقائق (شائع لـ timeouts)
-    "pool_pre_ping": True, # للتحقق من الاتصال قبل استخدامه
-    "pool_timeout": 10,   # وقت انتظار الحصول على اتصال من الـ pool
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# تهيئة SQLAlchemy مع التطبيق ونموذج Base
-db = SQLAlchemy(model_class=Base)
-db.init_app(app)
+# --- المسارات وأوامر CLI تُسجَّل على هذا الـ Blueprint، ويُنشأ التطبيق في create_app() ---
+bp = Blueprint("main", __name__, cli_group=None) # cli_group=None: الأوامر تبقى `flask <command>`
 
 # --- تحميل مفاتيح API ---
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
@@ -72,81 +73,161 @@ if not APP_URL:
 
 APP_TITLE = "Yasmin GPT Chat"
 
-# --- تعريف نماذج قاعدة البيانات (مدمجة هنا) ---
-
-class Conversation(Base):
-    __tablename__ = "conversations" # استخدام صيغة الجمع أفضل
-
-    # استخدام Mapped و mapped_column للأسلوب الحديث
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    title: Mapped[str] = mapped_column(String(100), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
-    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
-
-    # العلاقة مع الرسائل (one-to-many)
-    # cascade: حذف الرسائل تلقائيًا عند حذف المحادثة
-    # back_populates: يربط العلاقة بالاتجاه المعاكس في نموذج Message
-    # order_by: ترتيب الرسائل تلقائيًا عند الوصول إليها من المحادثة
-    messages: Mapped[list["Message"]] = relationship(
-        "Message",
-        back_populates="conversation",
-        cascade="all, delete-orphan",
-        order_by="Message.created_at",
-        lazy="selectin" # تحميل الرسائل مع المحادثة بكفاءة
+# حجم صفحة قائمة المحادثات
+CONVERSATIONS_PAGE_SIZE = int(os.environ.get("CONVERSATIONS_PAGE_SIZE", 50))
+CONVERSATIONS_MAX_PAGE_SIZE = 200
+# حجم صفحة رسائل المحادثة
+MESSAGES_PAGE_SIZE = int(os.environ.get("MESSAGES_PAGE_SIZE", 50))
+MESSAGES_MAX_PAGE_SIZE = 500
+# حجم صفحة نتائج البحث
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = 100
+# حذف المحادثات القديمة (سياسة الاحتفاظ) على دفعات محدودة
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", 500))
+# رمز يسمح باستدعاء نقاط النهاية الإدارية (مثل الحذف الجماعي)؛ غير مفعّلة إذا لم يُضبط
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN")
+
+# --- خدمة الترجمة (مع ذاكرة مؤقتة من طبقتين: LRU داخل العملية + جدول في قاعدة البيانات) ---
+translation_service = TranslationService(
+    cache=TranslationCache(store=DatabaseTranslationStore(db, TranslationCacheEntry))
+)
+
+
+# آخر تطبيق أنشأه create_app: خيوط الخلفية (الكتابة المؤجلة) تعمل خارج سياق التطبيق
+_app = None
+
+
+def _database_engine():
+    if has_app_context():
+        return db.engine
+    with _app.app_context():
+        return db.engine
+
+
+# فهرس البحث النصي الكامل في الرسائل (يُحدَّث مع كل إدراج أو تعديل أو حذف عبر ORM)
+search_index = search.SearchIndex(Message.__table__, Conversation.__table__)
+search_index.listen(Message)
+
+# طابور الكتابة المؤجلة لرسائل المحادثة (يُستخدم فقط عند تفعيل WRITE_BEHIND)
+write_behind_queue = write_behind.WriteBehindQueue(_database_engine, Message.__table__, Conversation.__table__,
+                                                   on_insert=search_index.index, preview=message_preview)
+
+# الردود المخزنة لطلبات المحادثة التي تحمل ترويسة Idempotency-Key
+idempotency_store = idempotency.IdempotencyStore(_database_engine, IdempotencyRecord)
+
+
+def as_utc(value):
+    """Treat naive datetimes (SQLite drops tzinfo) as UTC."""
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+
+def load_context_tail(conversation_id, after_id, budget, before_id=None):
+    """
+    Return (rows, complete): the newest StoredMessage rows of a
+    conversation with after_id < id < before_id, oldest first, read newest
+    first through the (conversation_id, id) index until `budget` tokens are
+    exceeded. `complete` is False if older rows in that range were not read.
+    """
+    stmt = select(Message.id, Message.role, Message.content, Message.created_at, Message.content_compressed)\
+           .where(Message.conversation_id == conversation_id, Message.id > after_id)\
+           .order_by(Message.id.desc())
+    if before_id is not None:
+        stmt = stmt.where(Message.id < before_id)
+    rows = []
+    used = 0
+    result = db.session.execute(stmt, execution_options={"yield_per": 50})
+    try:
+        for row in result:
+            if used > budget:
+                return rows[::-1], False
+            content = message_compression.stored_text(row.content, row.content_compressed)
+            rows.append(StoredMessage(row.id, row.role, content, row.created_at))
+            used += context_builder.message_tokens({"content": content})
+    finally:
+        result.close()
+    return rows[::-1], True
+
+
+def replace_assistant_reply(conversation_id, message_id, content):
+    """
+    Swap the text of an assistant message in place with a single UPDATE, and
+    refresh its search entry and the conversation's updated_at and preview. Returns False
+    if the message no longer exists. The caller commits.
+    """
+    now = datetime.now(timezone.utc)
+    swapped = db.session.execute(
+        update(Message)
+        .where(Message.id == message_id, Message.conversation_id == conversation_id, Message.role == 'assistant')
+        .values(**message_compression.stored_columns(content), created_at=now),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if not swapped:
+        return False
+    # تحديث Core لا يطلق أحداث after_update، لذا نحدّث فهرس البحث يدويًا
+    search_index.index(db.session.connection(), [(message_id, content)])
+    db.session.execute(
+        update(Conversation).where(Conversation.id == conversation_id)
+        .values(updated_at=now, last_message_preview=message_preview(content), last_role='assistant'),
+        execution_options={"synchronize_session": False},
     )
-
-    def add_message(self, role: str, content: str):
-        """ Helper method to add a message to this conversation """
-        new_message = Message(
-            conversation_id=self.id, # ربط الرسالة بهذه المحادثة
-            role=role,
-            content=content
-        )
-        # إضافة الرسالة إلى الجلسة (سيتم ربطها تلقائيًا بالمحادثة عبر العلاقة)
-        db.session.add(new_message)
-        # تحديث وقت تعديل المحادثة (يمكن أن يتم تلقائيًا عبر onupdate إذا كان الحقل موجودًا)
-        self.updated_at = datetime.now(timezone.utc)
-        return new_message # قد يكون مفيدًا إرجاع الرسالة المُنشأة
-
-    def to_dict(self):
-        """ Serialize conversation and its messages to a dictionary """
-        return {
-            "id": str(self.id), # تحويل UUID إلى سلسلة
-            "title": self.title,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            # تحويل كل رسالة في قائمة الرسائل إلى قاموس
-            "messages": [message.to_dict() for message in self.messages]
-        }
-
-    def __repr__(self):
-        return f"<Conversation(id={self.id}, title='{self.title}')>"
-
-class Message(Base):
-    __tablename__ = "messages" # استخدام صيغة الجمع
-
-    id: Mapped[int] = mapped_column(primary_key=True) # استخدام auto-incrementing integer كـ PK
-    # ربط بالـ UUID الخاص بالمحادثة
-    conversation_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("conversations.id"), nullable=False, index=True)
-    role: Mapped[str] = mapped_column(String(20), nullable=False) # 'user' or 'assistant'
-    content: Mapped[str] = mapped_column(Text, nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
-
-    # العلاقة العكسية مع المحادثة (many-to-one)
-    conversation: Mapped["Conversation"] = relationship("Conversation", back_populates="messages")
-
-    def to_dict(self):
-        """ Serialize message to a dictionary """
-        return {
-            "id": self.id,
-            "conversation_id": str(self.conversation_id), # تحويل UUID إلى سلسلة
-            "role": self.role,
-            "content": self.content,
-            "created_at": self.created_at.isoformat()
-        }
-
-    def __repr__(self):
-        return f"<Message(id={self.id}, role='{self.role}', conv_id={self.conversation_id})>"
+    return True
+
+
+def save_message(conversation, role, content):
+    """Add a message to the session, or queue it for the write-behind flusher when WRITE_BEHIND is on."""
+    if write_behind.ENABLED:
+        return write_behind_queue.enqueue(conversation.id, role, content)
+    return conversation.add_message(role, content)
+
+
+def flush_pending_writes():
+    """Write queued write-behind messages now, before a route reads or changes stored messages."""
+    if write_behind.ENABLED:
+        write_behind_queue.flush()
+
+
+def delete_conversations(conversation_ids):
+    """
+    Delete conversations with all their messages and search entries using
+    set-based statements in the current transaction (nothing is loaded into
+    the session). Returns (conversations_deleted, messages_deleted).
+    """
+    search_index.unindex_conversations(db.session.connection(), conversation_ids)
+    messages_deleted = db.session.execute(
+        delete(Message).where(Message.conversation_id.in_(conversation_ids)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    conversations_deleted = db.session.execute(
+        delete(Conversation).where(Conversation.id.in_(conversation_ids)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    return conversations_deleted, messages_deleted
+
+
+def purge_conversations(older_than_days, batch_size=PURGE_BATCH_SIZE):
+    """
+    Delete conversations not updated for `older_than_days` days, committing
+    every `batch_size` conversations so no transaction holds many locks.
+    Returns (conversations_deleted, messages_deleted).
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    total_conversations = total_messages = 0
+    while True:
+        # يستخدم الفهرس (updated_at, id)
+        ids = db.session.execute(
+            select(Conversation.id).where(Conversation.updated_at < cutoff)
+            .order_by(Conversation.updated_at).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        conversations_deleted, messages_deleted = delete_conversations(ids)
+        db.session.commit()
+        total_conversations += conversations_deleted
+        total_messages += messages_deleted
+        logger.info(f"Retention purge: deleted {conversations_deleted} conversations ({messages_deleted} messages) in this batch.")
+    logger.info(f"Retention purge finished: {total_conversations} conversations and {total_messages} messages "
+                f"older than {older_than_days:g} days deleted.")
+    return total_conversations, total_messages
 
 
 # --- الردود الاحتياطية (للاستخدام عند فشل كل الـ APIs) ---
@@ -160,12 +241,24 @@ offline_responses = {
 default_offline_response = "أعتذر، لا يمكنني معالجة طلبك الآن. يبدو أن هناك مشكلة في الاتصال بالإنترنت أو بخدمات الذكاء الاصطناعي."
 
 # --- دالة استدعاء Gemini API (النموذج الاحتياطي) ---
-def call_gemini_api(messages_list, temperature, max_tokens=512):
+def call_gemini_api(messages_list, temperature, max_tokens=512, cancel_event=None):
     """Call the Gemini API as a backup"""
     if not GEMINI_API_KEY:
         logger.warning("Gemini API key not available for backup.")
         return None, "مفتاح Gemini API غير متوفر"
 
+    breaker = circuit_breaker.get_breaker("gemini")
+    if not breaker.allow_request():
+        logger.warning("Gemini circuit is open; skipping backup call.")
+        return None, "النموذج الاحتياطي (Gemini) غير متاح مؤقتًا بسبب أعطال متكررة"
+
+    started = time.monotonic()
+    if cancel_event is not None:
+        ai_reply, error = _collect_stream(lambda: stream_gemini_api(messages_list, temperature, max_tokens),
+                                          cancel_event, "Gemini")
+        _record_collected(breaker, started, cancel_event, ai_reply)
+        return ai_reply, error
+
     try:
         # تحويل تنسيق الرسائل لـ Gemini
         gemini_contents = []
@@ -181,10 +274,10 @@ def call_gemini_api(messages_list, temperature, max_tokens=512):
              # Or potentially return an error: return None, "Gemini requires the last message to be from the user."
 
         # بناء الـ URL بشكل آمن
-        gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={GEMINI_API_KEY}" # استخدام 1.5 flash كمثال
+        gemini_url = provider_client.gemini_url(provider_client.GEMINI_CHAT_MODEL, "generateContent", GEMINI_API_KEY)
         logger.debug(f"Calling Gemini API ({gemini_url.split('?')[0]}) with {len(gemini_contents)} parts...")
 
-        response = requests.post(
+        response = provider_client.post(
             url=gemini_url,
             headers={'Content-Type': 'application/json'},
             json={
@@ -194,10 +287,14 @@ def call_gemini_api(messages_list, temperature, max_tokens=512):
                     "temperature": temperature
                 }
             },
-            timeout=30 # مهلة معقولة
+            timeout=provider_client.GEMINI_TIMEOUT # مهلة معقولة
         )
         response.raise_for_status() # إثارة خطأ لأكواد 4xx/5xx
-        response_data = response.json()
+        response_data = json_provider.loads(response.content)
+        breaker.record_success(time.monotonic() - started)
+        usage = response_data.get('usageMetadata') or {}
+        metrics.record_usage("gemini", provider_client.GEMINI_CHAT_MODEL,
+                             usage.get('promptTokenCount'), usage.get('candidatesTokenCount'))
 
         # التحقق من الاستجابة ومعالجة الردود المحظورة
         if 'candidates' not in response_data or not response_data['candidates']:
@@ -224,52 +321,489 @@ def call_gemini_api(messages_list, temperature, max_tokens=512):
 
     except requests.exceptions.Timeout:
         logger.error("Gemini API request timed out.")
+        breaker.record_failure(time.monotonic() - started)
         return None, "استجابة النموذج الاحتياطي (Gemini) استغرقت وقتاً طويلاً"
     except requests.exceptions.HTTPError as e:
+         breaker.record_error(e, time.monotonic() - started)
          error_body = e.response.text
          logger.error(f"Gemini API HTTP error ({e.response.status_code}): {error_body}")
          try:
-             error_json = e.response.json()
+             error_json = json_provider.loads(e.response.content)
              error_details = error_json.get("error", {}).get("message", error_body)
          except json.JSONDecodeError:
              error_details = error_body[:200] # عرض جزء من النص
          return None, f"خطأ HTTP من Gemini: {error_details}"
     except requests.exceptions.RequestException as e:
         logger.error(f"Error calling Gemini API: {e}")
+        breaker.record_failure(time.monotonic() - started)
         return None, f"خطأ في الاتصال بالنموذج الاحتياطي (Gemini): {e}"
     except Exception as e:
         logger.error(f"Unexpected error processing Gemini response: {e}", exc_info=True)
         return None, f"خطأ غير متوقع في معالجة استجابة Gemini: {e}"
 
 
+# --- دالة استدعاء OpenRouter API (النموذج الأساسي) ---
+def call_openrouter_api(messages_list, model, temperature, max_tokens, cancel_event=None):
+    """Call the OpenRouter chat-completions API. Returns (reply, error)."""
+    breaker = circuit_breaker.get_breaker("openrouter")
+    if not breaker.allow_request():
+        # الدائرة مفتوحة: تخطي OpenRouter فورًا بدلاً من انتظار المهلة كاملة
+        logger.warning("OpenRouter circuit is open; skipping straight to the backup provider.")
+        return None, "OpenRouter غير متاح مؤقتًا بسبب أعطال متكررة"
+
+    started = time.monotonic()
+    if cancel_event is not None:
+        # في وضع التحوّط نستخدم البث حتى يمكن قطع الطلب الخاسر فور فوز الآخر
+        ai_reply, error = _collect_stream(lambda: stream_openrouter_api(messages_list, model, temperature, max_tokens),
+                                          cancel_event, "OpenRouter")
+        _record_collected(breaker, started, cancel_event, ai_reply)
+        return ai_reply, error # زمن الاستجابة يسجله hedging.race
+
+    try:
+        logger.debug(f"Sending request to OpenRouter with model: {model}, history size: {len(messages_list)}")
+        headers = {
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json", # إضافة Content-Type
+            "HTTP-Referer": APP_URL,
+            "X-Title": APP_TITLE,
+        }
+        payload = {
+            "model": model,
+            "messages": messages_list,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        response = provider_client.post(url=provider_client.OPENROUTER_CHAT_URL, headers=headers, json=payload,
+                                        timeout=provider_client.OPENROUTER_TIMEOUT)
+        response.raise_for_status() # Check for 4xx/5xx errors
+        api_response = json_provider.loads(response.content)
+        breaker.record_success(time.monotonic() - started)
+        hedging.openrouter_latency.record(time.monotonic() - started)
+
+        # التحقق من صحة الرد
+        if api_response.get('choices') and api_response['choices'][0].get('message'):
+            ai_reply = api_response['choices'][0]['message'].get('content', '').strip()
+            # تسجيل التكلفة والاستخدام إذا كانت متوفرة
+            if 'usage' in api_response:
+                logger.info(f"OpenRouter usage: {api_response['usage']}")
+                metrics.record_usage("openrouter", model, api_response['usage'].get('prompt_tokens'),
+                                     api_response['usage'].get('completion_tokens'))
+            if not ai_reply:
+                logger.warning(f"OpenRouter returned an empty content string for model {model}. Response: {api_response}")
+                # لا تعتبره خطأ فادحًا، قد يكون بسبب مرشحات المحتوى
+                return None, "أعاد OpenRouter ردًا فارغًا"
+            logger.info(f"Received reply from OpenRouter ({model}).")
+            return ai_reply, None
+        logger.error(f"OpenRouter response structure invalid: {api_response}")
+        return None, "استجابة غير متوقعة من OpenRouter"
+
+    except requests.exceptions.Timeout:
+        logger.error("OpenRouter API request timed out.")
+        breaker.record_failure(time.monotonic() - started)
+        hedging.openrouter_latency.record(time.monotonic() - started) # عينة دنيا: الرد كان سيتأخر أكثر
+        return None, "استجابة OpenRouter استغرقت وقتاً طويلاً"
+    except requests.exceptions.HTTPError as e:
+        breaker.record_error(e, time.monotonic() - started)
+        error_body = e.response.text
+        logger.error(f"OpenRouter API HTTP error ({e.response.status_code}): {error_body}")
+        try:
+             error_json = json_provider.loads(e.response.content)
+             error_details = error_json.get("error", {}).get("message", error_body)
+        except json.JSONDecodeError:
+             error_details = error_body[:200]
+        return None, f"خطأ HTTP من OpenRouter: {error_details}"
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error calling OpenRouter API: {e}", exc_info=True)
+        breaker.record_failure(time.monotonic() - started)
+        return None, f"خطأ في الاتصال بـ OpenRouter: {e}"
+    except Exception as e:
+        logger.error(f"Unexpected error processing OpenRouter response: {e}", exc_info=True)
+        return None, f"خطأ غير متوقع في معالجة استجابة OpenRouter: {e}"
+
+
+def _collect_stream(open_stream, cancel_event, provider_name):
+    """
+    Drain a provider stream into one reply, abandoning it as soon as cancel_event
+    is set (the socket is shut down, so this holds even before the first byte).
+    """
+    stream = open_stream()
+    parts = []
+    try:
+        with provider_client.cancel_on(cancel_event):
+            for delta in stream:
+                if cancel_event.is_set():
+                    break
+                parts.append(delta)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if not cancel_event.is_set():
+            logger.error(f"Error streaming from {provider_name}: {e}")
+            return None, f"خطأ في الاتصال بـ {provider_name}: {e}"
+    finally:
+        stream.close() # إغلاق الاتصال بالمزود إن لم يكتمل البث
+    if cancel_event.is_set():
+        logger.info(f"Cancelled in-flight {provider_name} request (lost the hedged race).")
+        return None, f"تم إلغاء طلب {provider_name}"
+    reply = "".join(parts).strip()
+    return (reply, None) if reply else (None, f"لم يتم العثور على نص في استجابة {provider_name}")
+
+
+def _record_collected(breaker, started, cancel_event, ai_reply):
+    """Report a hedged call's outcome to its breaker; a cancelled loser is neither success nor failure."""
+    if ai_reply:
+        breaker.record_success(time.monotonic() - started)
+    elif cancel_event.is_set():
+        breaker.release()
+    else:
+        breaker.record_failure(time.monotonic() - started)
+
+
+def generate_ai_reply(messages_for_api, model, temperature, max_tokens):
+    """
+    Get a reply from OpenRouter with Gemini as backup.
+
+    Sequential by default. With PROVIDER_HEDGING on, Gemini is fired in
+    parallel once OpenRouter exceeds the hedge delay and the first answer wins.
+    Returns (reply, error_message, used_backup, api_source).
+    """
+    if OPENROUTER_API_KEY and GEMINI_API_KEY and hedging.HEDGING_ENABLED:
+        delay = hedging.hedge_delay()
+        with tracing.span("hedged_race"):
+            winner, ai_reply, errors = hedging.race(
+                ("OpenRouter", lambda cancel: metrics.timed_call(
+                    "openrouter", model,
+                    lambda: call_openrouter_api(messages_for_api, model, temperature, max_tokens, cancel), cancel)),
+                ("Gemini (Backup)", lambda cancel: metrics.timed_call(
+                    "gemini", provider_client.GEMINI_CHAT_MODEL,
+                    lambda: call_gemini_api(messages_for_api, temperature, max_tokens, cancel), cancel)),
+                delay,
+                latency=hedging.openrouter_latency,
+            )
+        if ai_reply:
+            used_backup = winner != "OpenRouter"
+            if used_backup:
+                metrics.record_fallback("gemini")
+            logger.info(f"Hedged reply served by {winner} (hedge delay {delay:.2f}s, used_backup={used_backup}).")
+            return ai_reply, None, used_backup, winner
+        logger.error(f"Hedged race failed on all providers: {errors}")
+        error_message = errors.get("OpenRouter") or f"فشل النموذج الاحتياطي (Gemini): {errors.get('Gemini (Backup)')}"
+        return None, error_message, False, "N/A"
+
+    ai_reply = None
+    error_message = None
+    api_source = "N/A"
+
+    # 1. محاولة OpenRouter
+    if OPENROUTER_API_KEY:
+        api_source = "OpenRouter"
+        with tracing.span("openrouter"):
+            ai_reply, error_message = metrics.timed_call(
+                "openrouter", model, lambda: call_openrouter_api(messages_for_api, model, temperature, max_tokens))
+
+    # 2. محاولة Gemini كاحتياطي إذا فشل OpenRouter
+    if not ai_reply and GEMINI_API_KEY:
+        api_source = "Gemini (Backup)"
+        logger.info("OpenRouter failed or unavailable. Trying Gemini API as backup...")
+        if OPENROUTER_API_KEY:
+            metrics.record_fallback("gemini")
+        # نمرر نفس قائمة الرسائل التي أُرسلت إلى OpenRouter
+        with tracing.span("gemini"):
+            ai_reply, backup_error = metrics.timed_call(
+                "gemini", provider_client.GEMINI_CHAT_MODEL, lambda: call_gemini_api(messages_for_api, temperature, max_tokens))
+        if ai_reply:
+            logger.info("Received reply from Gemini (backup).")
+            return ai_reply, None, True, api_source # مسح خطأ OpenRouter إذا نجح Gemini
+        logger.error(f"Gemini backup also failed: {backup_error}")
+        # احتفظ بخطأ OpenRouter الأصلي إذا كان موجودًا، أو استخدم خطأ Gemini
+        error_message = error_message or f"فشل النموذج الاحتياطي (Gemini): {backup_error}"
+
+    return ai_reply, error_message, False, api_source
+
+
+def summarize_history(previous_summary, messages):
+    """Fold older turns into a conversation's rolling summary using the normal provider chain."""
+    summary, error_message, _, api_source = generate_ai_reply(
+        context_builder.summary_prompt(previous_summary, messages),
+        context_builder.SUMMARY_MODEL, 0.2, context_builder.SUMMARY_MAX_TOKENS)
+    if not summary:
+        logger.error(f"Conversation summary refresh failed: {error_message}")
+        return None
+    logger.info(f"Refreshed conversation summary via {api_source} ({len(messages)} messages folded).")
+    return summary
+
+
+# --- البث التدريجي (Streaming) من مزودي النماذج ---
+def _iter_sse_data(response):
+    """Yield the raw `data:` payloads of an upstream Server-Sent Events response."""
+    # text/event-stream بدون charset يُفك افتراضيًا كـ ISO-8859-1، مما يفسد النص العربي
+    response.encoding = 'utf-8'
+    # chunk_size=None يعيد البيانات فور وصولها بدلاً من انتظار امتلاء المخزن المؤقت
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if not line or line.startswith(':'): # أسطر فارغة أو تعليقات keep-alive
+            continue
+        if line.startswith('data:'):
+            yield line[5:].strip()
+
+
+def stream_openrouter_api(messages_list, model, temperature, max_tokens):
+    """Stream a reply from OpenRouter (`stream: true`), yielding text deltas."""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": APP_URL,
+        "X-Title": APP_TITLE,
+    }
+    payload = {
+        "model": model,
+        "messages": messages_list,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+    logger.debug(f"Streaming from OpenRouter with model: {model}, history size: {len(messages_list)}")
+    with provider_client.post(url=provider_client.OPENROUTER_CHAT_URL, headers=headers, json=payload,
+                              timeout=provider_client.OPENROUTER_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for data in _iter_sse_data(response):
+            if data == '[DONE]':
+                break
+            chunk = json_provider.loads(data)
+            if 'error' in chunk: # OpenRouter قد يرسل الخطأ داخل البث بعد رمز 200
+                raise ValueError(f"OpenRouter stream error: {chunk['error'].get('message', chunk['error'])}")
+            if chunk.get('usage'):
+                logger.info(f"OpenRouter usage: {chunk['usage']}")
+                metrics.record_usage("openrouter", model, chunk['usage'].get('prompt_tokens'),
+                                     chunk['usage'].get('completion_tokens'))
+            choices = chunk.get('choices') or []
+            if choices:
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    yield delta
+
+
+def stream_gemini_api(messages_list, temperature, max_tokens=512):
+    """Stream a reply from Gemini (`streamGenerateContent`), yielding text deltas."""
+    gemini_contents = []
+    for msg in messages_list:
+        role = "user" if msg["role"] == "user" else "model"
+        gemini_contents.append({"role": role, "parts": [{"text": msg["content"]}]})
+
+    gemini_url = provider_client.gemini_url(provider_client.GEMINI_CHAT_MODEL, "streamGenerateContent", GEMINI_API_KEY, alt="sse")
+    logger.debug(f"Streaming from Gemini API ({gemini_url.split('?')[0]}) with {len(gemini_contents)} parts...")
+    with provider_client.post(url=gemini_url, headers={'Content-Type': 'application/json'},
+                              json={
+                                  "contents": gemini_contents,
+                                  "generationConfig": {
+                                      "maxOutputTokens": max_tokens,
+                                      "temperature": temperature
+                                  }
+                              },
+                              timeout=provider_client.GEMINI_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        usage = {}
+        try:
+            for data in _iter_sse_data(response):
+                chunk = json_provider.loads(data)
+                usage = chunk.get('usageMetadata') or usage # كل جزء يحمل المجموع حتى الآن، فنحتسب الأخير فقط
+                candidates = chunk.get('candidates') or []
+                if not candidates:
+                    block_reason = chunk.get('promptFeedback', {}).get('blockReason')
+                    if block_reason:
+                        raise ValueError(f"Gemini stream blocked: {block_reason}")
+                    continue
+                for part in (candidates[0].get('content') or {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+        finally:
+            metrics.record_usage("gemini", provider_client.GEMINI_CHAT_MODEL,
+                                 usage.get('promptTokenCount'), usage.get('candidatesTokenCount'))
+
+
+def stream_ai_reply(messages_for_api, model, temperature, max_tokens, result):
+    """
+    Yield reply deltas using the same OpenRouter -> Gemini chain as the blocking path.
+
+    A provider is only abandoned if it fails before producing any text; once tokens
+    have been sent to the browser a mid-stream failure ends the reply where it is.
+    `result` is filled with 'used_backup', 'api_source' and 'error'.
+    """
+    providers = []
+    if OPENROUTER_API_KEY:
+        providers.append(("OpenRouter", "openrouter", model, False,
+                          lambda: stream_openrouter_api(messages_for_api, model, temperature, max_tokens)))
+    if GEMINI_API_KEY:
+        providers.append(("Gemini (Backup)", "gemini", provider_client.GEMINI_CHAT_MODEL, True,
+                          lambda: stream_gemini_api(messages_for_api, temperature, max_tokens)))
+
+    for api_source, breaker_name, provider_model, is_backup, open_stream in providers:
+        breaker = circuit_breaker.get_breaker(breaker_name)
+        if not breaker.allow_request():
+            logger.warning(f"{api_source} circuit is open; skipping it for this stream.")
+            continue
+        if is_backup and OPENROUTER_API_KEY:
+            metrics.record_fallback("gemini")
+        produced = False
+        started = time.monotonic()
+        try:
+            for delta in open_stream():
+                if not produced:
+                    produced = True
+                    result['api_source'] = api_source
+                    result['used_backup'] = is_backup
+                    result['error'] = None
+                    logger.info(f"Streaming reply from {api_source} ({model}).")
+                yield delta
+            breaker.record_success(time.monotonic() - started)
+            metrics.observe_provider(breaker_name, provider_model, "success" if produced else "error",
+                                     time.monotonic() - started)
+            if produced:
+                return
+            logger.warning(f"{api_source} stream finished without any text.")
+        except GeneratorExit:
+            breaker.release() # العميل أغلق الاتصال؛ لا يُحتسب على المزود
+            metrics.observe_provider(breaker_name, provider_model, "cancelled", time.monotonic() - started)
+            raise
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error streaming from {api_source}: {e}")
+            breaker.record_error(e, time.monotonic() - started)
+            metrics.observe_provider(breaker_name, provider_model, "error", time.monotonic() - started)
+            result['error'] = result.get('error') or f"خطأ في البث من {api_source}: {e}"
+            if produced:
+                return # لا يمكن التبديل إلى مزود آخر بعد إرسال جزء من الرد
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json_provider.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Wrap an event generator in a streamed `text/event-stream` response."""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # منع الوكلاء (proxies) من تخزين البث مؤقتًا
+    return response
+
+
+def get_offline_response(user_message):
+    """Return the predefined offline reply matching the user message."""
+    metrics.record_fallback("offline")
+    idempotency.discard() # رد احتياطي: إعادة المحاولة بنفس المفتاح يجب أن تصل إلى المزودين من جديد
+    user_msg_lower = user_message.lower()
+    for key, response_text in offline_responses.items():
+        if key.lower() in user_msg_lower:
+            logger.info(f"Matched offline response for key: '{key}'")
+            return response_text
+    logger.info("Using default offline response.")
+    return default_offline_response
+
+
+def stream_chat_events(conversation_id, messages_for_api, model, temperature, max_tokens, user_message, new_conversation_id):
+    """SSE generator for /api/chat; persists the assistant reply when the stream ends or is cancelled."""
+    result = {'used_backup': False, 'api_source': "N/A", 'error': None}
+    reply_parts = []
+    try:
+        yield sse_event('meta', {"id": str(conversation_id), "new_conversation_id": new_conversation_id})
+        for delta in stream_ai_reply(messages_for_api, model, temperature, max_tokens, result):
+            reply_parts.append(delta)
+            yield sse_event('delta', {"content": delta})
+
+        if not reply_parts:
+            result['api_source'] = "Offline Fallback"
+            logger.warning("Both API streams failed. Falling back to predefined offline responses.")
+            offline_reply = get_offline_response(user_message)
+            reply_parts.append(offline_reply)
+            yield sse_event('delta', {"content": offline_reply})
+
+        yield sse_event('done', {"id": str(conversation_id), "used_backup": result['used_backup'],
+                                 "new_conversation_id": new_conversation_id})
+    finally:
+        # يتم الوصول إلى هنا أيضًا عند إغلاق العميل للاتصال (GeneratorExit)، فنحفظ ما وصل من الرد
+        ai_reply = "".join(reply_parts).strip()
+        if ai_reply:
+            try:
+                db_conversation = db.session.get(Conversation, conversation_id)
+                if db_conversation is None:
+                    # حُذفت المحادثة أثناء البث: لا مكان لحفظ الرد
+                    logger.warning(f"Conversation {conversation_id} was deleted while streaming; discarding the reply.")
+                    db.session.rollback()
+                else:
+                    save_message(db_conversation, 'assistant', ai_reply)
+                    db.session.commit()
+                    logger.info(f"Committed streamed reply (from {result['api_source']}) for conversation {conversation_id}")
+            except Exception as e: # لا يجب أن يفلت استثناء من finally أثناء GeneratorExit
+                logger.error(f"Database commit error after streaming reply: {e}", exc_info=True)
+                db.session.rollback()
+
+
+def stream_regenerate_events(conversation_id, old_message_id, messages_for_api, model, temperature, max_tokens):
+    """SSE generator for /api/regenerate; the old reply is only replaced once new text exists."""
+    result = {'used_backup': False, 'api_source': "N/A", 'error': None}
+    reply_parts = []
+    try:
+        for delta in stream_ai_reply(messages_for_api, model, temperature, max_tokens, result):
+            reply_parts.append(delta)
+            yield sse_event('delta', {"content": delta})
+
+        if reply_parts:
+            yield sse_event('done', {"used_backup": result['used_backup']})
+        else:
+            logger.warning(f"Regen: Failed to stream new reply for conv {conversation_id}. Keeping old reply.")
+            idempotency.discard()
+            yield sse_event('error', {"error": result['error'] or "فشل إعادة توليد الرد من جميع المصادر."})
+    finally:
+        ai_reply = "".join(reply_parts).strip()
+        if ai_reply:
+            try:
+                if not replace_assistant_reply(conversation_id, old_message_id, ai_reply):
+                    # الرسالة أو المحادثة كلها حُذفت أثناء البث
+                    logger.warning(f"Regen: Message {old_message_id} was removed while streaming; discarding new reply.")
+                    db.session.rollback()
+                else:
+                    db.session.commit()
+                    logger.info(f"Regen: Committed streamed message (from {result['api_source']}) for conv {conversation_id}")
+            except Exception as e: # لا يجب أن يفلت استثناء من finally أثناء GeneratorExit
+                logger.error(f"Regen: Database commit error after streaming: {e}", exc_info=True)
+                db.session.rollback()
+
+
 # --- مسارات Flask (Routes) ---
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Route for the main chat page."""
     logger.info(f"Serving main page (index.html) requested by {request.remote_addr}")
     # تمرير عنوان التطبيق إلى القالب
     return render_template('index.html', app_title=APP_TITLE)
 
-@app.route('/api/chat', methods=['POST'])
+@bp.route('/api/chat', methods=['POST'])
+@idempotency.idempotent(idempotency_store, 'chat')
 def chat():
     """API route for handling chat messages."""
     try:
-        data = request.json
+        with tracing.span("parse"):
+            data = request.json
         if not data:
             logger.warning("Received empty JSON payload for /api/chat")
             return jsonify({"error": "الطلب غير صالح (بيانات فارغة)"}), 400
 
-        messages_for_api = data.get('history', []) # الواجهة الأمامية ترسل السجل كاملاً
-        if not messages_for_api or not isinstance(messages_for_api, list) or messages_for_api[-1].get('role') != 'user':
-             logger.warning(f"Invalid 'history' received in /api/chat: {messages_for_api}")
-             return jsonify({"error": "تنسيق سجل المحادثة غير صالح أو آخر رسالة ليست للمستخدم"}), 400
-
-        user_message = messages_for_api[-1]['content'].strip()
+        # وضعان للبروتوكول:
+        # - delta: يرسل العميل الرسالة الجديدة فقط ('message') ويُبنى السجل من جدول الرسائل
+        # - full history (للتوافق): يرسل العميل السجل كاملاً ('history')
+        delta_mode = isinstance(data.get('message'), str)
+        if delta_mode:
+            messages_for_api = None # سيُبنى من قاعدة البيانات بعد تحديد المحادثة
+            user_message = data['message'].strip()
+        else:
+            messages_for_api = data.get('history', []) # الواجهة الأمامية ترسل السجل كاملاً
+            if not messages_for_api or not isinstance(messages_for_api, list) or messages_for_api[-1].get('role') != 'user':
+                 logger.warning(f"Invalid 'history' received in /api/chat: {messages_for_api}")
+                 return jsonify({"error": "تنسيق سجل المحادثة غير صالح أو آخر رسالة ليست للمستخدم"}), 400
+            user_message = messages_for_api[-1]['content'].strip()
         model = data.get('model', 'mistralai/mistral-7b-instruct-v0.2') # نموذج افتراضي محدث
         conversation_id_str = data.get('conversation_id') # قد يكون null
         temperature = float(data.get('temperature', 0.7)) # تأكد من تحويله إلى float
         max_tokens = int(data.get('max_tokens', 1024)) # تأكد من تحويله إلى int وزيادة القيمة الافتراضية قليلاً
+        stream = bool(data.get('stream', False)) # البث التدريجي للرد عبر Server-Sent Events
 
         if not user_message:
              logger.warning("Received empty user message content in /api/chat history.")
@@ -281,9 +815,10 @@ def chat():
         if conversation_id_str:
             try:
                 conversation_id = uuid.UUID(conversation_id_str) # تحويل النص إلى UUID
-                # استخدام الأسلوب الحديث للاستعلام
-                stmt = select(Conversation).filter_by(id=conversation_id)
-                db_conversation = db.session.execute(stmt).scalar_one_or_none()
+                # استخدام الأسلوب الحديث للاستعلام (بدون تحميل كل الرسائل عبر selectin)
+                stmt = select(Conversation).options(lazyload(Conversation.messages)).filter_by(id=conversation_id)
+                with tracing.span("lookup"):
+                    db_conversation = db.session.execute(stmt).scalar_one_or_none()
                 if db_conversation:
                     logger.info(f"Found existing conversation: {conversation_id}")
                 else:
@@ -293,7 +828,8 @@ def chat():
                 logger.warning(f"Invalid UUID format received for conversation_id: {conversation_id_str}")
                 conversation_id = None # اعتبرها محادثة جديدة
 
-        if not db_conversation:
+        is_new_conversation = not db_conversation
+        if is_new_conversation:
             conversation_id = uuid.uuid4() # إنشاء UUID جديد
             initial_title = user_message.split('\n')[0][:60] # عنوان أطول قليلاً
             logger.info(f"Creating new conversation with ID: {conversation_id}, title: '{initial_title}'")
@@ -302,18 +838,41 @@ def chat():
             # لا تقم بعمل commit الآن، انتظر حتى نهاية العملية
 
         # --- إضافة رسالة المستخدم (مع منع التكرار البسيط) ---
-        # جلب آخر رسالة محفوظة *لهذه المحادثة*
-        stmt_last_msg = select(Message)\
-                        .filter_by(conversation_id=db_conversation.id)\
-                        .order_by(Message.created_at.desc())\
-                        .limit(1)
-        last_db_message = db.session.execute(stmt_last_msg).scalar_one_or_none()
+        history_rows = []
+        if delta_mode:
+            # سجل المحادثة من قاعدة البيانات: ما بعد الملخص فقط، وبقدر ما تتسع له ميزانية النموذج
+            # (آخر صف هو آخر رسالة، فلا حاجة لاستعلام منفصل)
+            if not is_new_conversation:
+                summary_upto_id = db_conversation.summary_upto_id or 0
+                with tracing.span("history"):
+                    history_rows, history_complete = load_context_tail(
+                        db_conversation.id, summary_upto_id, context_builder.history_budget(model, max_tokens))
+                    if not history_complete:
+                        # السجل تجاوز الميزانية منذ آخر طي: نقرأ كل ما بعد الملخص مرة واحدة ليُطوى فيه
+                        # (بعد الطي يعود الباقي تحت الميزانية، فتكفي القراءة الأولى في الطلبات التالية)
+                        history_rows, history_complete = load_context_tail(
+                            db_conversation.id, summary_upto_id, float('inf'))
+                if write_behind.ENABLED:
+                    history_rows += write_behind_queue.pending(db_conversation.id)
+            last_db_message = history_rows[-1] if history_rows else None
+        else:
+            # جلب آخر رسالة محفوظة *لهذه المحادثة*
+            stmt_last_msg = select(Message)\
+                            .filter_by(conversation_id=db_conversation.id)\
+                            .order_by(Message.created_at.desc())\
+                            .limit(1)
+            pending = write_behind_queue.pending(db_conversation.id) if write_behind.ENABLED else []
+            with tracing.span("dedupe"):
+                last_db_message = pending[-1] if pending else db.session.execute(stmt_last_msg).scalar_one_or_none()
 
         # التحقق من التكرار (إذا كانت نفس الرسالة ونفس الدور ومنذ فترة قصيرة)
-        time_since_last = (datetime.now(timezone.utc) - last_db_message.created_at).total_seconds() if last_db_message else float('inf')
-        if not last_db_message or not (last_db_message.role == 'user' and last_db_message.content == user_message and time_since_last < 10): # زد الوقت قليلاً
+        time_since_last = (datetime.now(timezone.utc) - as_utc(last_db_message.created_at)).total_seconds() if last_db_message else float('inf')
+        is_duplicate = bool(last_db_message) and last_db_message.role == 'user' and last_db_message.content == user_message and time_since_last < 10 # زد الوقت قليلاً
+        if not is_duplicate:
             logger.debug(f"Adding user message to DB for conversation {db_conversation.id}")
-            user_msg_db = db_conversation.add_message('user', user_message)
+            if write_behind.ENABLED and is_new_conversation:
+                db.session.commit() # صف المحادثة يجب أن يُكتب قبل رسائلها المؤجلة
+            user_msg_db = save_message(db_conversation, 'user', user_message)
             # قد نحتاج لعمل flush للحصول على معرف الرسالة إذا احتجناه، لكن لا يبدو ضروريًا الآن
             # db.session.flush([user_msg_db])
         else:
@@ -321,104 +880,44 @@ def chat():
              # إذا كانت مكررة، استخدم آخر رسالة مستخدم موجودة كمرجع
              user_msg_db = last_db_message
 
-        # --- استدعاء واجهات برمجة التطبيقات (API Calls) ---
-        ai_reply = None
-        error_message = None
-        used_backup = False
-        api_source = "N/A" # لتتبع مصدر الرد
+        if delta_mode:
+            messages_for_api = [{"id": row.id, "role": row.role, "content": row.content} for row in history_rows]
+            if not is_duplicate: # الرسالة المكررة موجودة أصلاً في آخر السجل
+                messages_for_api.append({"role": "user", "content": user_message})
+            logger.debug(f"Rebuilt history from DB for conversation {db_conversation.id}: {len(messages_for_api)} messages")
+
+        # --- ملاءمة السجل لميزانية الرموز (مع الملخص المتراكم عند توفر سجل قاعدة البيانات) ---
+        with tracing.span("context"): # يشمل تحديث الملخص إن احتاج السجل إلى طي
+            messages_for_api = context_builder.build_context(messages_for_api, model, max_tokens,
+                                                             conversation=db_conversation if delta_mode else None,
+                                                             summarize=summarize_history)
+
+        if stream:
+            # حفظ المحادثة ورسالة المستخدم الآن لتحرير اتصال قاعدة البيانات طوال مدة البث
+            with tracing.span("commit"):
+                db.session.commit()
+            new_conversation_id = str(conversation_id) if not conversation_id_str else None
+            logger.info(f"Streaming reply for conversation {db_conversation.id}")
+            return sse_response(stream_chat_events(db_conversation.id, messages_for_api, model, temperature,
+                                                   max_tokens, user_message, new_conversation_id))
 
-        # 1. محاولة OpenRouter
-        if OPENROUTER_API_KEY:
-            api_source = "OpenRouter"
-            try:
-                logger.debug(f"Sending request to OpenRouter with model: {model}, history size: {len(messages_for_api)}")
-                openrouter_url = "https://openrouter.ai/api/v1/chat/completions"
-                headers = {
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json", # إضافة Content-Type
-                    "HTTP-Referer": APP_URL,
-                    "X-Title": APP_TITLE,
-                }
-                payload = {
-                    "model": model,
-                    "messages": messages_for_api,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                }
-                response = requests.post(url=openrouter_url, headers=headers, json=payload, timeout=45)
-                response.raise_for_status() # Check for 4xx/5xx errors
-                api_response = response.json()
-
-                # التحقق من صحة الرد
-                if api_response.get('choices') and api_response['choices'][0].get('message'):
-                    ai_reply = api_response['choices'][0]['message'].get('content', '').strip()
-                    if not ai_reply:
-                         logger.warning(f"OpenRouter returned an empty content string for model {model}. Response: {api_response}")
-                         # لا تعتبره خطأ فادحًا، قد يكون بسبب مرشحات المحتوى
-                    else:
-                        logger.info(f"Received reply from OpenRouter ({model}).")
-                    # تسجيل التكلفة والاستخدام إذا كانت متوفرة
-                    if 'usage' in api_response: logger.info(f"OpenRouter usage: {api_response['usage']}")
-                else:
-                    logger.error(f"OpenRouter response structure invalid: {api_response}")
-                    error_message = "استجابة غير متوقعة من OpenRouter"
-
-            except requests.exceptions.Timeout:
-                logger.error("OpenRouter API request timed out.")
-                error_message = "استجابة OpenRouter استغرقت وقتاً طويلاً"
-            except requests.exceptions.HTTPError as e:
-                error_body = e.response.text
-                logger.error(f"OpenRouter API HTTP error ({e.response.status_code}): {error_body}")
-                try:
-                     error_json = e.response.json()
-                     error_details = error_json.get("error", {}).get("message", error_body)
-                except json.JSONDecodeError:
-                     error_details = error_body[:200]
-                error_message = f"خطأ HTTP من OpenRouter: {error_details}"
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error calling OpenRouter API: {e}", exc_info=True)
-                error_message = f"خطأ في الاتصال بـ OpenRouter: {e}"
-            except Exception as e:
-                logger.error(f"Unexpected error processing OpenRouter response: {e}", exc_info=True)
-                error_message = f"خطأ غير متوقع في معالجة استجابة OpenRouter: {e}"
-
-        # 2. محاولة Gemini كاحتياطي إذا فشل OpenRouter
-        if not ai_reply and GEMINI_API_KEY:
-            api_source = "Gemini (Backup)"
-            logger.info("OpenRouter failed or unavailable. Trying Gemini API as backup...")
-            # نمرر نفس قائمة الرسائل التي أُرسلت إلى OpenRouter
-            ai_reply, backup_error = call_gemini_api(messages_for_api, temperature, max_tokens)
-            if ai_reply:
-                used_backup = True
-                error_message = None # مسح خطأ OpenRouter إذا نجح Gemini
-                logger.info("Received reply from Gemini (backup).")
-            else:
-                logger.error(f"Gemini backup also failed: {backup_error}")
-                # احتفظ بخطأ OpenRouter الأصلي إذا كان موجودًا، أو استخدم خطأ Gemini
-                error_message = error_message or f"فشل النموذج الاحتياطي (Gemini): {backup_error}"
+        # --- استدعاء واجهات برمجة التطبيقات (API Calls) ---
+        # 1. و 2. محاولة OpenRouter ثم Gemini كاحتياطي (بالتتابع أو بالتحوّط حسب الإعدادات)
+        ai_reply, error_message, used_backup, api_source = generate_ai_reply(messages_for_api, model, temperature, max_tokens)
 
         # 3. إذا فشل كلاهما، استخدم الردود المحددة مسبقًا
         if not ai_reply:
             api_source = "Offline Fallback"
             logger.warning("Both API calls failed. Falling back to predefined offline responses.")
-            matched_offline = False
-            user_msg_lower = user_message.lower()
-            for key, response_text in offline_responses.items():
-                if key.lower() in user_msg_lower:
-                    ai_reply = response_text
-                    matched_offline = True
-                    logger.info(f"Matched offline response for key: '{key}'")
-                    break
-            if not matched_offline:
-                ai_reply = default_offline_response
-                logger.info("Using default offline response.")
+            ai_reply = get_offline_response(user_message)
 
         # --- حفظ رد الـ AI وعمل Commit ---
         if ai_reply:
             logger.debug(f"Adding assistant reply (from {api_source}) to DB for conversation {db_conversation.id}")
-            assistant_msg_db = db_conversation.add_message('assistant', ai_reply)
+            assistant_msg_db = save_message(db_conversation, 'assistant', ai_reply)
             try:
-                db.session.commit() # حفظ كل التغييرات (المحادثة الجديدة، رسالة المستخدم، رسالة المساعد)
+                with tracing.span("commit"):
+                    db.session.commit() # حفظ كل التغييرات (المحادثة الجديدة، رسالة المستخدم، رسالة المساعد)
                 logger.info(f"Successfully committed messages for conversation {db_conversation.id}")
                 # إعادة الرد إلى الواجهة الأمامية
                 return jsonify({
@@ -450,26 +949,67 @@ def chat():
 
 # --- نقاط نهاية إدارة المحادثات ---
 
-@app.route('/api/conversations', methods=['GET'])
+def encode_cursor(updated_at, conversation_id):
+    """Opaque keyset cursor for the conversation list."""
+    raw = f"{updated_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError on malformed input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, conversation_id = raw.split("|", 1)
+        return datetime.fromisoformat(updated_at), uuid.UUID(conversation_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+@bp.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    """API route to get a list of all conversations (simplified)."""
+    """
+    API route to list conversations, newest first, one page at a time.
+
+    Query params: `limit` (default CONVERSATIONS_PAGE_SIZE) and `cursor`
+    (the `next_cursor` of the previous page). Returns
+    {"conversations": [...], "next_cursor": str | None}.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', CONVERSATIONS_PAGE_SIZE)), 1), CONVERSATIONS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "قيمة limit أو cursor غير صالحة"}), 400
+
     try:
-        logger.info("Fetching conversation list...")
-        # الاستعلام عن المحادثات مرتبة حسب آخر تحديث
-        stmt = select(Conversation).order_by(desc(Conversation.updated_at))
-        conversations = db.session.execute(stmt).scalars().all()
+        # الأعمدة المطلوبة فقط: بدون تحميل كائنات المحادثة أو رسائلها
+        stmt = (
+            select(Conversation.id, Conversation.title, Conversation.updated_at, Conversation.message_count,
+                   Conversation.last_message_preview, Conversation.last_role)
+            .order_by(desc(Conversation.updated_at), desc(Conversation.id))
+            .limit(limit + 1) # صف إضافي لمعرفة وجود صفحة تالية
+        )
+        if after:
+            stmt = stmt.where(tuple_(Conversation.updated_at, Conversation.id) < tuple_(*after))
+        rows = db.session.execute(stmt).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
 
-        # تحويل القائمة إلى تنسيق JSON المطلوب
         conversations_list = [
             {
-                "id": str(conv.id),
-                "title": conv.title,
-                "updated_at": conv.updated_at.isoformat()
+                "id": row.id,
+                "title": row.title,
+                "updated_at": row.updated_at,
+                "message_count": row.message_count,
+                "last_message_preview": row.last_message_preview,
+                "last_role": row.last_role,
             }
-            for conv in conversations
+            for row in rows
         ]
-        logger.info(f"Retrieved {len(conversations_list)} conversations.")
-        return jsonify(conversations_list)
+        return jsonify({"conversations": conversations_list, "next_cursor": next_cursor})
     except SQLAlchemyError as e:
         logger.error(f"Database error getting conversations list: {e}", exc_info=True)
         return jsonify({"error": f"خطأ في استرجاع قائمة المحادثات من قاعدة البيانات: {e}"}), 500
@@ -478,9 +1018,10 @@ def get_conversations():
         return jsonify({"error": f"خطأ غير متوقع في استرجاع المحادثات: {e}"}), 500
 
 
-@app.route('/api/conversations/<uuid:conversation_id>', methods=['GET'])
+@bp.route('/api/conversations/<uuid:conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     """API route to get a specific conversation with all its messages."""
+    flush_pending_writes()
     # استخدام محول <uuid:> في المسار للتحقق من التنسيق وتمرير كائن UUID
     try:
         logger.info(f"Fetching conversation details for ID: {conversation_id}")
@@ -503,23 +1044,204 @@ def get_conversation(conversation_id):
         return jsonify({"error": f"خطأ غير متوقع في استرجاع المحادثة: {e}"}), 500
 
 
-@app.route('/api/conversations/<uuid:conversation_id>', methods=['DELETE'])
+def message_row_dict(row, conversation_id):
+    """
+    Like Message.to_dict() but for a Core row (id, role, content,
+    content_compressed, created_at); UUIDs and datetimes are left for json_provider.
+    """
+    return {
+        "id": row.id,
+        "conversation_id": conversation_id,
+        "role": row.role,
+        "content": message_compression.stored_text(row.content, row.content_compressed),
+        "created_at": row.created_at
+    }
+
+
+@bp.route('/api/conversations/<uuid:conversation_id>/messages', methods=['GET'])
+def get_conversation_messages(conversation_id):
+    """
+    API route to page through a conversation's messages by message id.
+
+    Query params (at most one cursor), plus `limit`:
+      before=<id>  the `limit` messages just before that id (backfill)
+      after=<id>   the `limit` messages just after that id
+      since=<id>   all messages after that id, for incremental sync
+                   (capped at MESSAGES_MAX_PAGE_SIZE)
+      (none)       the newest `limit` messages (the tail)
+    Messages are returned oldest first; `has_more` says whether more exist
+    in the requested direction.
+    """
+    flush_pending_writes()
+    try:
+        cursors = {name: int(request.args[name]) for name in ('before', 'after', 'since') if name in request.args}
+        default_limit = MESSAGES_MAX_PAGE_SIZE if 'since' in cursors else MESSAGES_PAGE_SIZE
+        limit = min(max(int(request.args.get('limit', default_limit)), 1), MESSAGES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "قيم before/after/since/limit يجب أن تكون أعدادًا صحيحة"}), 400
+    if len(cursors) > 1:
+        return jsonify({"error": "استخدم واحدًا فقط من before أو after أو since"}), 400
+
+    try:
+        exists = db.session.execute(select(Conversation.id).filter_by(id=conversation_id)).first()
+        if not exists:
+            return jsonify({"error": "المحادثة المطلوبة غير موجودة"}), 404
+
+        stmt = select(Message.id, Message.role, Message.content, Message.created_at, Message.content_compressed).where(
+            Message.conversation_id == conversation_id)
+        if 'after' in cursors or 'since' in cursors:
+            # صفحة للأمام: الأقدم أولاً مباشرة
+            stmt = stmt.where(Message.id > cursors.get('after', cursors.get('since'))).order_by(Message.id)
+            newest_first = False
+        else:
+            # الذيل أو صفحة للخلف: الأحدث أولاً ثم يُعكس الترتيب
+            if 'before' in cursors:
+                stmt = stmt.where(Message.id < cursors['before'])
+            stmt = stmt.order_by(desc(Message.id))
+            newest_first = True
+        rows = db.session.execute(stmt.limit(limit + 1)).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newest_first:
+            rows.reverse()
+
+        return jsonify({
+            "conversation_id": conversation_id,
+            "messages": [message_row_dict(row, conversation_id) for row in rows],
+            "has_more": has_more
+        })
+    except SQLAlchemyError as e:
+        logger.error(f"Database error getting messages of conversation {conversation_id}: {e}", exc_info=True)
+        return jsonify({"error": f"خطأ قاعدة بيانات عند استرجاع رسائل المحادثة: {e}"}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error getting messages of conversation {conversation_id}: {e}", exc_info=True)
+        return jsonify({"error": f"خطأ غير متوقع في استرجاع رسائل المحادثة: {e}"}), 500
+
+
+@bp.route('/api/conversations/<uuid:conversation_id>/export', methods=['GET'])
+def export_conversation(conversation_id):
+    """
+    API route to download a conversation as JSON (`format=json`, the default)
+    or NDJSON (`format=ndjson`), streamed in batches so memory stays flat
+    regardless of the conversation's size.
+    """
+    flush_pending_writes()
+    fmt = request.args.get('format', 'json')
+    if fmt not in conversation_export.FORMATS:
+        return jsonify({"error": "صيغة التصدير يجب أن تكون json أو ndjson"}), 400
+
+    try:
+        header_row = db.session.execute(
+            select(Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at)
+            .filter_by(id=conversation_id)
+        ).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error exporting conversation {conversation_id}: {e}", exc_info=True)
+        return jsonify({"error": f"خطأ قاعدة بيانات عند تصدير المحادثة: {e}"}), 500
+    if not header_row:
+        return jsonify({"error": "المحادثة المطلوبة غير موجودة"}), 404
+
+    header = {
+        "id": header_row.id,
+        "title": header_row.title,
+        "created_at": header_row.created_at,
+        "updated_at": header_row.updated_at,
+    }
+    engine = db.engine # يُقرأ هنا لأن المولّد يعمل بعد انتهاء دالة العرض
+
+    def message_batches():
+        stmt = (
+            select(Message.id, Message.role, Message.content, Message.created_at, Message.content_compressed)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.id)
+        )
+        # اتصال مستقل بمؤشر من جهة الخادم: لا تُحمَّل كل الصفوف في الذاكرة دفعة واحدة
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=conversation_export.EXPORT_BATCH_SIZE).execute(stmt)
+            for partition in result.partitions():
+                yield [
+                    {
+                        "id": row.id,
+                        "conversation_id": header["id"],
+                        "role": row.role,
+                        "content": message_compression.stored_text(row.content, row.content_compressed),
+                        "created_at": row.created_at
+                    }
+                    for row in partition
+                ]
+
+    logger.info(f"Exporting conversation {conversation_id} as {fmt}")
+    response = Response(
+        stream_with_context(conversation_export.iter_export(fmt, header, message_batches())),
+        mimetype=conversation_export.FORMATS[fmt],
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="conversation-{conversation_id}.{fmt}"'
+    return response
+
+
+@bp.route('/api/search', methods=['GET'])
+def search_messages():
+    """
+    API route for ranked full-text search over stored messages.
+
+    Query params: `q` (required), `conversation_id` (optional filter),
+    `limit` (default SEARCH_PAGE_SIZE) and `offset`. Returns
+    {"results": [...], "next_offset": int | None}; each result carries an
+    HTML snippet with the matching words in <mark>.
+    """
+    query = request.args.get('q', '').strip()
+    if not search.tokens(query):
+        return jsonify({"error": "نص البحث (q) مطلوب"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        conversation_id = uuid.UUID(request.args['conversation_id']) if request.args.get('conversation_id') else None
+    except ValueError:
+        return jsonify({"error": "قيم limit أو offset أو conversation_id غير صالحة"}), 400
+
+    flush_pending_writes()
+    try:
+        rows = search_index.search(db.session.connection(), query, limit + 1, offset, conversation_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error searching messages: {e}", exc_info=True)
+        return jsonify({"error": f"خطأ قاعدة بيانات أثناء البحث: {e}"}), 500
+
+    query_tokens = search.tokens(query)
+    return jsonify({
+        "results": [search_result_dict(row, query_tokens) for row in rows[:limit]],
+        "next_offset": offset + limit if len(rows) > limit else None
+    })
+
+
+def search_result_dict(row, query_tokens):
+    """One /api/search result: the message fields of message_row_dict, with a highlighted snippet instead of the text."""
+    message = message_row_dict(row, row.conversation_id)
+    return {
+        "message_id": message["id"],
+        "conversation_id": message["conversation_id"],
+        "conversation_title": row.title,
+        "role": message["role"],
+        "created_at": message["created_at"],
+        "snippet": search.snippet(message["content"], query_tokens),
+        "rank": round(row.rank, 4)
+    }
+
+
+@bp.route('/api/conversations/<uuid:conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
     """API route to delete a specific conversation."""
+    flush_pending_writes()
     try:
         logger.info(f"Attempting to delete conversation with ID: {conversation_id}")
-        # الاستعلام عن المحادثة المراد حذفها
-        stmt = select(Conversation).filter_by(id=conversation_id)
-        conversation = db.session.execute(stmt).scalar_one_or_none()
-
-        if not conversation:
+        deleted, messages_deleted = delete_conversations([conversation_id])
+        if not deleted:
+            db.session.rollback()
             logger.warning(f"Attempted to delete non-existent conversation: {conversation_id}")
             return jsonify({"error": "المحادثة المطلوب حذفها غير موجودة"}), 404
 
-        # حذف المحادثة (سيتم حذف الرسائل تلقائيًا بسبب cascade)
-        db.session.delete(conversation)
         db.session.commit()
-        logger.info(f"Successfully deleted conversation: {conversation_id}")
+        logger.info(f"Successfully deleted conversation: {conversation_id} ({messages_deleted} messages)")
         return jsonify({"success": True, "message": "تم حذف المحادثة وجميع رسائلها بنجاح"})
 
     except SQLAlchemyError as e:
@@ -532,7 +1254,35 @@ def delete_conversation(conversation_id):
         return jsonify({"error": f"خطأ غير متوقع أثناء حذف المحادثة: {e}"}), 500
 
 
-@app.route('/api/conversations/<uuid:conversation_id>/title', methods=['PUT'])
+@bp.route('/api/conversations/purge', methods=['POST'])
+def purge_old_conversations():
+    """
+    Admin API route deleting conversations not updated for `older_than_days`
+    days, in batches. Requires the ADMIN_API_TOKEN in an `X-Admin-Token` header.
+    """
+    if not ADMIN_API_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_API_TOKEN:
+        return jsonify({"error": "غير مصرح بهذه العملية"}), 403
+    data = request.json or {}
+    try:
+        older_than_days = float(data['older_than_days'])
+        batch_size = int(data.get('batch_size', PURGE_BATCH_SIZE))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "older_than_days مطلوب ويجب أن يكون رقمًا"}), 400
+    if older_than_days < 1 or not 1 <= batch_size <= 10000:
+        return jsonify({"error": "older_than_days يجب ألا يقل عن 1 و batch_size بين 1 و 10000"}), 400
+
+    flush_pending_writes()
+    try:
+        conversations_deleted, messages_deleted = purge_conversations(older_than_days, batch_size)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error purging conversations: {e}", exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": f"خطأ قاعدة بيانات أثناء حذف المحادثات القديمة: {e}"}), 500
+    return jsonify({"success": True, "deleted_conversations": conversations_deleted,
+                    "deleted_messages": messages_deleted})
+
+
+@bp.route('/api/conversations/<uuid:conversation_id>/title', methods=['PUT'])
 def update_conversation_title(conversation_id):
     """API route to update the title of a specific conversation."""
     try:
@@ -580,11 +1330,14 @@ def update_conversation_title(conversation_id):
         return jsonify({"error": f"خطأ غير متوقع أثناء تحديث العنوان: {e}"}), 500
 
 
-@app.route('/api/regenerate', methods=['POST'])
+@bp.route('/api/regenerate', methods=['POST'])
+@idempotency.idempotent(idempotency_store, 'regenerate')
 def regenerate_response():
     """API route for regenerating the last AI response."""
+    flush_pending_writes()
     try:
-        data = request.json
+        with tracing.span("parse"):
+            data = request.json
         if not data:
              return jsonify({"error": "الطلب غير صالح (بيانات فارغة)"}), 400
 
@@ -592,6 +1345,7 @@ def regenerate_response():
         model = data.get('model', 'mistralai/mistral-7b-instruct-v0.2')
         temperature = float(data.get('temperature', 0.7))
         max_tokens = int(data.get('max_tokens', 1024))
+        stream = bool(data.get('stream', False))
 
         if not conversation_id_str:
             return jsonify({"error": "معرف المحادثة مطلوب لإعادة التوليد"}), 400
@@ -603,83 +1357,55 @@ def regenerate_response():
 
         logger.info(f"Received regenerate request for conversation: {conversation_id}, using model: {model}")
 
-        # --- الحصول على المحادثة والرسائل ---
-        # استخدام joinload لتحميل الرسائل بكفاءة أكبر هنا
-        stmt = select(Conversation).options(relationship(Conversation.messages)).filter_by(id=conversation_id)
-        conversation = db.session.execute(stmt).scalar_one_or_none()
+        # --- الحصول على المحادثة وآخر رسالة فقط ---
+        stmt = select(Conversation).options(lazyload(Conversation.messages)).filter_by(id=conversation_id)
+        with tracing.span("lookup"):
+            conversation = db.session.execute(stmt).scalar_one_or_none()
 
         if not conversation:
             return jsonify({"error": "المحادثة المطلوبة لإعادة التوليد غير موجودة"}), 404
 
-        # الرسائل مرتبة بالفعل حسب created_at بفضل order_by في العلاقة
-        messages = conversation.messages
+        with tracing.span("lookup"):
+            last_message = db.session.execute(
+                select(Message.id, Message.role).where(Message.conversation_id == conversation_id)
+                .order_by(Message.id.desc()).limit(1)
+            ).first()
 
-        if not messages:
+        if not last_message:
             return jsonify({"error": "لا توجد رسائل في المحادثة لإعادة التوليد"}), 400
 
-        # --- حذف آخر رسالة للـ AI ---
-        last_message = messages[-1]
         if last_message.role != 'assistant':
             logger.warning(f"Last message in conv {conversation_id} is not from assistant. Cannot regenerate.")
             return jsonify({"error": "آخر رسالة ليست من المساعد، لا يمكن إعادة التوليد."}), 400
 
-        logger.debug(f"Deleting last assistant message (ID: {last_message.id}) for regeneration.")
-        # حذف الرسالة من الجلسة (سيتم حذفها من قاعدة البيانات عند الـ commit)
-        db.session.delete(last_message)
-        # إزالتها أيضًا من القائمة المحلية للرسائل
-        messages_for_api = [msg.to_dict() for msg in messages[:-1]] # استبعاد الرسالة الأخيرة المحذوفة
-
-        if not messages_for_api:
+        # السياق: الرسائل بعد الملخص وقبل الرد القديم، بقدر ما تتسع له ميزانية النموذج
+        with tracing.span("history"):
+            remaining, complete = load_context_tail(conversation_id, conversation.summary_upto_id or 0,
+                                                    context_builder.history_budget(model, max_tokens),
+                                                    before_id=last_message.id)
+        if not remaining:
             logger.warning(f"No user messages left after removing assistant message in conv {conversation_id}.")
-            db.session.rollback() # تراجع عن الحذف
             return jsonify({"error": "لا توجد رسائل متبقية لإرسالها بعد حذف رد المساعد"}), 400
 
-        # --- إعادة استدعاء واجهات برمجة التطبيقات ---
-        ai_reply = None
-        error_message = None
-        used_backup = False
-        api_source = "N/A"
+        # إذا لم تُقرأ كل الرسائل بعد الملخص فلا نطوي ما قُرئ فيه، وإلا سقط ما بينهما من الملخص
+        with tracing.span("context"):
+            messages_for_api = context_builder.build_context(
+                [{"id": row.id, "role": row.role, "content": row.content} for row in remaining],
+                model, max_tokens, conversation=conversation, summarize=summarize_history if complete else None)
 
-        # 1. محاولة OpenRouter
-        if OPENROUTER_API_KEY:
-            api_source = "OpenRouter (Regen)"
-            try:
-                logger.debug(f"Regen: Sending request to OpenRouter with model: {model}, history size: {len(messages_for_api)}")
-                # (نفس كود استدعاء OpenRouter كما في /api/chat)
-                openrouter_url = "https://openrouter.ai/api/v1/chat/completions"
-                headers = { "Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json", "HTTP-Referer": APP_URL, "X-Title": APP_TITLE }
-                payload = { "model": model, "messages": messages_for_api, "temperature": temperature, "max_tokens": max_tokens }
-                response = requests.post(url=openrouter_url, headers=headers, json=payload, timeout=45)
-                response.raise_for_status()
-                api_response = response.json()
-                if api_response.get('choices') and api_response['choices'][0].get('message'):
-                    ai_reply = api_response['choices'][0]['message'].get('content', '').strip()
-                    if ai_reply: logger.info(f"Regen: Received reply from OpenRouter ({model}).")
-                else:
-                     logger.error(f"Regen: OpenRouter response structure invalid: {api_response}")
-                     error_message = "استجابة غير متوقعة من OpenRouter أثناء إعادة التوليد"
-            except Exception as e: # التقاط جميع الأخطاء من استدعاء API
-                logger.error(f"Regen: Error calling OpenRouter: {e}", exc_info=True)
-                # قم بتحليل الخطأ وتعيين error_message كما في /api/chat
-                if isinstance(e, requests.exceptions.Timeout): error_message = "مهلة OpenRouter أثناء إعادة التوليد"
-                elif isinstance(e, requests.exceptions.HTTPError): error_message = f"خطأ HTTP من OpenRouter أثناء إعادة التوليد: {e.response.status_code}"
-                else: error_message = f"خطأ OpenRouter أثناء إعادة التوليد: {e}"
-
-
-        # 2. محاولة Gemini كاحتياطي
-        if not ai_reply and GEMINI_API_KEY:
-            api_source = "Gemini (Backup Regen)"
-            logger.info("Regen: OpenRouter failed. Trying Gemini backup...")
-            # تحويل الرسائل المتبقية إلى تنسيق Gemini
-            gemini_api_messages = [{"role": msg['role'], "content": msg['content']} for msg in messages_for_api]
-            ai_reply, backup_error = call_gemini_api(gemini_api_messages, temperature, max_tokens)
-            if ai_reply:
-                used_backup = True
-                error_message = None
-                logger.info("Regen: Received reply from Gemini (backup).")
-            else:
-                 logger.error(f"Regen: Gemini backup also failed: {backup_error}")
-                 error_message = error_message or f"فشل إعادة التوليد بالنموذج الاحتياطي: {backup_error}"
+        if stream:
+            # الرد القديم يبقى في قاعدة البيانات حتى يصل نص جديد فعلاً
+            with tracing.span("commit"):
+                db.session.commit() # حفظ الملخص إن تحدّث، وإنهاء معاملة القراءة قبل بدء البث
+            logger.info(f"Regen: Streaming new reply for conversation {conversation_id}")
+            return sse_response(stream_regenerate_events(conversation_id, last_message.id, messages_for_api,
+                                                         model, temperature, max_tokens))
+
+        # --- إعادة استدعاء واجهات برمجة التطبيقات ---
+        # 1. و 2. محاولة OpenRouter ثم Gemini كاحتياطي
+        ai_reply, error_message, used_backup, api_source = generate_ai_reply(messages_for_api, model, temperature, max_tokens)
+        if ai_reply:
+            logger.info(f"Regen: Received reply from {api_source}.")
 
         # 3. استخدام الردود المحددة مسبقًا (قد لا يكون منطقيًا في إعادة التوليد، لكن كاحتياطي أخير)
         if not ai_reply:
@@ -693,26 +1419,29 @@ def regenerate_response():
             error_message = error_message or "فشل إعادة توليد الرد من جميع المصادر."
 
 
-        # --- حفظ الرد الجديد أو التراجع ---
+        # --- استبدال الرد القديم أو الإبقاء عليه ---
         if ai_reply:
-            logger.debug(f"Regen: Adding new assistant reply (from {api_source}) to DB for conv {conversation_id}")
-            new_assistant_msg = conversation.add_message('assistant', ai_reply)
+            logger.debug(f"Regen: Replacing assistant message {last_message.id} (from {api_source}) for conv {conversation_id}")
             try:
-                db.session.commit() # حفظ حذف الرسالة القديمة وإضافة الجديدة
+                with tracing.span("commit"):
+                    swapped = replace_assistant_reply(conversation_id, last_message.id, ai_reply)
+                    if swapped:
+                        db.session.commit() # الملخص (إن تحدّث) والرد الجديد في معاملة واحدة
+                if not swapped:
+                    db.session.rollback()
+                    return jsonify({"error": "حُذف رد المساعد أثناء إعادة التوليد"}), 409
                 logger.info(f"Regen: Successfully committed regenerated message for conv {conversation_id}")
                 return jsonify({
                     "content": ai_reply,
                     "used_backup": used_backup,
-                    # قد ترغب في إرسال معرف الرسالة الجديدة أيضًا
-                    # "new_message_id": new_assistant_msg.id
                 })
             except SQLAlchemyError as e:
                  logger.error(f"Regen: Database commit error: {e}", exc_info=True)
-                 db.session.rollback() # تراجع عن كل شيء (الحذف والإضافة)
+                 db.session.rollback()
                  return jsonify({"error": f"حدث خطأ أثناء حفظ الرد المُعاد توليده: {e}"}), 500
         else:
-            # فشلت إعادة التوليد، تراجع عن حذف الرسالة الأصلية
-            logger.warning(f"Regen: Failed to generate new reply for conv {conversation_id}. Rolling back deletion.")
+            # فشلت إعادة التوليد، الرد الأصلي لم يُمس
+            logger.warning(f"Regen: Failed to generate new reply for conv {conversation_id}. Keeping old reply.")
             db.session.rollback()
             return jsonify({"error": error_message or "فشل إعادة توليد الاستجابة"}), 500
 
@@ -724,8 +1453,65 @@ def regenerate_response():
              logger.error(f"Error during rollback after critical regenerate error: {rollback_err}", exc_info=True)
         return jsonify({"error": f"خطأ داخلي خطير أثناء إعادة التوليد: {e}"}), 500
 
+# --- نقاط نهاية الترجمة ---
+
+@bp.route('/translation')
+def translation_page():
+    """Route for the translation page."""
+    return render_template('translation.html', app_title=APP_TITLE)
+
+
+@bp.route('/api/translation/languages', methods=['GET'])
+def get_translation_languages():
+    """API route listing the supported translation languages."""
+    return jsonify(translation_service.get_supported_languages())
+
+
+@bp.route('/api/translation/translate', methods=['POST'])
+def translate():
+    """API route for translating a single text."""
+    data = request.json
+    if not data or not isinstance(data.get('text'), str):
+        return jsonify({"success": False, "error": "النص المراد ترجمته مطلوب"}), 400
+
+    result = translation_service.translate_text(
+        data['text'],
+        source_lang=data.get('source_lang', 'auto'),
+        target_lang=data.get('target_lang', 'ar'),
+    )
+    return jsonify(result)
+
+
+@bp.route('/api/translation/batch', methods=['POST'])
+def translate_batch():
+    """API route for translating many segments in as few model calls as possible."""
+    data = request.json
+    segments = data.get('segments') if data else None
+    if not isinstance(segments, list) or not segments or not all(isinstance(seg, str) for seg in segments):
+        return jsonify({"success": False, "error": "قائمة المقاطع (segments) مطلوبة ويجب أن تحتوي نصوصًا"}), 400
+    if len(segments) > 500:
+        return jsonify({"success": False, "error": "الحد الأقصى 500 مقطع في الطلب الواحد"}), 400
+
+    result = translation_service.translate_batch(
+        segments,
+        source_lang=data.get('source_lang', 'auto'),
+        target_lang=data.get('target_lang', 'ar'),
+    )
+    return jsonify(result)
+
+
+# --- نقطة نهاية حالة الخدمة ---
+@bp.route('/api/stats', methods=['GET'])
+def get_stats():
+    """API route exposing runtime health counters (circuit breakers, translation cache, write-behind queue)."""
+    return jsonify({
+        "providers": circuit_breaker.snapshot_all(),
+        "translation_cache": translation_service.cache.stats(),
+        "write_behind": write_behind_queue.stats() if write_behind.ENABLED else {"enabled": False},
+    })
+
 # --- معالجات الأخطاء العامة ---
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     if request.path.startswith('/api/'):
         logger.warning(f"404 Not Found for API route: {request.path} from {request.remote_addr}")
@@ -734,7 +1520,7 @@ def not_found_error(error):
     # تأكد من وجود 'templates/404.html' أو قدم رسالة بسيطة
     return render_template('error.html', error_code=404, error_message="الصفحة غير موجودة"), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     original_exception = getattr(error, 'original_exception', error)
     logger.error(f"500 Internal Server Error for {request.path} from {request.remote_addr}: {original_exception}", exc_info=True)
@@ -749,7 +1535,7 @@ def internal_error(error):
     # تأكد من وجود 'templates/500.html' أو 'templates/error.html'
     return render_template('error.html', error_code=500, error_message="حدث خطأ داخلي في الخادم"), 500
 
-@app.errorhandler(Exception) # معالج عام لأي استثناءات أخرى
+@bp.app_errorhandler(Exception) # معالج عام لأي استثناءات أخرى
 def handle_exception(e):
      # التعامل مع أخطاء HTTP التي قد لا تكون 500
      if isinstance(e, requests.exceptions.HTTPError):
@@ -783,41 +1569,184 @@ def handle_exception(e):
          return render_template('error.html', error_code=500, error_message="حدث خطأ غير متوقع."), 500
 
 
-# --- إنشاء جداول قاعدة البيانات عند بدء التشغيل ---
-# هذا ضروري ليعمل التطبيق عند تشغيله لأول مرة على Render أو محليًا
-def initialize_database():
+# --- إنشاء/ترقية مخطط قاعدة البيانات (مرة واحدة قبل بدء العمال، وليس عند الاستيراد) ---
+def migrate_database(app):
+    """
+    Apply pending schema migrations for `app`, then close the pooled
+    connections so a forking server does not hand them to its workers.
+    """
     with app.app_context():
-        logger.info("Application context acquired. Attempting to create database tables...")
         try:
-            # هذا الأمر آمن للتشغيل عدة مرات
-            db.create_all()
-            logger.info("Database tables checked/created successfully.")
+            applied = migrations.upgrade(db.engine, search_index)
+            logger.info(f"Database schema is up to date ({len(applied)} migration(s) applied).")
+            return applied
         except SQLAlchemyError as e:
             # حاول إظهار الخطأ بدون بيانات الاعتماد إذا كان خطأ اتصال
             db_uri_safe = str(app.config.get("SQLALCHEMY_DATABASE_URI"))
             if "@" in db_uri_safe:
                 db_uri_safe = db_uri_safe.split("@")[1] # إظهار ما بعد @ فقط
-            logger.error(f"FATAL: SQLAlchemyError occurred during db.create_all() for DB: ...@{db_uri_safe}. Error: {e}", exc_info=False) # لا تظهر تفاصيل كثيرة
-            raise SystemExit(f"Database initialization failed: {e}") from e
-        except Exception as e:
-            logger.error(f"FATAL: An unexpected error occurred during db.create_all(): {e}", exc_info=True)
-            raise SystemExit(f"Unexpected database initialization error: {e}") from e
-
-# استدعاء دالة تهيئة قاعدة البيانات
-initialize_database()
-logger.info("Database initialization routine finished.")
-
-# --- نقطة الدخول لـ Gunicorn/WSGI Server (لا حاجة لـ app.run) ---
-# Render سيستخدم أمرًا مثل `gunicorn app:app`
-# الكود التالي اختياري ولكنه يساعد في تهيئة التسجيل عند استخدام Gunicorn
-if __name__ != '__main__':
+            logger.error(f"FATAL: SQLAlchemyError occurred during schema migration for DB: ...@{db_uri_safe}. Error: {e}", exc_info=False) # لا تظهر تفاصيل كثيرة
+            raise SystemExit(f"Database migration failed: {e}") from e
+        finally:
+            db.engine.dispose()
+
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Create or upgrade the database schema."""
+    for version, name in migrations.pending(db.engine):
+        print(f"Pending migration {version}: {name}")
+    applied = migrate_database(current_app._get_current_object())
+    print(f"Applied {len(applied)} migration(s).")
+
+
+@bp.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the full-text search index from the messages table."""
+    with db.engine.begin() as conn:
+        search_index.ensure(conn)
+        total = search_index.rebuild(conn)
+    print(f"Indexed {total} messages.")
+
+
+@bp.cli.command('purge-conversations')
+@click.option('--older-than-days', type=float, required=True, help='Delete conversations not updated for this many days.')
+@click.option('--batch-size', type=int, default=PURGE_BATCH_SIZE, show_default=True, help='Conversations per transaction.')
+def purge_conversations_command(older_than_days, batch_size):
+    """Delete old conversations in bounded batches (retention job)."""
+    if older_than_days < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--older-than-days")
+    flush_pending_writes()
+    conversations_deleted, messages_deleted = purge_conversations(older_than_days, batch_size)
+    print(f"Deleted {conversations_deleted} conversations and {messages_deleted} messages.")
+
+
+def backfill_conversation_summaries(batch_size=500):
+    """
+    Recompute message_count, last_message_preview and last_role of every
+    conversation from its messages, `batch_size` conversations per
+    transaction. Returns the number of conversations updated.
+    """
+    total = 0
+    last_id = None
+    while True:
+        stmt = select(Conversation.id).order_by(Conversation.id).limit(batch_size)
+        if last_id is not None:
+            stmt = stmt.where(Conversation.id > last_id)
+        ids = db.session.execute(stmt).scalars().all()
+        if not ids:
+            break
+        stats = db.session.execute(
+            select(Message.conversation_id, func.count(), func.max(Message.id))
+            .where(Message.conversation_id.in_(ids)).group_by(Message.conversation_id)
+        ).all()
+        counts = {cid: count for cid, count, _ in stats}
+        # بداية آخر رسالة فقط تكفي للمعاينة
+        last_messages = {
+            row.conversation_id: row for row in db.session.execute(
+                select(Message.conversation_id, Message.role, Message.content_compressed,
+                       func.substr(Message.content, 1, PREVIEW_CHARS * 2).label("head"))
+                .where(Message.id.in_([last_message_id for _, _, last_message_id in stats]))
+            )
+        }
+        conversations = Conversation.__table__
+        db.session.execute(
+            update(conversations).where(conversations.c.id == bindparam("b_id")).values(
+                message_count=bindparam("b_count"),
+                last_message_preview=bindparam("b_preview"),
+                last_role=bindparam("b_role"),
+                updated_at=conversations.c.updated_at, # بدون onupdate: لا يتغير ترتيب القائمة الجانبية
+            ),
+            [
+                {
+                    "b_id": cid,
+                    "b_count": counts.get(cid, 0),
+                    "b_preview": message_preview(message_compression.stored_text(
+                        last_messages[cid].head, last_messages[cid].content_compressed)) if cid in last_messages else None,
+                    "b_role": last_messages[cid].role if cid in last_messages else None,
+                }
+                for cid in ids
+            ],
+        )
+        db.session.commit()
+        total += len(ids)
+        last_id = ids[-1]
+    return total
+
+
+@bp.cli.command('backfill-conversation-summaries')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Conversations per transaction.')
+def backfill_conversation_summaries_command(batch_size):
+    """Fill the sidebar summary columns of existing conversations (run once after upgrading)."""
+    flush_pending_writes()
+    print(f"Updated {backfill_conversation_summaries(batch_size)} conversations.")
+
+
+@bp.cli.command('compact-messages')
+@click.option('--older-than-days', type=float, default=message_compression.COMPRESS_AFTER_DAYS, show_default=True,
+              help='Compress messages created before this many days ago.')
+@click.option('--larger-than', type=int, default=message_compression.COMPRESS_LARGER_THAN, show_default=True,
+              help='Also compress messages longer than this many characters, whatever their age.')
+@click.option('--batch-size', type=int, default=message_compression.COMPACT_BATCH_SIZE, show_default=True,
+              help='Messages per transaction.')
+def compact_messages_command(older_than_days, larger_than, batch_size):
+    """Compress cold message content in batches and report the space saved."""
+    flush_pending_writes()
+    totals = message_compression.compact(_database_engine, Message.__table__, older_than_days, larger_than, batch_size)
+    saved = totals["bytes_before"] - totals["bytes_after"]
+    ratio = saved / totals["bytes_before"] * 100 if totals["bytes_before"] else 0
+    print(f"Compressed {totals['messages']} messages ({message_compression.CODEC}): "
+          f"{totals['bytes_before']} -> {totals['bytes_after']} bytes, {saved} saved ({ratio:.1f}%).")
+    if db.engine.dialect.name == "postgresql" and saved:
+        print("Run VACUUM on the messages table to return the freed space to the database.")
+
+
+# --- مصنع التطبيق ---
+def create_app():
+    """
+    Build the Flask app: configuration, extensions, routes and CLI commands.
+
+    Nothing here touches the database; the schema is created or upgraded by
+    `flask migrate`, or once in the gunicorn master (gunicorn.conf.py).
+    """
+    global _app
+    app = Flask(__name__)
+    app.secret_key = SESSION_SECRET
+    if DATABASE_URL:
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    # إعدادات اتصال قاعدة البيانات الموصى بها للبيئات السحابية
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 280,  # أقل بقليل من 5 دقائق (شائع لـ timeouts)
+        "pool_pre_ping": True, # للتحقق من الاتصال قبل استخدامه
+        "pool_timeout": 10,   # وقت انتظار الحصول على اتصال من الـ pool
+    }
+    if DATABASE_URL and not DATABASE_URL.startswith("sqlite"):
+        # نفس QueuePool الافتراضي، مع قياس زمن انتظار الاتصال لـ /metrics
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"] = metrics.TimedQueuePool
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    db.init_app(app) # ينشئ المحرك فقط؛ أول اتصال يُفتح عند أول استعلام
+    json_provider.init_app(app)
+    metrics.init_app(app)
+    tracing.init_app(app)
+    app.register_blueprint(bp)
+
+    # عند التشغيل عبر Gunicorn: استخدم معالجات سجله
     gunicorn_logger = logging.getLogger('gunicorn.error')
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    logger.info("Application started via WSGI server (like Gunicorn). Logging handlers configured.")
-else:
+    if gunicorn_logger.handlers:
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+
+    _app = app
+    return app
+
+
+# --- نقطة الدخول: Gunicorn يستخدم `gunicorn "app:create_app()"` (انظر gunicorn.conf.py) ---
+if __name__ == '__main__':
      # يمكنك إضافة هذا لتشغيل التطبيق محليًا بسهولة للتجربة
      logger.info("Starting Flask development server (use Gunicorn/WSGI for production)...")
      # Render لن يستخدم هذا الجزء، لكنه مفيد للاختبار المحلي
      port = int(os.environ.get("PORT", 5001)) # استخدم منفذ مختلف عن الشائع 5000 لتجنب التعارضات
+     app = create_app()
+     migrate_database(app)
      app.run(host='0.0.0.0', port=port, debug=False) # لا تستخدم debug=True في الإنتاج
@@ -0,0 +1,239 @@
+"""
+Microbenchmarks for the conversation hot paths (pytest-benchmark).
+
+The file is not named test_*.py, so a plain `pytest` run skips it; run it
+explicitly, once per table size (the app binds its database at import):
+
+    pip install pytest-benchmark
+    BENCH_MESSAGES=1000 pytest benchmarks/bench_orm.py \
+        --benchmark-storage=benchmarks/baselines --benchmark-save=sqlite-1k
+
+(likewise 100000 / sqlite-100k and 1000000 / sqlite-1m), and compare a change
+against the committed baseline with the same storage option plus
+`--benchmark-compare=0001 --benchmark-compare-fail=mean:10%`.
+
+The seeded SQLite file is built once per size under BENCH_DIR (default /tmp)
+and copied before every run, so writes from one run never leak into the next.
+Messages are spread over conversations of CONVERSATION_LENGTH messages, plus
+one LONG_CONVERSATION_LENGTH conversation for the serialization benchmarks.
+"""
+import os
+import sys
+import uuid
+import shutil
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+BENCH_MESSAGES = int(os.environ.get("BENCH_MESSAGES", 1000))
+BENCH_DIR = os.environ.get("BENCH_DIR", "/tmp")
+CONVERSATION_LENGTH = 50
+LONG_CONVERSATION_LENGTH = 1000
+
+_DB_PATH = os.path.join(BENCH_DIR, f"dzgpt-bench-{BENCH_MESSAGES}.db")
+_SEED_PATH = _DB_PATH + ".seed"
+
+# يجب ضبط قاعدة البيانات قبل استيراد app
+if os.path.exists(_SEED_PATH):
+    shutil.copyfile(_SEED_PATH, _DB_PATH)
+elif os.path.exists(_DB_PATH):
+    os.remove(_DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+os.environ.setdefault("SESSION_SECRET", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as dzgpt # noqa: E402
+from sqlalchemy import func, insert, select # noqa: E402
+
+flask_app = dzgpt.create_app()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WORDS = "مرحبا كيف يمكنني مساعدتك اليوم هذا نص تجريبي لقياس الأداء hello world benchmark message".split()
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _seed(engine):
+    """Insert BENCH_MESSAGES messages with Core (the ORM would take hours for 1M rows)."""
+    rng = random.Random(42)
+    conversations = dzgpt.Conversation.__table__
+    messages = dzgpt.Message.__table__
+    started = datetime.now(timezone.utc) - timedelta(days=60)
+    lengths = [LONG_CONVERSATION_LENGTH] if BENCH_MESSAGES >= LONG_CONVERSATION_LENGTH * 2 else []
+    remaining = BENCH_MESSAGES - sum(lengths)
+    lengths += [CONVERSATION_LENGTH] * (remaining // CONVERSATION_LENGTH)
+    if remaining % CONVERSATION_LENGTH:
+        lengths.append(remaining % CONVERSATION_LENGTH)
+
+    with engine.begin() as conn:
+        batch = []
+        for n, length in enumerate(lengths):
+            conversation_id = uuid.uuid4()
+            created = started + timedelta(seconds=n)
+            last = _text(rng, 30)
+            conn.execute(insert(conversations).values(
+                id=conversation_id, title=f"محادثة {n}", created_at=created,
+                updated_at=created + timedelta(seconds=length), message_count=length,
+                last_message_preview=dzgpt.message_preview(last), last_role="assistant"))
+            for i in range(length):
+                role = "user" if i % 2 == 0 else "assistant"
+                content = last if i == length - 1 else _text(rng, 8 if role == "user" else 60)
+                batch.append({"conversation_id": conversation_id, "role": role, "content": content,
+                              "created_at": created + timedelta(seconds=i)})
+            if len(batch) >= 10000:
+                conn.execute(insert(messages), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(messages), batch)
+
+
+@pytest.fixture(scope="session")
+def seeded():
+    dzgpt.migrate_database(flask_app)
+    with flask_app.app_context():
+        if not os.path.exists(_SEED_PATH):
+            _seed(dzgpt.db.engine)
+            dzgpt.db.engine.dispose()
+            shutil.copyfile(_DB_PATH, _SEED_PATH)
+        longest = dzgpt.db.session.execute(
+            select(dzgpt.Conversation.id).order_by(dzgpt.Conversation.message_count.desc()).limit(1)).scalar_one()
+        typical = dzgpt.db.session.execute(
+            select(dzgpt.Conversation.id).where(dzgpt.Conversation.message_count == min(CONVERSATION_LENGTH, BENCH_MESSAGES))
+            .limit(1)).scalar_one()
+        dzgpt.db.session.remove()
+    return {"long": longest, "typical": typical}
+
+
+@pytest.fixture
+def ctx(seeded):
+    with flask_app.app_context():
+        yield seeded
+        dzgpt.db.session.remove()
+
+
+@pytest.fixture(params=["typical", "long"])
+def conversation_id(request, ctx):
+    return ctx[request.param]
+
+
+# --- القراءة: القائمة الجانبية وتحميل محادثة كاملة ---
+
+def test_list_endpoint(benchmark, ctx):
+    client = flask_app.test_client()
+    response = benchmark(client.get, "/api/conversations?limit=50")
+    assert response.status_code == 200
+
+
+def test_fetch_endpoint(benchmark, conversation_id):
+    client = flask_app.test_client()
+    response = benchmark(client.get, f"/api/conversations/{conversation_id}")
+    assert response.status_code == 200
+
+
+def _load_orm(conversation_id):
+    dzgpt.db.session.expunge_all() # لا نقيس خريطة الهوية المحملة مسبقًا
+    stmt = select(dzgpt.Conversation).filter_by(id=conversation_id)
+    return dzgpt.db.session.execute(stmt).scalar_one().to_dict()
+
+
+def _load_core(conversation_id):
+    conversation = dzgpt.db.session.execute(
+        select(dzgpt.Conversation.__table__).where(dzgpt.Conversation.id == conversation_id)).one()
+    messages = dzgpt.db.session.execute(
+        select(dzgpt.Message.id, dzgpt.Message.role, dzgpt.Message.content, dzgpt.Message.content_compressed,
+               dzgpt.Message.created_at)
+        .where(dzgpt.Message.conversation_id == conversation_id).order_by(dzgpt.Message.created_at)).all()
+    return conversation, messages
+
+
+def test_hydrate_orm(benchmark, conversation_id):
+    """Full ORM objects (selectin messages) plus to_dict(), as get_conversation does."""
+    result = benchmark(_load_orm, conversation_id)
+    assert result["messages"]
+
+
+def test_hydrate_core(benchmark, conversation_id):
+    """Column projection of the same rows, no ORM objects."""
+    conversation, messages = benchmark(_load_core, conversation_id)
+    assert messages
+
+
+# --- التسلسل إلى JSON ---
+
+def test_serialize_to_dict_json(benchmark, conversation_id):
+    """to_dict() through the app's JSON provider, as jsonify does."""
+    conversation = dzgpt.db.session.execute(select(dzgpt.Conversation).filter_by(id=conversation_id)).scalar_one()
+    benchmark(lambda: flask_app.json.dumps(conversation.to_dict()))
+
+
+def test_serialize_stdlib_json(benchmark, conversation_id):
+    """to_dict() through json_provider's standard-library fallback (no orjson)."""
+    conversation = dzgpt.db.session.execute(select(dzgpt.Conversation).filter_by(id=conversation_id)).scalar_one()
+    benchmark(lambda: dzgpt.json_provider._dumps_stdlib(conversation.to_dict()))
+
+
+def test_serialize_core_orjson(benchmark, conversation_id):
+    """Core rows straight into orjson, which encodes datetime and UUID natively."""
+    if orjson is None:
+        pytest.skip("orjson is not installed")
+    conversation, messages = _load_core(conversation_id)
+
+    def encode():
+        return orjson.dumps({
+            "id": conversation.id, "title": conversation.title,
+            "created_at": conversation.created_at, "updated_at": conversation.updated_at,
+            "messages": [{"id": m.id, "conversation_id": conversation.id, "role": m.role,
+                          "content": dzgpt.message_compression.stored_text(m.content, m.content_compressed),
+                          "created_at": m.created_at} for m in messages],
+        })
+    benchmark(encode)
+
+
+# --- الكتابة ---
+
+def test_add_message(benchmark, ctx):
+    conversation = dzgpt.db.session.get(dzgpt.Conversation, ctx["typical"])
+
+    def add():
+        conversation.add_message("user", "رسالة جديدة لقياس زمن الإضافة")
+        dzgpt.db.session.commit()
+    benchmark(add)
+
+
+def test_regenerate_swap(benchmark, ctx):
+    """The in-place reply swap used by /api/regenerate."""
+    conversation_id = ctx["typical"]
+    message_id = dzgpt.db.session.execute(
+        select(func.max(dzgpt.Message.id))
+        .where(dzgpt.Message.conversation_id == conversation_id, dzgpt.Message.role == "assistant")).scalar_one()
+
+    def swap():
+        assert dzgpt.replace_assistant_reply(conversation_id, message_id, "رد جديد بعد إعادة التوليد")
+        dzgpt.db.session.commit()
+    benchmark(swap)
+
+
+def _new_conversation():
+    conversation = dzgpt.Conversation(title="للحذف")
+    dzgpt.db.session.add(conversation)
+    dzgpt.db.session.flush()
+    for i in range(CONVERSATION_LENGTH):
+        conversation.add_message("user" if i % 2 == 0 else "assistant", f"رسالة {i}")
+    dzgpt.db.session.commit()
+    return (conversation.id,), {}
+
+
+def test_delete_conversation(benchmark, ctx):
+    def delete(conversation_id):
+        assert dzgpt.delete_conversations([conversation_id])[0] == 1
+        dzgpt.db.session.commit()
+    benchmark.pedantic(delete, setup=_new_conversation, rounds=50)
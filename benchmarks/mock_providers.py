@@ -0,0 +1,238 @@
+"""
+Local stand-in for the OpenRouter and Gemini APIs, for load tests that must not
+hit the paid providers.
+
+    python benchmarks/mock_providers.py --port 8900 --latency lognormal:800,0.5 --error-rate 0.02
+
+then start the app with
+
+    OPENROUTER_CHAT_URL=http://127.0.0.1:8900/api/v1/chat/completions
+    GEMINI_API_BASE=http://127.0.0.1:8900/v1beta
+    OPENROUTER_API_KEY=mock GEMINI_API_KEY=mock
+
+Both blocking and streamed (SSE) variants are served:
+POST /api/v1/chat/completions (with or without "stream": true) and
+POST /v1beta/models/<model>:generateContent / :streamGenerateContent?alt=sse.
+"""
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("mock_providers")
+
+REPLY_WORDS = "هذا رد تجريبي من خادم المحاكاة المحلي لقياس أداء التطبيق دون استدعاء المزودين الحقيقيين".split()
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec into a function returning seconds:
+    `fixed:MS`, `uniform:MIN_MS,MAX_MS`, or `lognormal:MEDIAN_MS,SIGMA`.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median / 1000
+    raise argparse.ArgumentTypeError(f"Invalid latency spec '{spec}' (fixed:MS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA)")
+
+
+class MockConfig:
+    def __init__(self, latency, error_rate=0.0, reply_words=40, stream_chunks=10, chunk_delay_ms=30):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reply_words = reply_words
+        self.stream_chunks = max(1, stream_chunks)
+        self.chunk_delay = chunk_delay_ms / 1000
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reply_text(self, prompt=""):
+        numbered = _numbered_segments(prompt)
+        if numbered:
+            # ترجمة دفعية: نعيد نفس المفاتيح حتى لا يتراجع التطبيق إلى ترجمة كل مقطع وحده
+            return json.dumps({key: " ".join(random.choices(REPLY_WORDS, k=5)) for key in numbered}, ensure_ascii=False)
+        return " ".join(random.choice(REPLY_WORDS) for _ in range(self.reply_words))
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive مثل المزودين الحقيقيين، ليُختبر الـ pool في provider_client
+    config = None # MockConfig، يُضبط في make_server
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid JSON"}})
+
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/chat/completions"):
+            provider, stream = "openrouter", bool(payload.get("stream"))
+        elif ":streamGenerateContent" in path:
+            provider, stream = "gemini", True
+        elif ":generateContent" in path:
+            provider, stream = "gemini", False
+        else:
+            return self._send_json(404, {"error": {"message": f"unknown endpoint {path}"}})
+
+        time.sleep(self.config.latency()) # زمن الوصول حتى أول بايت
+        if random.random() < self.config.error_rate:
+            self.config.count(f"{provider}_error")
+            status = random.choice((429, 500, 503))
+            return self._send_json(status, {"error": {"code": status, "message": "mock provider failure"}})
+
+        self.config.count(f"{provider}_{'stream' if stream else 'ok'}")
+        if provider == "openrouter":
+            prompt = (payload.get("messages") or [{}])[-1].get("content") or ""
+        else:
+            prompt = " ".join(p.get("text") or "" for p in ((payload.get("contents") or [{}])[-1].get("parts") or []))
+        text = self.config.reply_text(prompt)
+        if provider == "openrouter":
+            model = payload.get("model", "mock")
+            if stream:
+                return self._stream_openrouter(model, text)
+            return self._send_json(200, {
+                "id": "mock", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": _usage_openrouter(payload.get("messages"), text),
+            })
+        if stream:
+            return self._stream_gemini(payload, text)
+        return self._send_json(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": _usage_gemini(payload.get("contents"), text),
+        })
+
+    def _send_json(self, status, data):
+        raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _send_sse(self, events):
+        # بدون Content-Length: نغلق الاتصال بعد البث كما تفعل الخوادم مع الاستجابات المقسمة
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i, event in enumerate(events):
+                if i:
+                    time.sleep(self.config.chunk_delay)
+                self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.config.count("client_disconnected") # مثلاً الطلب الخاسر في سباق التحوّط
+
+    def _stream_openrouter(self, model, text):
+        events = [json.dumps({"model": model, "choices": [{"index": 0, "delta": {"content": piece}}]}, ensure_ascii=False)
+                  for piece in _split(text, self.config.stream_chunks)]
+        events.append(json.dumps({"model": model, "choices": [], "usage": _usage_openrouter(None, text)}))
+        events.append("[DONE]")
+        self._send_sse(events)
+
+    def _stream_gemini(self, payload, text):
+        usage = _usage_gemini(payload.get("contents"), text)
+        events = [json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}],
+                              "usageMetadata": usage}, ensure_ascii=False)
+                  for piece in _split(text, self.config.stream_chunks)]
+        self._send_sse(events)
+
+
+def _numbered_segments(prompt):
+    start, end = prompt.find("{"), prompt.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(prompt[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) and all(key.isdigit() for key in data) else None
+
+
+def _split(text, parts):
+    size = max(1, -(-len(text) // parts))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _usage_openrouter(messages, text):
+    prompt = sum(_approx_tokens(m.get("content") or "") for m in messages or [])
+    return {"prompt_tokens": prompt, "completion_tokens": _approx_tokens(text)}
+
+
+def _usage_gemini(contents, text):
+    prompt = sum(_approx_tokens(p.get("text") or "") for c in contents or [] for p in c.get("parts", []))
+    return {"promptTokenCount": prompt, "candidatesTokenCount": _approx_tokens(text)}
+
+
+def make_server(host, port, config):
+    """Build (but do not start) a threaded mock server; port 0 picks a free port."""
+    handler = type("ConfiguredMockProviderHandler", (MockProviderHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config, host="127.0.0.1", port=0):
+    """Start a mock server in a daemon thread and return it; its base URL is http://host:server.server_port."""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name="mock-providers", daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("lognormal:800,0.5"),
+                        help="Time to first byte: fixed:MS, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (default lognormal:800,0.5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429/5xx")
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument("--stream-chunks", type=int, default=10)
+    parser.add_argument("--chunk-delay-ms", type=float, default=30, help="Delay between streamed chunks")
+
+
+def config_from_args(args):
+    return MockConfig(args.latency, args.error_rate, args.reply_words, args.stream_chunks, args.chunk_delay_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = make_server(args.host, args.port, config_from_args(args))
+    logger.info(f"Mock providers on http://{args.host}:{server.server_port} "
+                f"(OpenRouter: /api/v1/chat/completions, Gemini: /v1beta)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Served: {server.RequestHandlerClass.config.counts}")
+
+
+if __name__ == "__main__":
+    main()
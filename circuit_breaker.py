@@ -0,0 +1,160 @@
+import os
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات قاطع الدائرة (Circuit Breaker) ---
+WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", 60))   # نافذة الإحصاءات المتحركة
+MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", 5))                # أقل عدد استدعاءات قبل الحكم على المزود
+ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", 0.5))          # نسبة الأخطاء التي تفتح الدائرة
+SLOW_CALL_SECONDS = float(os.environ.get("BREAKER_SLOW_CALL_SECONDS", 20))
+SLOW_CALL_RATE = float(os.environ.get("BREAKER_SLOW_CALL_RATE", 0.8))  # نسبة الاستدعاءات البطيئة التي تفتح الدائرة
+COOLDOWN_SECONDS = float(os.environ.get("BREAKER_COOLDOWN_SECONDS", 30))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_provider_failure(exc):
+    """Whether an exception says something about provider health (vs. a bad request of ours)."""
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return True
+
+
+class CircuitBreaker:
+    """
+    Per-provider breaker over a rolling window of call outcomes and latencies.
+
+    closed -> open when the error rate or slow-call rate crosses its threshold;
+    open -> half_open after the cool-down, letting a single probe through;
+    the probe's outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self._calls = deque() # (timestamp, ok, latency)
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def _open(self, now, reason):
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        logger.warning(f"Circuit for provider '{self.name}' opened: {reason}. Skipping it for {COOLDOWN_SECONDS:.0f}s.")
+
+    def allow_request(self):
+        """Return True if a call may go to this provider now (claims the probe slot when half-open)."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now - self._opened_at < COOLDOWN_SECONDS:
+                    return False
+                self.state = HALF_OPEN
+                logger.info(f"Circuit for provider '{self.name}' is half-open; sending a probe request.")
+            # half-open: مسبار واحد فقط في كل مرة (مع إعادة المحاولة إذا لم يُبلَّغ عن نتيجته)
+            if self._probe_started_at is not None and now - self._probe_started_at < COOLDOWN_SECONDS:
+                return False
+            self._probe_started_at = now
+            return True
+
+    def record_success(self, latency):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if latency >= SLOW_CALL_SECONDS:
+                    self._open(now, f"probe was slow ({latency:.1f}s)")
+                    return
+                self.state = CLOSED
+                self._calls.clear()
+                self._probe_started_at = None
+                logger.info(f"Circuit for provider '{self.name}' closed after a successful probe.")
+                return
+            self._calls.append((now, True, latency))
+            self._evaluate(now)
+
+    def record_failure(self, latency=None):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open(now, "probe failed")
+                return
+            self._calls.append((now, False, latency))
+            self._evaluate(now)
+
+    def record_error(self, exc, latency=None):
+        """Record an exception, counting only those that reflect provider health."""
+        if is_provider_failure(exc):
+            self.record_failure(latency)
+        else:
+            # طلب خاطئ من جهتنا (400/401/403): لا يدل على صحة المزود، فلا يغلق الدائرة ولا يدخل في الإحصاءات
+            self.release()
+
+    def release(self):
+        """
+        Give back a half-open probe slot without a verdict or a recorded call
+        (e.g. a cancelled hedged call, or a 4xx that says nothing about the provider).
+        """
+        with self._lock:
+            self._probe_started_at = None
+
+    def _evaluate(self, now):
+        self._trim(now)
+        if self.state != CLOSED or len(self._calls) < MIN_CALLS:
+            return
+        total = len(self._calls)
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, latency in self._calls if latency is not None and latency >= SLOW_CALL_SECONDS)
+        if errors / total >= ERROR_RATE:
+            self._open(now, f"{errors}/{total} calls failed in the last {WINDOW_SECONDS:.0f}s")
+        elif slow / total >= SLOW_CALL_RATE:
+            self._open(now, f"{slow}/{total} calls slower than {SLOW_CALL_SECONDS:.0f}s")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            total = len(self._calls)
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            latencies = [latency for _, _, latency in self._calls if latency is not None]
+            return {
+                "state": self.state,
+                "calls": total,
+                "error_rate": round(errors / total, 3) if total else 0.0,
+                "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "retry_in": round(max(0.0, COOLDOWN_SECONDS - (now - self._opened_at)), 1) if self.state == OPEN else 0.0,
+            }
+
+
+# سجل مشترك داخل العملية: مسارات المحادثة والترجمة تستخدم نفس القاطع لكل مزود
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the shared breaker for a provider ('openrouter', 'gemini')."""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def snapshot_all():
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,155 @@
+import os
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# --- نوافذ السياق لكل نموذج (بالرموز/tokens) ---
+MODEL_CONTEXT_WINDOWS = {
+    'mistralai/mistral-7b-instruct': 32768,
+    'mistralai/mistral-7b-instruct-v0.2': 32768,
+    'anthropic/claude-3-haiku': 200000,
+    'anthropic/claude-3-sonnet': 200000,
+    'google/gemini-pro': 32768,
+    'meta-llama/llama-3-8b-instruct': 8192,
+    'google/gemma-7b-it': 8192,
+    'openai/gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get("DEFAULT_CONTEXT_WINDOW", 8192))
+# سقف للسجل المرسل حتى مع النماذج ذات النوافذ الضخمة (التكلفة وزمن الاستجابة)
+MAX_HISTORY_TOKENS = int(os.environ.get("MAX_HISTORY_TOKENS", 12000))
+# هامش أمان لأن تقدير الرموز تقريبي
+SAFETY_MARGIN = float(os.environ.get("CONTEXT_SAFETY_MARGIN", 0.1))
+# عند التلخيص، تُطوى رسائل كافية ليبقى السجل عند هذه النسبة من الميزانية،
+# فلا يتكرر التلخيص في كل دورة (hysteresis)
+SUMMARY_TARGET_RATIO = float(os.environ.get("SUMMARY_TARGET_RATIO", 0.6))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", 400))
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "mistralai/mistral-7b-instruct")
+
+_MESSAGE_OVERHEAD = 4 # رموز تنسيق الدور والفواصل لكل رسالة
+
+SUMMARY_PREFIX = "ملخص الجزء السابق من المحادثة:\n"
+
+
+def estimate_tokens(text):
+    """
+    Rough token count without a tokenizer.
+
+    Latin text averages ~4 characters per token, Arabic and other alphabetic
+    scripts ~2.5, and CJK ideographs/kana/hangul about one token each.
+    """
+    if not text:
+        return 0
+    latin = other = cjk = 0
+    for ch in text:
+        if ch.isascii():
+            latin += 1
+        elif unicodedata.east_asian_width(ch) in ('W', 'F'):
+            cjk += 1
+        else:
+            other += 1
+    return int(latin / 4 + other / 2.5 + cjk) + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + _MESSAGE_OVERHEAD
+
+
+def history_budget(model, max_tokens):
+    """Tokens available for the prompt history once the reply's max_tokens is reserved."""
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    budget = int(window * (1 - SAFETY_MARGIN)) - max_tokens
+    return max(256, min(budget, MAX_HISTORY_TOKENS))
+
+
+def fit_to_budget(messages, budget):
+    """Keep the newest messages that fit in `budget`; the last message is always kept."""
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        cost = message_tokens(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def summary_message(summary):
+    return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+
+def build_context(messages, model, max_tokens, conversation=None, summarize=None):
+    """
+    Fit a conversation history into the model's token budget.
+
+    `messages` are dicts with 'role' and 'content', oldest first. When they also
+    carry the DB 'id' and a `conversation` row is given, turns older than the
+    conversation's cached summary are replaced by that summary. If the rest
+    still does not fit, the oldest turns are folded into the summary via
+    `summarize(previous_summary, messages) -> str | None`, and
+    `conversation.summary` / `conversation.summary_upto_id` are updated (the
+    caller commits). Messages without an 'id' (e.g. write-behind rows not
+    flushed yet) are never folded and are kept even past the target. Otherwise, and whenever summarizing fails, the oldest
+    turns are simply dropped.
+    """
+    budget = history_budget(model, max_tokens)
+    # الرسائل بلا 'id' هي رسائل لم تُحفظ بعد (رسالة المستخدم الحالية)، وتبقى دائمًا ضمن المرشحة
+    use_summary = conversation is not None and any(m.get("id") is not None for m in messages)
+    if not use_summary:
+        kept = fit_to_budget(messages, budget)
+        if len(kept) < len(messages):
+            logger.info(f"Context trimmed to {len(kept)}/{len(messages)} messages (budget {budget} tokens, model {model}).")
+        return kept
+
+    summary = conversation.summary
+    upto_id = conversation.summary_upto_id or 0
+    candidates = [m for m in messages if m.get("id") is None or m["id"] > upto_id]
+    summary_cost = message_tokens(summary_message(summary)) if summary else 0
+    candidates_cost = sum(message_tokens(m) for m in candidates)
+
+    if summary_cost + candidates_cost <= budget:
+        return ([summary_message(summary)] if summary else []) + _strip_ids(candidates)
+
+    # السجل لا يتسع: طي أقدم الرسائل في الملخص حتى يعود الباقي إلى النسبة المستهدفة
+    target = int(budget * SUMMARY_TARGET_RATIO) - SUMMARY_MAX_TOKENS
+    keep = fit_to_budget(candidates, max(target, 0))
+    older = candidates[:len(candidates) - len(keep)]
+    fold = [m for m in older if m.get("id") is not None]
+    # الرسائل المؤجلة (write-behind) لم تُحفظ بعد، فلا تُطوى ولا تُحذف مهما تجاوزت الميزانية
+    keep = [m for m in older if m.get("id") is None] + keep
+
+    new_summary = summarize(summary, _strip_ids(fold)) if summarize and fold else None
+    if new_summary:
+        conversation.summary = new_summary
+        conversation.summary_upto_id = fold[-1]["id"]
+        logger.info(f"Folded {len(fold)} messages into the summary of conversation {conversation.id} "
+                    f"(now covers up to message {fold[-1]['id']}).")
+        return [summary_message(new_summary)] + _strip_ids(keep)
+
+    logger.warning(f"Could not refresh summary for conversation {conversation.id}; truncating history instead.")
+    base = [summary_message(summary)] if summary else []
+    return base + _strip_ids(fit_to_budget(candidates, budget - summary_cost))
+
+
+def _strip_ids(messages):
+    """Provider payloads only take role and content."""
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+def summary_prompt(previous_summary, messages):
+    """Messages asking a model to extend `previous_summary` with `messages`."""
+    transcript = "\n".join(
+        f"{'المستخدم' if m['role'] == 'user' else 'المساعد'}: {m['content']}" for m in messages
+    )
+    instructions = (
+        "لخّص المحادثة التالية بإيجاز مع الحفاظ على الحقائق والأسماء والقرارات والطلبات المهمة، "
+        "ليُستخدم الملخص كسياق لمتابعة المحادثة. أعد الملخص فقط."
+    )
+    if previous_summary:
+        instructions += f"\n\nالملخص الحالي (أدمجه مع الجديد):\n{previous_summary}"
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": transcript},
+    ]
@@ -0,0 +1,47 @@
+import os
+
+import json_provider
+
+# عدد الرسائل في كل دفعة تُجلب من المؤشر وتُكتب إلى الاستجابة
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _dumps(value):
+    return json_provider.dumps(value)
+
+
+def iter_json(header, batches):
+    """
+    Stream a conversation as one JSON document, shaped like Conversation.to_dict().
+
+    `header` holds the conversation fields; `batches` yields lists of message
+    dicts. Only one batch is held in memory at a time.
+    """
+    yield _dumps(header)[:-1] + ',"messages":['
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        chunk = ",".join(_dumps(message) for message in batch)
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]}"
+
+
+def iter_ndjson(header, batches):
+    """Stream a conversation as NDJSON: the conversation line, then one line per message."""
+    yield _dumps({"type": "conversation", **header}) + "\n"
+    for batch in batches:
+        if batch:
+            yield "".join(_dumps({"type": "message", **message}) + "\n" for message in batch)
+
+
+def iter_export(fmt, header, batches):
+    """Serialize with the streamer for `fmt` ('json' or 'ndjson')."""
+    serializer = iter_ndjson if fmt == "ndjson" else iter_json
+    return serializer(header, batches)
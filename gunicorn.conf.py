@@ -0,0 +1,34 @@
+import os
+import shutil
+
+# يُحمَّل تلقائيًا بواسطة gunicorn من مجلد التشغيل
+# مقاييس Prometheus من عدة عمليات: كل عامل يكتب في هذا المجلد ويجمعها /metrics
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/dzgpt-prometheus")
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True) # preload يستورد metrics قبل on_starting
+
+# يُحمَّل التطبيق مرة واحدة في العملية الرئيسية ثم يُنسخ للعمال (create_app لا يفتح أي اتصال بقاعدة البيانات)
+preload_app = True
+# ترحيل المخطط مرة واحدة في العملية الرئيسية قبل إنشاء العمال؛ اضبطه على 0 إذا كان يُشغَّل `flask migrate` في خطوة النشر
+MIGRATE_ON_START = os.environ.get("MIGRATE_ON_START", "1") == "1"
+
+
+def on_starting(server):
+    """
+    Start every deployment with an empty metrics directory (stale worker files
+    would be summed in), and migrate the schema before any worker is forked.
+    The master serves no requests, so its own live gauges are dropped afterwards.
+    """
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    if MIGRATE_ON_START:
+        from app import migrate_database
+        migrate_database(server.app.wsgi()) # التطبيق المحمَّل مسبقًا (preload_app)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(os.getpid()) # الترحيل يكتب مقاييس باسم العملية الرئيسية
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that has exited; its counters stay in the totals."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,176 @@
+import os
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات التحوّط (Hedging) ---
+# عند التفعيل: إذا لم يرد المزود الأساسي خلال مهلة التحوّط، يُطلق المزود الاحتياطي بالتوازي
+# ويُعتمد أول رد ناجح، ثم يُلغى الطلب الآخر.
+HEDGING_ENABLED = os.environ.get("PROVIDER_HEDGING", "off").lower() in ("1", "true", "on", "yes")
+# رقم بالثواني، أو "auto" لاستخدام النسبة المئوية HEDGE_PERCENTILE من زمن استجابة OpenRouter الفعلي
+HEDGE_DELAY = os.environ.get("HEDGE_DELAY_SECONDS", "auto")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY_SECONDS", 8)) # قبل توفر عينات كافية
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY_SECONDS", 1))
+HEDGE_MAX_WORKERS = int(os.environ.get("HEDGE_MAX_WORKERS", 8))
+_MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies (seconds) for percentile estimates."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """Return the p-th percentile, or None if there are not enough samples."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < _MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+class CancelEvent(threading.Event):
+    """
+    Event that also runs the callbacks registered with add_callback() when set,
+    so a cancelled call can be interrupted mid-read (see provider_client.cancel_on).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, fn):
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(fn)
+                return
+        fn() # أُلغي مسبقًا
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Cancel callback failed: {e}", exc_info=True)
+
+
+# زمن استجابة OpenRouter الناجحة (مشترك داخل العامل)
+openrouter_latency = LatencyTracker()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Lazily create the worker pool (rebuilt after fork, like provider_client's session)."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+                _executor_pid = pid
+    return _executor
+
+
+def hedge_delay():
+    """
+    Seconds to wait for the primary provider before firing the backup.
+
+    In "auto" mode this is a percentile of openrouter_latency, which race()
+    feeds with every primary attempt that says something about its latency:
+    answers, slow failures (timeouts) and, for a primary that lost the race,
+    the time it had been running when it was cancelled. Those censored samples
+    are lower bounds, but leaving them out would keep only the fast survivors
+    and let the threshold shrink with every hedge.
+    """
+    if HEDGE_DELAY.lower() != "auto":
+        return float(HEDGE_DELAY)
+    observed = openrouter_latency.percentile(HEDGE_PERCENTILE)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, observed)
+
+
+def race(primary, backup, delay, latency=None):
+    """
+    Run `primary`, and `backup` too once `delay` seconds pass without an answer.
+
+    `primary` and `backup` are (name, fn) pairs where fn(cancel_event) returns
+    (reply, error) and should stop early once cancel_event (a CancelEvent) is
+    set, e.g. by making its provider calls inside provider_client.cancel_on. The backup
+    also starts immediately if the primary fails first. Primary latencies are
+    recorded in the `latency` tracker if given (see hedge_delay). Returns
+    (winner_name, reply, errors) where errors maps provider name to its error.
+    """
+    results = queue.Queue()
+    cancel_events = {}
+    primary_started = time.monotonic()
+
+    def start(name, fn):
+        cancel_events[name] = CancelEvent()
+
+        def run():
+            started = time.monotonic()
+            try:
+                reply, error = fn(cancel_events[name])
+            except Exception as e: # لا يجب أن يسقط الخيط دون إبلاغ المنتظر
+                logger.error(f"Hedged call to {name} raised: {e}", exc_info=True)
+                reply, error = None, str(e)
+            results.put((name, reply, error, time.monotonic() - started))
+
+        _get_executor().submit(run)
+
+    start(*primary)
+    backup_started = False
+    pending = 1
+    errors = {}
+
+    while pending:
+        try:
+            name, reply, error, elapsed = results.get(timeout=None if backup_started else delay)
+        except queue.Empty:
+            logger.info(f"{primary[0]} has not answered after {delay:.2f}s; hedging with {backup[0]}.")
+            start(*backup)
+            backup_started = True
+            pending += 1
+            continue
+
+        pending -= 1
+        if latency is not None and name == primary[0] and (reply or elapsed >= delay):
+            latency.record(elapsed) # خطأ سريع لا يقول شيئًا عن زمن الرد
+        if reply:
+            if latency is not None and name != primary[0] and primary[0] not in errors:
+                # الأساسي ما زال جاريًا: زمنه الحقيقي لا يقل عن المدة حتى الآن
+                latency.record(time.monotonic() - primary_started)
+            for other, event in cancel_events.items():
+                if other != name:
+                    event.set() # إلغاء الطلب الخاسر، ولو كان ما زال ينتظر أول بايت
+            logger.info(f"Hedged race won by {name} after {elapsed:.2f}s.")
+            return name, reply, errors
+        errors[name] = error
+        if not backup_started:
+            logger.info(f"{primary[0]} failed before hedge delay; starting {backup[0]} now.")
+            start(*backup)
+            backup_started = True
+            pending += 1
+
+    return None, None, errors
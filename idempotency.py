@@ -0,0 +1,216 @@
+import os
+import logging
+import hashlib
+import functools
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import g, request, jsonify, make_response, Response
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات مفاتيح منع التكرار (Idempotency-Key) ---
+TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))  # مدة الاحتفاظ بالرد المخزن
+WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 90))       # انتظار طلب مماثل قيد التنفيذ
+LOCK_SECONDS = float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 300))      # بعدها يُعتبر الطلب الجاري عالقًا
+_POLL_SECONDS = 0.25
+_PURGE_EVERY_SECONDS = 600
+MAX_KEY_LENGTH = 255
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+HEADER = "Idempotency-Key"
+
+
+def _utc(value):
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class IdempotencyStore:
+    """
+    Stores the final response of a request under its Idempotency-Key.
+
+    A request claims its key by inserting an in-progress row; repeats with the
+    same key either replay the stored response, or wait while the first one
+    is still running (same-process waiters are woken by an Event, others poll
+    the table). Keys are scoped per endpoint and expire after TTL_SECONDS.
+    """
+
+    def __init__(self, get_engine, model):
+        self.get_engine = get_engine
+        self.table = model.__table__
+        self._events = {} # key -> Event للطلبات الجارية في هذه العملية
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    @staticmethod
+    def scoped_key(endpoint, key):
+        return hashlib.sha256(f"{endpoint}\x1f{key}".encode("utf-8")).hexdigest()
+
+    def claim(self, key, fingerprint):
+        """
+        Returns ("owner", None) when this request should run, ("replay", row)
+        for a stored response, ("mismatch", None) if the key was used with a
+        different payload, or ("busy", None) if waiting timed out.
+        """
+        self._maybe_purge()
+        deadline = time.monotonic() + WAIT_SECONDS
+        table = self.table
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                with self.get_engine().begin() as conn:
+                    row = conn.execute(select(table).where(table.c.key == key)).first()
+                    stale = row is not None and (
+                        _utc(row.expires_at) <= now
+                        or (row.status == IN_PROGRESS and now - _utc(row.created_at) > timedelta(seconds=LOCK_SECONDS))
+                    )
+                    if row is None or stale:
+                        if stale:
+                            conn.execute(delete(table).where(table.c.key == key))
+                        conn.execute(table.insert().values(
+                            key=key, request_hash=fingerprint, status=IN_PROGRESS,
+                            created_at=now, expires_at=now + timedelta(seconds=TTL_SECONDS),
+                        ))
+                        with self._lock:
+                            self._events[key] = threading.Event()
+                        return "owner", None
+            except IntegrityError:
+                continue # طلب آخر سبقنا إلى الإدراج؛ نعيد القراءة
+
+            if row.request_hash != fingerprint:
+                return "mismatch", None
+            if row.status == COMPLETED:
+                return "replay", row
+            if time.monotonic() >= deadline:
+                return "busy", None
+            with self._lock:
+                event = self._events.get(key)
+            if event is not None:
+                event.wait(_POLL_SECONDS * 4)
+            else:
+                time.sleep(_POLL_SECONDS)
+
+    def complete(self, key, status, mimetype, body):
+        table = self.table
+        try:
+            with self.get_engine().begin() as conn:
+                conn.execute(table.update().where(table.c.key == key).values(
+                    status=COMPLETED, response_status=status, response_mimetype=mimetype, response_body=body,
+                ))
+        except SQLAlchemyError as e:
+            logger.error(f"Could not store idempotent response: {e}")
+            self.release(key)
+            return
+        self._wake(key)
+
+    def release(self, key):
+        """Forget an unfinished claim so a retry can run the request again."""
+        table = self.table
+        try:
+            with self.get_engine().begin() as conn:
+                conn.execute(delete(table).where(table.c.key == key, table.c.status == IN_PROGRESS))
+        except SQLAlchemyError as e:
+            logger.error(f"Could not release idempotency key: {e}")
+        self._wake(key)
+
+    def _wake(self, key):
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_EVERY_SECONDS:
+            return
+        self._last_purge = now
+        table = self.table
+        try:
+            with self.get_engine().begin() as conn:
+                result = conn.execute(delete(table).where(table.c.expires_at < datetime.now(timezone.utc)))
+            if result.rowcount:
+                logger.info(f"Purged {result.rowcount} expired idempotency keys.")
+        except SQLAlchemyError as e:
+            logger.error(f"Idempotency key purge failed: {e}")
+
+
+def discard():
+    """
+    Mark the current request's response as not worth replaying (an error
+    event or an offline fallback reply); its key is released once the
+    response is sent, so a retry runs the request again.
+    """
+    state = g.get("idempotency_state")
+    if state is not None:
+        state["store"] = False
+
+
+def idempotent(store, endpoint):
+    """
+    Route decorator: requests carrying an Idempotency-Key header run at most
+    once per key; repeats get the stored response (streamed responses are
+    captured as they are sent). 5xx responses, interrupted streams and
+    responses marked with discard() are not stored, so they can be retried.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            raw_key = request.headers.get(HEADER)
+            if not raw_key:
+                return view(*args, **kwargs)
+            if len(raw_key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"مفتاح {HEADER} أطول من المسموح"}), 400
+
+            key = store.scoped_key(endpoint, raw_key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            outcome, row = store.claim(key, fingerprint)
+            if outcome == "replay":
+                logger.info(f"Replaying stored response for {endpoint} ({HEADER} seen before).")
+                response = Response(row.response_body, status=row.response_status, mimetype=row.response_mimetype)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+            if outcome == "mismatch":
+                return jsonify({"error": f"مفتاح {HEADER} مستخدم مسبقًا لطلب مختلف"}), 422
+            if outcome == "busy":
+                return jsonify({"error": f"طلب آخر بنفس مفتاح {HEADER} ما زال قيد التنفيذ"}), 409
+
+            # البث يعمل بعد عودة الدالة، فيُشارك القاموس نفسه مع _capture
+            state = g.idempotency_state = {"store": True}
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                store.release(key)
+                raise
+            if response.status_code >= 500 or not state["store"]:
+                store.release(key)
+            elif response.is_streamed:
+                response.response = _capture(store, key, response.response, response.status_code, response.mimetype,
+                                             state)
+            else:
+                store.complete(key, response.status_code, response.mimetype, response.get_data(as_text=True))
+            return response
+        return wrapper
+    return decorator
+
+
+def _capture(store, key, iterable, status, mimetype, state):
+    """Pass a streamed body through, storing it once it has been sent completely (unless discarded)."""
+    chunks = []
+    completed = False
+    try:
+        for chunk in iterable:
+            chunks.append(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk)
+            yield chunk
+        completed = True
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+        if completed and state["store"]:
+            store.complete(key, status, mimetype, "".join(chunks))
+        else:
+            store.release(key)
@@ -0,0 +1,87 @@
+import json
+import uuid
+import decimal
+import logging
+import dataclasses
+from datetime import date
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson # اختياري: ترميز وفك JSON أسرع بكثير من المكتبة القياسية
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# --- ترميز JSON موحد لاستجابات الواجهة وطلبات/ردود مزودي النماذج ---
+# UUID يُرمَّز كنص، والتواريخ بصيغة ISO 8601 (كما كانت تفعل to_dict يدويًا) في كلا المسارين
+BACKEND = "orjson" if orjson is not None else "json"
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(value):
+    if isinstance(value, date): # datetime أيضًا
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps_stdlib(value, indent=None):
+    separators = None if indent else (",", ":")
+    return json.dumps(value, default=_default, ensure_ascii=False, indent=indent, separators=separators)
+
+
+def dumps_bytes(value):
+    """Encode `value` as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass # مثلاً أعداد صحيحة أكبر من 64 بت: المكتبة القياسية تتعامل معها
+    return _dumps_stdlib(value).encode("utf-8")
+
+
+def dumps(value):
+    """Encode `value` as a compact JSON string."""
+    return dumps_bytes(value).decode("utf-8")
+
+
+def loads(data):
+    """Decode JSON from str or bytes; errors are json.JSONDecodeError (a ValueError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider using orjson when installed and the standard library otherwise."""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get("indent"):
+            return _dumps_stdlib(obj, indent=kwargs["indent"])
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self._app.debug:
+            body = f"{_dumps_stdlib(obj, indent=2)}\n".encode("utf-8")
+        else:
+            body = dumps_bytes(obj) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Install FastJSONProvider as `app.json` (used by jsonify and request.get_json)."""
+    app.json = FastJSONProvider(app)
+    logger.info(f"JSON provider backend: {BACKEND}")
@@ -0,0 +1,242 @@
+import os
+import math
+import unicodedata
+from bisect import bisect_right
+from collections import Counter
+from functools import lru_cache
+
+# --- كاشف اللغة المحلي (بدون نموذج) ---
+# الحد الأدنى للثقة قبل اللجوء إلى نموذج الذكاء الاصطناعي
+MIN_CONFIDENCE = float(os.environ.get("LANGUAGE_DETECT_MIN_CONFIDENCE", 0.9))
+_MAX_CHARS = 1000  # يكفي أول جزء من النص للحكم على لغته
+_ALPHA = 0.5       # تنعيم لابلاس للمقاطع الثلاثية غير المرئية
+
+# نطاقات Unicode لكل نظام كتابة (البداية، النهاية، النظام)
+_SCRIPT_RANGES = sorted([
+    (0x0590, 0x05FF, "hebrew"),
+    (0xFB1D, 0xFB4F, "hebrew"),
+    (0x0600, 0x06FF, "arabic"),
+    (0x0750, 0x077F, "arabic"),
+    (0x08A0, 0x08FF, "arabic"),
+    (0xFB50, 0xFDFF, "arabic"),
+    (0xFE70, 0xFEFF, "arabic"),
+    (0x0400, 0x052F, "cyrillic"),
+    (0x0900, 0x097F, "devanagari"),
+    (0x1100, 0x11FF, "hangul"),
+    (0x3130, 0x318F, "hangul"),
+    (0xAC00, 0xD7AF, "hangul"),
+    (0x3040, 0x30FF, "kana"),
+    (0x31F0, 0x31FF, "kana"),
+    (0xFF66, 0xFF9F, "kana"),
+    (0x3400, 0x4DBF, "han"),
+    (0x4E00, 0x9FFF, "han"),
+    (0xF900, 0xFAFF, "han"),
+    (0x0041, 0x024F, "latin"),
+    (0x1E00, 0x1EFF, "latin"),
+])
+_RANGE_STARTS = [start for start, _, _ in _SCRIPT_RANGES]
+
+# أنظمة كتابة لا تستخدمها إلا لغة واحدة من اللغات المدعومة
+_SINGLE_LANGUAGE_SCRIPTS = {"hebrew": "he", "cyrillic": "ru", "devanagari": "hi", "hangul": "ko"}
+
+# نصوص تدريب قصيرة لبناء ملف المقاطع الثلاثية لكل لغة تشترك في نظام كتابة مع غيرها
+_SAMPLES = {
+    "arabic": {
+        "ar": (
+            "إن التطور السريع للتكنولوجيا الحديثة قد غير الطريقة التي يعيش بها الناس ويعملون. "
+            "من المهم أن نفهم ماذا يعني ذلك بالنسبة لأطفالنا ولمستقبل العالم. كثير منهم يبحثون عن عمل جديد، "
+            "وما زال هناك الكثير من العمل في المدن التي يعيشون فيها منذ سنوات. هذا هو الوقت الذي يجب على كل "
+            "واحد أن يفكر فيما يريده وكيف يحب أن يصل إلى هناك مع أصدقائه وعائلته. مرحبا، كيف حالك اليوم؟ "
+            "شكرا جزيلا على مساعدتك. هل يمكنك أن تترجم هذه الرسالة إلى اللغة الإنجليزية من فضلك؟ "
+            "أريد أن أتعلم كيف أكتب برنامجا بسيطا، وما هي أفضل طريقة للبدء في ذلك؟ نحن في انتظار ردكم."
+        ),
+        "fa": (
+            "پیشرفت سریع فناوری مدرن شیوه زندگی و کار مردم را تغییر داده است. مهم است که بفهمیم این برای "
+            "فرزندان ما و برای آینده جهان چه معنایی دارد. بسیاری از آنها به دنبال کار جدیدی هستند و هنوز "
+            "کارهای زیادی در شهرهایی که سال‌ها در آن زندگی کرده‌اند باقی مانده است. این زمانی است که هر کسی "
+            "باید به آنچه می‌خواهد فکر کند و اینکه چگونه دوست دارد با دوستان و خانواده‌اش به آنجا برسد. "
+            "سلام، حال شما چطور است؟ خیلی ممنون از کمک شما. آیا می‌توانید این پیام را به زبان انگلیسی ترجمه "
+            "کنید؟ من می‌خواهم یاد بگیرم چگونه یک برنامه ساده بنویسم و بهترین راه برای شروع چیست؟ ما منتظر پاسخ شما هستیم."
+        ),
+        "ur": (
+            "جدید ٹیکنالوجی کی تیز رفتار ترقی نے لوگوں کے رہنے اور کام کرنے کا طریقہ بدل دیا ہے۔ یہ سمجھنا "
+            "ضروری ہے کہ ہمارے بچوں اور دنیا کے مستقبل کے لیے اس کا کیا مطلب ہے۔ ان میں سے بہت سے لوگ نئی "
+            "نوکری تلاش کر رہے ہیں، اور ان شہروں میں ابھی بہت کام باقی ہے جہاں وہ برسوں سے رہ رہے ہیں۔ یہ وہ "
+            "وقت ہے جب ہر ایک کو سوچنا چاہیے کہ وہ کیا چاہتا ہے اور اپنے دوستوں اور خاندان کے ساتھ وہاں کیسے "
+            "پہنچنا پسند کرے گا۔ السلام علیکم، آپ کیسے ہیں؟ آپ کی مدد کا بہت شکریہ۔ کیا آپ اس پیغام کا انگریزی "
+            "میں ترجمہ کر سکتے ہیں؟ میں سیکھنا چاہتا ہوں کہ ایک سادہ پروگرام کیسے لکھوں اور شروع کرنے کا بہترین "
+            "طریقہ کیا ہے؟ ہم آپ کے جواب کا انتظار کر رہے ہیں۔"
+        ),
+    },
+    "latin": {
+        "en": (
+            "The quick development of modern technology has changed the way people live and work. It is "
+            "important that we understand what this means for our children and for the future of the world. "
+            "Many of them are looking for a new job, and there is still a lot of work to be done in the cities "
+            "where they have been living for years. This is the time when everyone should think about what they "
+            "want and how they would like to get there with their friends and family. Hello, how are you today? "
+            "Thank you very much for your help. Could you please translate this message into Arabic? I want to "
+            "learn how to write a simple program, and which is the best way to start? We are waiting for your answer."
+        ),
+        "fr": (
+            "Le développement rapide de la technologie moderne a changé la façon dont les gens vivent et "
+            "travaillent. Il est important que nous comprenions ce que cela signifie pour nos enfants et pour "
+            "l'avenir du monde. Beaucoup d'entre eux cherchent un nouvel emploi, et il y a encore beaucoup de "
+            "travail à faire dans les villes où ils habitent depuis des années. C'est le moment où chacun doit "
+            "réfléchir à ce qu'il veut et à la manière dont il aimerait y arriver avec ses amis et sa famille. "
+            "Bonjour, comment allez-vous aujourd'hui ? Merci beaucoup pour votre aide. Pourriez-vous traduire ce "
+            "message en arabe ? Je veux apprendre à écrire un programme simple, et quelle est la meilleure façon "
+            "de commencer ? Nous attendons votre réponse."
+        ),
+        "es": (
+            "El rápido desarrollo de la tecnología moderna ha cambiado la forma en que las personas viven y "
+            "trabajan. Es importante que entendamos lo que esto significa para nuestros hijos y para el futuro "
+            "del mundo. Muchos de ellos están buscando un nuevo trabajo, y todavía queda mucho por hacer en las "
+            "ciudades donde han vivido durante años. Este es el momento en que cada uno debe pensar en lo que "
+            "quiere y en cómo le gustaría llegar allí con sus amigos y su familia. Hola, ¿cómo estás hoy? "
+            "Muchas gracias por tu ayuda. ¿Puedes traducir este mensaje al árabe, por favor? Quiero aprender a "
+            "escribir un programa sencillo, ¿y cuál es la mejor manera de empezar? Estamos esperando tu respuesta."
+        ),
+        "pt": (
+            "O rápido desenvolvimento da tecnologia moderna mudou a forma como as pessoas vivem e trabalham. "
+            "É importante que nós entendamos o que isso significa para os nossos filhos e para o futuro do mundo. "
+            "Muitos deles estão procurando um novo emprego, e ainda há muito trabalho a fazer nas cidades onde "
+            "eles moram há anos. Este é o momento em que cada um deve pensar no que quer e em como gostaria de "
+            "chegar lá com os seus amigos e a sua família. Olá, como você está hoje? Muito obrigado pela sua "
+            "ajuda. Você pode traduzir esta mensagem para o árabe, por favor? Eu quero aprender a escrever um "
+            "programa simples, e qual é a melhor maneira de começar? Não estamos com pressa, aguardamos a sua resposta."
+        ),
+        "it": (
+            "Il rapido sviluppo della tecnologia moderna ha cambiato il modo in cui le persone vivono e "
+            "lavorano. È importante che capiamo che cosa significa questo per i nostri figli e per il futuro "
+            "del mondo. Molti di loro stanno cercando un nuovo lavoro, e c'è ancora molto da fare nelle città "
+            "dove vivono da anni. Questo è il momento in cui ognuno dovrebbe pensare a quello che vuole e a come "
+            "gli piacerebbe arrivarci con gli amici e con la famiglia. Ciao, come stai oggi? Grazie mille per il "
+            "tuo aiuto. Puoi tradurre questo messaggio in arabo, per favore? Voglio imparare a scrivere un "
+            "programma semplice, e qual è il modo migliore per cominciare? Aspettiamo la vostra risposta."
+        ),
+        "de": (
+            "Die schnelle Entwicklung der modernen Technik hat die Art und Weise verändert, wie Menschen leben "
+            "und arbeiten. Es ist wichtig, dass wir verstehen, was das für unsere Kinder und für die Zukunft der "
+            "Welt bedeutet. Viele von ihnen suchen eine neue Arbeit, und es gibt noch viel zu tun in den Städten, "
+            "in denen sie seit Jahren wohnen. Jetzt ist die Zeit, in der jeder darüber nachdenken sollte, was er "
+            "möchte und wie er mit seinen Freunden und seiner Familie dorthin kommen würde. Hallo, wie geht es "
+            "dir heute? Vielen Dank für deine Hilfe. Kannst du diese Nachricht bitte ins Arabische übersetzen? "
+            "Ich möchte lernen, wie man ein einfaches Programm schreibt, und was ist der beste Weg, um anzufangen? "
+            "Wir warten auf deine Antwort."
+        ),
+        "nl": (
+            "De snelle ontwikkeling van de moderne technologie heeft de manier veranderd waarop mensen leven en "
+            "werken. Het is belangrijk dat we begrijpen wat dit betekent voor onze kinderen en voor de toekomst "
+            "van de wereld. Veel van hen zoeken een nieuwe baan, en er is nog veel werk te doen in de steden waar "
+            "ze al jaren wonen. Dit is het moment waarop iedereen moet nadenken over wat hij wil en hoe hij daar "
+            "met zijn vrienden en familie zou willen komen. Hallo, hoe gaat het vandaag met je? Heel erg bedankt "
+            "voor je hulp. Kun je dit bericht alsjeblieft in het Arabisch vertalen? Ik wil leren hoe ik een "
+            "eenvoudig programma schrijf, en wat is de beste manier om te beginnen? Wij wachten op jouw antwoord."
+        ),
+        "tr": (
+            "Modern teknolojinin hızlı gelişimi insanların yaşama ve çalışma biçimini değiştirdi. Bunun "
+            "çocuklarımız ve dünyanın geleceği için ne anlama geldiğini anlamamız önemlidir. Birçoğu yeni bir iş "
+            "arıyor ve yıllardır yaşadıkları şehirlerde daha yapılacak çok iş var. Şimdi herkesin ne istediğini "
+            "ve oraya arkadaşları ve ailesiyle nasıl ulaşmak istediğini düşünmesi gereken zamandır. Merhaba, "
+            "bugün nasılsın? Yardımın için çok teşekkür ederim. Bu mesajı lütfen Arapçaya çevirebilir misin? "
+            "Basit bir program yazmayı öğrenmek istiyorum, başlamanın en iyi yolu nedir? Cevabınızı bekliyoruz."
+        ),
+        "sw": (
+            "Maendeleo ya haraka ya teknolojia ya kisasa yamebadilisha jinsi watu wanavyoishi na kufanya kazi. "
+            "Ni muhimu kwamba tuelewe maana ya jambo hili kwa watoto wetu na kwa mustakabali wa dunia. Wengi "
+            "wao wanatafuta kazi mpya, na bado kuna kazi nyingi ya kufanya katika miji ambayo wameishi kwa miaka "
+            "mingi. Huu ni wakati ambapo kila mtu anapaswa kufikiri kuhusu anachotaka na jinsi angependa kufika "
+            "huko pamoja na marafiki na familia yake. Habari yako, hujambo leo? Asante sana kwa msaada wako. "
+            "Tafadhali unaweza kutafsiri ujumbe huu kwa Kiarabu? Nataka kujifunza jinsi ya kuandika programu "
+            "rahisi, na ni njia gani bora ya kuanza? Tunasubiri jibu lako."
+        ),
+    },
+}
+
+
+@lru_cache(maxsize=8192)
+def _script(ch):
+    """Writing system of one character, or None for digits, punctuation and symbols."""
+    if not ch.isalpha():
+        return None
+    code = ord(ch)
+    index = bisect_right(_RANGE_STARTS, code) - 1
+    if index >= 0:
+        start, end, script = _SCRIPT_RANGES[index]
+        if code <= end:
+            return script
+    return None
+
+
+def _clean(text, script):
+    """Lowercase letters of `script` only, everything else (incl. diacritics/ZWNJ) becomes a space."""
+    chars = []
+    for ch in text.lower():
+        if _script(ch) == script:
+            chars.append(ch)
+        elif unicodedata.category(ch) != "Mn" and ch != "ـ": # الحركات والتطويل لا تفصل الكلمات
+            chars.append(" ")
+    return "".join(chars)
+
+
+def _trigrams(text):
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def _build_profiles():
+    """Per script: {lang: (log-probabilities of seen trigrams, log-probability of an unseen one)}."""
+    profiles = {}
+    for script, samples in _SAMPLES.items():
+        counts = {lang: Counter(_trigrams(_clean(sample, script))) for lang, sample in samples.items()}
+        vocabulary = len(set().union(*counts.values()))
+        profiles[script] = {}
+        for lang, counter in counts.items():
+            denominator = sum(counter.values()) + _ALPHA * vocabulary
+            logprobs = {gram: math.log((count + _ALPHA) / denominator) for gram, count in counter.items()}
+            profiles[script][lang] = (logprobs, math.log(_ALPHA / denominator))
+    return profiles
+
+
+_PROFILES = _build_profiles()
+
+
+def detect(text):
+    """
+    Detect the language of `text` without any network call.
+
+    Returns (code, confidence) where confidence is in [0, 1], or ("unknown", 0.0)
+    when the text has no letters. The dominant script decides directly for
+    scripts used by a single supported language; Arabic-script and Latin-script
+    text is scored against character-trigram profiles.
+    """
+    text = text[:_MAX_CHARS]
+    scripts = Counter(script for script in map(_script, text) if script)
+    letters = sum(scripts.values())
+    if not letters:
+        return "unknown", 0.0
+
+    # الصينية واليابانية تشتركان في الرموز الصينية؛ وجود الكانا يعني اليابانية
+    kana = scripts.pop("kana", 0)
+    cjk = kana + scripts.pop("han", 0)
+    if cjk:
+        scripts["ja" if kana / cjk >= 0.05 else "zh"] = cjk
+
+    script, count = scripts.most_common(1)[0]
+    share = count / letters
+    if script in ("ja", "zh"):
+        return script, share
+    if script in _SINGLE_LANGUAGE_SCRIPTS:
+        return _SINGLE_LANGUAGE_SCRIPTS[script], share
+
+    scores = []
+    grams = Counter(_trigrams(_clean(text, script)))
+    for lang, (logprobs, unseen) in _PROFILES[script].items():
+        scores.append((sum(n * logprobs.get(gram, unseen) for gram, n in grams.items()), lang))
+    scores.sort(reverse=True)
+    (best, lang), (runner_up, _) = scores[0], scores[1]
+    # الفارق اللوغاريتمي بين أفضل لغتين: فارق 2.3 تقريبًا يعطي ثقة 0.9
+    return lang, share * (1 - math.exp(runner_up - best))
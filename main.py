@@ -1,11 +1,9 @@
-from app import app, db
+from app import create_app, migrate_database
 
-# Create all tables if they don't exist
-with app.app_context():
-    from models import Conversation, Message
-    db.create_all()
-    print("Database tables created successfully")
+# تطبيق التطوير المحلي: ترحيل المخطط مرة واحدة ثم التشغيل
+app = create_app()
 
 if __name__ == '__main__':
+    migrate_database(app)
     # Run the Flask application on port 5000
     app.run(host='0.0.0.0', port=5000, debug=True)
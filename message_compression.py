@@ -0,0 +1,113 @@
+import os
+import zlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, func, or_, select, update
+
+try:
+    import zstandard # اختياري: ضغط أفضل وأسرع من zlib
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# --- ضغط محتوى الرسائل ---
+# الرسائل المضغوطة يُفرَّغ عمودها النصي (content = '') ويُخزَّن نصها في content_compressed.
+# الرسائل الطويلة (COMPRESS_LARGER_THAN حرفًا فأكثر) تُضغط عند كتابتها (stored_columns)،
+# والقديمة تُضغط لاحقًا بالأمر `flask compact-messages` (compact).
+CODEC = os.environ.get("MESSAGE_COMPRESSION_CODEC", "zstd" if zstandard else "zlib")
+COMPRESS_AFTER_DAYS = float(os.environ.get("MESSAGE_COMPRESS_AFTER_DAYS", 30))
+COMPRESS_LARGER_THAN = int(os.environ.get("MESSAGE_COMPRESS_LARGER_THAN", 8000)) # بالأحرف، بغض النظر عن العمر
+COMPRESS_ON_WRITE = os.environ.get("MESSAGE_COMPRESS_ON_WRITE", "on").lower() in ("1", "true", "on", "yes")
+COMPACT_BATCH_SIZE = int(os.environ.get("MESSAGE_COMPACT_BATCH_SIZE", 500))
+MIN_LENGTH = 200 # الرسائل الأقصر لا يوفر ضغطها شيئًا يُذكر
+
+# البايت الأول من القيمة المضغوطة يحدد الخوارزمية
+_ZLIB = b"z"
+_ZSTD = b"s"
+
+
+def compress(content, codec=CODEC):
+    """Compress message text; the result starts with a one-byte codec tag."""
+    raw = content.encode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("MESSAGE_COMPRESSION_CODEC=zstd requires the 'zstandard' package")
+        return _ZSTD + zstandard.ZstdCompressor(level=6).compress(raw)
+    return _ZLIB + zlib.compress(raw, 6)
+
+
+def decompress(blob):
+    tag, payload = blob[:1], blob[1:]
+    if tag == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Message was compressed with zstd, but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return zlib.decompress(payload).decode("utf-8")
+
+
+def stored_text(content, compressed):
+    """The text of a message row given its `content` and `content_compressed` columns."""
+    return content if compressed is None else decompress(bytes(compressed))
+
+
+def stored_columns(content):
+    """
+    The `content` / `content_compressed` column values for writing message text:
+    compressed when COMPRESS_ON_WRITE is on, the text has at least
+    COMPRESS_LARGER_THAN characters and compression actually shrinks it.
+    """
+    if COMPRESS_ON_WRITE and len(content) >= max(COMPRESS_LARGER_THAN, MIN_LENGTH):
+        blob = compress(content)
+        if len(blob) < len(content.encode("utf-8")):
+            return {"content": "", "content_compressed": blob}
+    return {"content": content, "content_compressed": None}
+
+
+def compact(get_engine, messages_table, older_than_days=COMPRESS_AFTER_DAYS,
+            larger_than=COMPRESS_LARGER_THAN, batch_size=COMPACT_BATCH_SIZE):
+    """
+    Compress uncompressed messages older than `older_than_days` or longer than
+    `larger_than` characters, one transaction per `batch_size` rows. Rows that
+    would not shrink, or that changed since they were read, are left alone.
+    Returns {"messages", "bytes_before", "bytes_after"} for the rows actually
+    compressed.
+    """
+    m = messages_table
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    candidates = (
+        select(m.c.id, m.c.content, m.c.created_at)
+        .where(m.c.content_compressed.is_(None), func.length(m.c.content) >= MIN_LENGTH,
+               or_(m.c.created_at < cutoff, func.length(m.c.content) >= larger_than))
+        .order_by(m.c.id).limit(batch_size)
+    )
+    # created_at يتغير عند استبدال الرد (إعادة التوليد)، فلا نكتب فوق نص أحدث مما قرأناه
+    swap = (
+        update(m)
+        .where(m.c.id == bindparam("b_id"), m.c.created_at == bindparam("b_created_at"),
+               m.c.content_compressed.is_(None))
+        .values(content="", content_compressed=bindparam("b_blob"))
+    )
+    totals = {"messages": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+    while True:
+        with get_engine().begin() as conn:
+            rows = conn.execute(candidates.where(m.c.id > last_id)).all()
+            if not rows:
+                break
+            swapped = 0
+            for row in rows:
+                before = len(row.content.encode("utf-8"))
+                blob = compress(row.content)
+                if len(blob) >= before:
+                    continue
+                # صف بصف حتى نعرف أي الصفوف تغيرت فعلاً (executemany لا يعطي rowcount موثوقًا لكل صف)
+                if conn.execute(swap, {"b_id": row.id, "b_created_at": row.created_at, "b_blob": blob}).rowcount:
+                    swapped += 1
+                    totals["bytes_before"] += before
+                    totals["bytes_after"] += len(blob)
+            totals["messages"] += swapped
+            last_id = rows[-1].id
+        logger.info(f"Compacted {swapped}/{len(rows)} messages (up to id {last_id}).")
+    return totals
@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# --- مقاييس Prometheus ---
+# مع gunicorn (عدة عمليات) يجب ضبط PROMETHEUS_MULTIPROC_DIR قبل تشغيل العمال (انظر gunicorn.conf.py)،
+# فتكتب كل عملية قيمها في ملفات مشتركة وتُجمع عند طلب /metrics
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+_PROVIDER_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90)
+_DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HTTP_LATENCY = Histogram(
+    "dzgpt_http_request_duration_seconds",
+    "Time to produce a response (for streamed responses: until the stream starts).",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS,
+)
+PROVIDER_LATENCY = Histogram(
+    "dzgpt_provider_request_duration_seconds",
+    "Duration of upstream model calls, including the whole stream for streamed calls.",
+    ["provider", "model", "outcome"], buckets=_PROVIDER_BUCKETS,
+)
+FALLBACKS = Counter(
+    "dzgpt_provider_fallbacks_total",
+    "Replies that fell back to a later stage of the OpenRouter -> Gemini -> offline chain.",
+    ["stage"],
+)
+TOKENS = Counter(
+    "dzgpt_provider_tokens_total",
+    "Tokens reported by the providers' usage data.",
+    ["provider", "model", "kind"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "dzgpt_db_query_duration_seconds",
+    "Database statement execution time.",
+    ["operation"], buckets=_DB_BUCKETS,
+)
+DB_POOL_WAIT = Histogram(
+    "dzgpt_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the SQLAlchemy pool.",
+    buckets=_DB_BUCKETS,
+)
+
+
+def observe_provider(provider, model, outcome, seconds):
+    PROVIDER_LATENCY.labels(provider, model, outcome).observe(seconds)
+
+
+def timed_call(provider, model, call, cancel_event=None):
+    """
+    Run `call() -> (reply, error)` and record its latency as success, error,
+    or cancelled (the loser of a hedged race).
+    """
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        reply, error = call()
+        if reply:
+            outcome = "success"
+        elif cancel_event is not None and cancel_event.is_set():
+            outcome = "cancelled"
+        return reply, error
+    finally:
+        observe_provider(provider, model, outcome, time.monotonic() - started)
+
+
+def record_fallback(stage):
+    FALLBACKS.labels(stage).inc()
+
+
+def record_usage(provider, model, prompt_tokens, completion_tokens):
+    """Count prompt/completion tokens; missing values are ignored."""
+    if prompt_tokens:
+        TOKENS.labels(provider, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        TOKENS.labels(provider, model, "completion").inc(completion_tokens)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["metrics_query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    # الاستعلام الفاشل لا يصل إلى after_cursor_execute
+    stack = exception_context.connection.info.get("metrics_query_started") if exception_context.connection else None
+    if stack:
+        stack.pop()
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _observe_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - started)
+    return response
+
+
+def metrics_view():
+    """Prometheus text exposition of this process, or of all workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Time every request and database statement, and serve GET /metrics."""
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    if MULTIPROC_DIR:
+        logger.info(f"Prometheus multiprocess mode (PROMETHEUS_MULTIPROC_DIR={MULTIPROC_DIR}).")
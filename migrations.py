@@ -0,0 +1,159 @@
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, LargeBinary, MetaData, String, Table, Text,
+                        inspect, insert, select, text)
+from sqlalchemy.dialects.postgresql import UUID
+
+logger = logging.getLogger(__name__)
+
+# --- ترحيلات المخطط (schema migrations) ---
+# تُشغَّل مرة واحدة قبل بدء العمال (gunicorn.conf.py أو `flask migrate`)، لا عند استيراد التطبيق.
+# كل ترحيل يُطبَّق في معاملة واحدة ويُسجَّل رقمه في schema_migrations.
+# أضف الترحيلات الجديدة في آخر MIGRATIONS برقم أكبر، ولا تغيّر ترحيلاً طُبِّق من قبل:
+# أي تغيير في models.py بعد المخطط الأساسي يحتاج ترحيلاً جديدًا هنا.
+
+_ADVISORY_LOCK_ID = 725091 # قفل PostgreSQL يمنع عمليتين من الترحيل في الوقت نفسه
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+
+# --- المخطط الأساسي (الترحيل 1) مجمّدًا كما كانت النماذج عند إدخال الترحيلات ---
+# لا يُقرأ من models.py، حتى لا يتغير ما يُنشئه الترحيل 1 عندما تتغير النماذج لاحقًا
+_baseline_metadata = MetaData()
+
+Table(
+    "conversations", _baseline_metadata,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("title", String(100), nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Column("updated_at", DateTime(timezone=True), nullable=False),
+    Column("summary", Text),
+    Column("summary_upto_id", Integer),
+    Column("message_count", Integer, nullable=False, server_default="0"),
+    Column("last_message_preview", String(120)),
+    Column("last_role", String(20)),
+    Index("ix_conversations_updated_at_id", "updated_at", "id"),
+)
+
+Table(
+    "messages", _baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("conversation_id", UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"),
+           nullable=False, index=True),
+    Column("role", String(20), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("content_compressed", LargeBinary),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+)
+
+Table(
+    "translation_cache", _baseline_metadata,
+    Column("key", String(64), primary_key=True),
+    Column("source_lang", String(10), nullable=False),
+    Column("target_lang", String(10), nullable=False),
+    Column("translated_text", Text, nullable=False),
+    Column("provider", String(50)),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+)
+
+Table(
+    "idempotency_keys", _baseline_metadata,
+    Column("key", String(64), primary_key=True),
+    Column("request_hash", String(64), nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("response_status", Integer),
+    Column("response_mimetype", String(100)),
+    Column("response_body", Text),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Column("expires_at", DateTime(timezone=True), nullable=False, index=True),
+)
+
+
+def add_missing_columns_and_indexes(conn, metadata):
+    """
+    Add columns and indexes declared in `metadata` but missing from existing
+    tables (nullable, or NOT NULL with a server default); never drops or alters.
+    """
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=conn.dialect)
+                if column.server_default is not None:
+                    column_type += f" NOT NULL DEFAULT {column.server_default.arg}" if not column.nullable \
+                                   else f" DEFAULT {column.server_default.arg}"
+                logger.info(f"Schema upgrade: adding column {table.name}.{column.name} ({column_type})")
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        existing_indexes = {idx['name'] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info(f"Schema upgrade: creating index {index.name} on {table.name}")
+                index.create(conn)
+
+
+def _baseline(conn, search_index):
+    # قواعد البيانات التي أنشأها create_all القديم عند بدء التشغيل تُستكمل هنا بدلاً من إعادة إنشائها
+    _baseline_metadata.create_all(conn)
+    add_missing_columns_and_indexes(conn, _baseline_metadata)
+
+
+def _search_index(conn, search_index):
+    if search_index.ensure(conn):
+        search_index.backfill(conn) # فهرسة الرسائل الموجودة مسبقًا (مرة واحدة)
+
+
+# (الرقم، الاسم، الدالة(conn, search_index))
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "full-text search index", _search_index),
+]
+
+
+def _lock(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table(schema_migrations.name):
+        return set()
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine):
+    """Migrations not yet applied to the database, as (version, name) pairs."""
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+def upgrade(engine, search_index):
+    """
+    Apply pending migrations in order, each in its own transaction, and return
+    the (version, name) pairs applied. Safe to run from several processes at
+    once on PostgreSQL (advisory lock); already applied versions are skipped.
+    """
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock(conn)
+            schema_migrations.create(conn, checkfirst=True)
+            if version in applied_versions(conn):
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            migrate(conn, search_index)
+            conn.execute(insert(schema_migrations).values(
+                version=version, name=name, applied_at=datetime.now(timezone.utc)))
+        applied.append((version, name))
+    return applied
@@ -1,68 +1,195 @@
-from app import db
-from datetime import datetime
-
-
-# Database models for conversations
-class Conversation(db.Model):
-    id = db.Column(db.String(36), primary_key=True)  # UUID format
-    title = db.Column(db.String(100), nullable=False, default="محادثة جديدة")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime,
-                           default=datetime.utcnow,
-                           onupdate=datetime.utcnow)
-
-    # One-to-many relationship with Message
-    # cascade="all, delete-orphan" ensures messages are deleted when conversation is deleted
-    messages = db.relationship(
-        'Message',
-        backref='conversation',
-        lazy='dynamic',
-        cascade="all, delete-orphan"
-    )  # Use lazy='dynamic' for better filtering/ordering queries
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone # استخدام timezone aware datetime
+from typing import Optional
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, ColumnElement, Integer, LargeBinary, String, Text, DateTime, ForeignKey, Index, inspect
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import UUID # لاستخدام نوع UUID الأصلي في PostgreSQL
+
+import message_compression
+
+# --- Base Class for SQLAlchemy models (أسلوب حديث) ---
+class Base(DeclarativeBase):
+    pass
+
+# كائن SQLAlchemy الوحيد؛ يُربط بالتطبيق في create_app (app.py)
+db = SQLAlchemy(model_class=Base)
+
+# طول معاينة آخر رسالة المخزنة مع المحادثة (للقائمة الجانبية)
+PREVIEW_CHARS = 120
+
+
+def message_preview(content):
+    """One-line excerpt of a message for the sidebar (whitespace collapsed, at most PREVIEW_CHARS)."""
+    preview = " ".join(content[:PREVIEW_CHARS * 2].split())
+    return preview if len(preview) <= PREVIEW_CHARS else preview[:PREVIEW_CHARS - 1] + "…"
+
+# --- تعريف نماذج قاعدة البيانات ---
+
+class Conversation(Base):
+    __tablename__ = "conversations" # استخدام صيغة الجمع أفضل
+
+    # استخدام Mapped و mapped_column للأسلوب الحديث
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    title: Mapped[str] = mapped_column(String(100), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # ملخص متراكم للرسائل القديمة التي لم تعد تتسع في نافذة السياق
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    summary_upto_id: Mapped[Optional[int]] = mapped_column(nullable=True) # آخر رسالة مشمولة في الملخص
+    # أعمدة مشتقة للقائمة الجانبية، تُحدَّث مع كل رسالة (لا حاجة لربط جدول الرسائل)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    last_message_preview: Mapped[Optional[str]] = mapped_column(String(PREVIEW_CHARS), nullable=True)
+    last_role: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
+
+    # العلاقة مع الرسائل (one-to-many)
+    # cascade: حذف الرسائل تلقائيًا عند حذف المحادثة
+    # back_populates: يربط العلاقة بالاتجاه المعاكس في نموذج Message
+    # order_by: ترتيب الرسائل تلقائيًا عند الوصول إليها من المحادثة
+    messages: Mapped[list["Message"]] = relationship(
+        "Message",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        passive_deletes=True, # قاعدة البيانات تحذف الرسائل (ON DELETE CASCADE) دون تحميلها
+        order_by="Message.created_at",
+        lazy="selectin" # تحميل الرسائل مع المحادثة بكفاءة
+    )
+
+    # فهرس لترقيم صفحات القائمة الجانبية بالمفتاح (updated_at, id)
+    __table_args__ = (
+        Index("ix_conversations_updated_at_id", "updated_at", "id"),
+    )
+
+    def add_message(self, role: str, content: str):
+        """ Helper method to add a message to this conversation """
+        new_message = Message(
+            conversation_id=self.id, # ربط الرسالة بهذه المحادثة
+            role=role,
+            **message_compression.stored_columns(content) # الرسائل الطويلة تُخزَّن مضغوطة
+        )
+        # إضافة الرسالة إلى الجلسة (سيتم ربطها تلقائيًا بالمحادثة عبر العلاقة)
+        db.session.add(new_message)
+        # زيادة العداد في SQL (message_count + 1) للمحادثات المحفوظة، حتى لا تضيع زيادات الطلبات المتزامنة؛
+        # وتتراكم الزيادات إذا أضيفت عدة رسائل قبل الـ flush
+        current = self.__dict__.get("message_count")
+        if inspect(self).persistent:
+            base = current if isinstance(current, ColumnElement) else Conversation.message_count
+        else:
+            base = current or 0
+        self.message_count = base + 1
+        self.last_message_preview = message_preview(content)
+        self.last_role = role
+        # تحديث وقت تعديل المحادثة (يمكن أن يتم تلقائيًا عبر onupdate إذا كان الحقل موجودًا)
+        self.updated_at = datetime.now(timezone.utc)
+        return new_message # قد يكون مفيدًا إرجاع الرسالة المُنشأة
 
     def to_dict(self):
+        """ Serialize conversation and its messages to a dictionary """
         return {
-            "id":
-            self.id,
-            "title":
-            self.title,
-            "created_at":
-            self.created_at.isoformat() if self.created_at else None,
-            "updated_at":
-            self.updated_at.isoformat() if self.updated_at else None,
-            # Order messages by created_at when converting to dict
-            # Using .all() with order_by() on the dynamic relationship
-            "messages": [
-                msg.to_dict()
-                for msg in self.messages.order_by(Message.created_at).all()
-            ]
+            "id": self.id, # UUID والتواريخ يرمّزها json_provider مباشرة
+            "title": self.title,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "message_count": self.message_count,
+            "last_message_preview": self.last_message_preview,
+            "last_role": self.last_role,
+            # تحويل كل رسالة في قائمة الرسائل إلى قاموس
+            "messages": [message.to_dict() for message in self.messages]
         }
 
-    def add_message(self, role, content):
-        """Helper method to add a message to this conversation"""
-        message = Message(role=role, content=content, conversation_id=self.id)
-        db.session.add(message)
-        self.updated_at = datetime.utcnow()  # Update conversation timestamp
-        return message
+    def __repr__(self):
+        return f"<Conversation(id={self.id}, title='{self.title}')>"
+
+class Message(Base):
+    __tablename__ = "messages" # استخدام صيغة الجمع
 
+    id: Mapped[int] = mapped_column(primary_key=True) # استخدام auto-incrementing integer كـ PK
+    # ربط بالـ UUID الخاص بالمحادثة
+    conversation_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+    role: Mapped[str] = mapped_column(String(20), nullable=False) # 'user' or 'assistant'
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    # نص الرسائل القديمة/الطويلة بعد ضغطها (content يصبح '')؛ انظر message_compression
+    content_compressed: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
-class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
-    content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    conversation_id = db.Column(db.String(36),
-                                db.ForeignKey('conversation.id'),
-                                nullable=False)
+    # العلاقة العكسية مع المحادثة (many-to-one)
+    conversation: Mapped["Conversation"] = relationship("Conversation", back_populates="messages")
 
-    # Indexing conversation_id can improve query performance
-    __table_args__ = (db.Index('idx_message_conversation_id_created_at',
-                               'conversation_id', 'created_at'), )
+    # فهرس مركب لجلب رسائل محادثة واحدة مرتبة زمنيًا (بناء السجل من جهة الخادم)
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"), # ترقيم صفحات الرسائل بالمعرّف
+    )
 
     def to_dict(self):
+        """ Serialize message to a dictionary """
         return {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
             "role": self.role,
             "content": self.content,
-            "created_at":
-            self.created_at.isoformat() if self.created_at else None
+            "created_at": self.created_at
         }
+
+    def __repr__(self):
+        return f"<Message(id={self.id}, role='{self.role}', conv_id={self.conversation_id})>"
+
+
+@event.listens_for(Message, "load")
+@event.listens_for(Message, "refresh")
+def _expand_compressed_content(target, *args):
+    """Objects loaded through the ORM always carry the plain text in `content`."""
+    if target.__dict__.get("content_compressed") is not None:
+        set_committed_value(target, "content", message_compression.decompress(target.content_compressed))
+
+
+@event.listens_for(Message, "after_insert")
+def _expand_after_insert(mapper, connection, target):
+    # رسالة كُتبت مضغوطة (stored_columns) تبقى بنصها الكامل في الذاكرة بعد الـ flush
+    _expand_compressed_content(target)
+
+
+@event.listens_for(Message.content, "set")
+def _drop_compressed_content(target, value, oldvalue, initiator):
+    # نص جديد يُخزَّن دون ضغط
+    if target.__dict__.get("content_compressed") is not None:
+        target.content_compressed = None
+
+
+# صف رسالة مقروء عبر Core بعد فك الضغط
+StoredMessage = namedtuple("StoredMessage", ["id", "role", "content", "created_at"])
+
+
+class TranslationCacheEntry(Base):
+    __tablename__ = "translation_cache"
+
+    # مفتاح SHA-256 للثلاثية (النص المطبّع، لغة المصدر، اللغة الهدف)
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    source_lang: Mapped[str] = mapped_column(String(10), nullable=False)
+    target_lang: Mapped[str] = mapped_column(String(10), nullable=False)
+    translated_text: Mapped[str] = mapped_column(Text, nullable=False)
+    provider: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"<TranslationCacheEntry(key={self.key[:12]}, {self.source_lang}->{self.target_lang})>"
+
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    # SHA-256 لـ (نقطة النهاية، قيمة ترويسة Idempotency-Key)
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False) # بصمة جسم الطلب
+    status: Mapped[str] = mapped_column(String(16), nullable=False) # in_progress / completed
+    response_status: Mapped[Optional[int]] = mapped_column(nullable=True)
+    response_mimetype: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    response_body: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyRecord(key={self.key[:12]}, status={self.status})>"
@@ -0,0 +1,164 @@
+import os
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import json_provider
+
+logger = logging.getLogger(__name__)
+
+# --- عناوين مزودي النماذج ---
+# قابلة للتغيير لتوجيه الطلبات إلى خادم محاكاة محلي (انظر benchmarks/mock_providers.py)
+OPENROUTER_CHAT_URL = os.environ.get("OPENROUTER_CHAT_URL", "https://openrouter.ai/api/v1/chat/completions")
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+GEMINI_CHAT_MODEL = "gemini-1.5-flash-latest" # النموذج الاحتياطي لمسار المحادثة
+
+# --- إعدادات الاتصال (قابلة للتعديل عبر متغيرات البيئة) ---
+# حجم الـ pool لكل مضيف = أقصى عدد اتصالات keep-alive محفوظة لذلك المضيف في كل عامل (worker)
+DEFAULT_POOL_MAXSIZE = int(os.environ.get("PROVIDER_POOL_MAXSIZE", 10))
+OPENROUTER_POOL_MAXSIZE = int(os.environ.get("OPENROUTER_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+GEMINI_POOL_MAXSIZE = int(os.environ.get("GEMINI_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+
+# مهلة إنشاء الاتصال منفصلة عن مهلة القراءة: فشل الاتصال يجب أن يظهر بسرعة
+CONNECT_TIMEOUT = float(os.environ.get("PROVIDER_CONNECT_TIMEOUT", 5))
+OPENROUTER_TIMEOUT = float(os.environ.get("OPENROUTER_TIMEOUT", 45))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 30))
+
+_session_lock = threading.Lock()
+_session = None
+_session_pid = None
+_cancel_local = threading.local()
+
+
+class _CancelScope:
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+        self.active = True
+
+
+@contextmanager
+def cancel_on(cancel_event):
+    """
+    Abort the provider calls this thread makes inside the block once
+    `cancel_event` is set, even one still waiting for its first byte: the
+    socket is shut down, so the blocked read fails at once with a
+    `requests.exceptions.RequestException`. `cancel_event` must offer
+    add_callback(fn), like hedging.CancelEvent.
+    """
+    previous = getattr(_cancel_local, "scope", None)
+    scope = _cancel_local.scope = _CancelScope(cancel_event)
+    try:
+        yield
+    finally:
+        scope.active = False
+        _cancel_local.scope = previous
+
+
+class _CancellableConnectionMixin:
+    def getresponse(self, *args, **kwargs):
+        scope = getattr(_cancel_local, "scope", None)
+        self._cancel_token = token = object()
+        if scope is not None and self.sock is not None:
+            sock = self.sock
+
+            def abort():
+                # بعد انتهاء الكتلة أو إعادة استخدام الاتصال لطلب آخر لا نلمس المقبس
+                if scope.active and self._cancel_token is token:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            scope.cancel_event.add_callback(abort)
+        return super().getresponse(*args, **kwargs)
+
+
+class _HTTPConnection(_CancellableConnectionMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _ProviderAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections can be aborted from another thread via cancel_on()."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _build_session():
+    """Create a session with one keep-alive connection pool per provider host."""
+    session = requests.Session()
+    pools = {
+        _origin(OPENROUTER_CHAT_URL): OPENROUTER_POOL_MAXSIZE,
+        _origin(GEMINI_API_BASE): GEMINI_POOL_MAXSIZE,
+    }
+    for prefix, maxsize in pools.items():
+        # pool_block=False: عند امتلاء الـ pool يُفتح اتصال إضافي مؤقت بدلاً من انتظار اتصال حر
+        session.mount(prefix, _ProviderAdapter(pool_connections=1, pool_maxsize=maxsize, pool_block=False))
+    # أي مضيف آخر يحصل على pool افتراضي
+    session.mount("https://", _ProviderAdapter(pool_maxsize=DEFAULT_POOL_MAXSIZE))
+    session.mount("http://", _ProviderAdapter(pool_maxsize=DEFAULT_POOL_MAXSIZE))
+    return session
+
+
+def get_session():
+    """
+    Return the process-wide provider session.
+
+    The session is created lazily and rebuilt after a fork, so gunicorn workers
+    never share sockets inherited from the master process.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+                logger.debug(f"Created provider HTTP session for process {pid}")
+    return _session
+
+
+def post(url, json=None, headers=None, timeout=None, stream=False):
+    """
+    POST to a provider through the shared keep-alive pools.
+
+    `timeout` is the read timeout in seconds; the connect timeout is always
+    CONNECT_TIMEOUT. Exceptions are the usual `requests.exceptions` types.
+    """
+    read_timeout = timeout if timeout is not None else OPENROUTER_TIMEOUT
+    data = None
+    if json is not None: # نرمّز الجسم بأنفسنا (orjson إن توفر) بدلاً من json القياسية داخل requests
+        data = json_provider.dumps_bytes(json)
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+    return get_session().post(url, data=data, headers=headers,
+                              timeout=(CONNECT_TIMEOUT, read_timeout), stream=stream)
+
+
+def gemini_url(model, method, api_key, **params):
+    """Build a Gemini REST URL such as `.../models/<model>:generateContent?key=...`."""
+    query = "&".join([f"{k}={v}" for k, v in params.items()] + [f"key={api_key}"])
+    return f"{GEMINI_API_BASE}/models/{model}:{method}?{query}"
@@ -0,0 +1,237 @@
+import os
+import re
+import html
+import logging
+import unicodedata
+
+import message_compression
+
+from sqlalchemy import event, inspect, text, bindparam, column, table, select, delete, Float
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات البحث النصي الكامل ---
+SNIPPET_CHARS = int(os.environ.get("SEARCH_SNIPPET_CHARS", 160))
+_BACKFILL_BATCH = 1000
+
+# التشكيل وعلامات القرآن والتطويل: تُحذف قبل الفهرسة والبحث
+_ARABIC_MARKS = "\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640"
+_MARKS_RE = re.compile(f"[{_ARABIC_MARKS}]")
+# توحيد أشكال الألف والياء والتاء المربوطة والهمزة (والحروف الفارسية الشائعة في النص العربي)
+_UNIFY = str.maketrans({
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627", # أ إ آ ٱ -> ا
+    "\u0649": "\u064A", "\u06CC": "\u064A", "\u0626": "\u064A", # ى ی ئ -> ي
+    "\u0629": "\u0647", # ة -> ه
+    "\u0624": "\u0648", # ؤ -> و
+    "\u06A9": "\u0643", # ک -> ك
+})
+# أداة التعريف مع حروف العطف والجر المتصلة: وال، بال، كال، فال، لل، ال
+_ARTICLE_PREFIXES = ("\u0648\u0627\u0644", "\u0628\u0627\u0644", "\u0643\u0627\u0644", "\u0641\u0627\u0644", "\u0644\u0644", "\u0627\u0644")
+_TOKEN_RE = re.compile(r"\w+")
+_ORIGINAL_WORD_RE = re.compile(rf"[\w{_ARABIC_MARKS}]+") # كلمة في النص الأصلي مع تشكيلها
+
+
+def normalize(value):
+    """Search normal form: NFKC, no tashkeel/tatweel, unified alef/yaa/taa-marbuta, lowercase."""
+    value = unicodedata.normalize("NFKC", value) # يحول أيضًا أشكال العرض العربية إلى الحروف الأساسية
+    return _MARKS_RE.sub("", value).translate(_UNIFY).lower()
+
+
+def stem(token):
+    """Strip the definite article (with an attached و/ب/ك/ف/ل) so 'المدرسة' also matches 'مدرسة'."""
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 3:
+            return token[len(prefix):]
+    return token
+
+
+def tokens(value):
+    """Normalized, stemmed words of `value`, as stored in the index and used in queries."""
+    return [stem(token) for token in _TOKEN_RE.findall(normalize(value))]
+
+
+def document(content):
+    """The text that gets indexed for a message."""
+    return " ".join(tokens(content))
+
+
+def snippet(content, query_tokens, width=SNIPPET_CHARS):
+    """
+    HTML-escaped excerpt of `content` around the first match, with matching
+    words wrapped in <mark>. The last query token also matches as a prefix.
+    """
+    exact, prefix = set(query_tokens[:-1]), query_tokens[-1]
+    matches = []
+    for match in _ORIGINAL_WORD_RE.finditer(content):
+        word = stem(normalize(match.group()))
+        if word in exact or word.startswith(prefix):
+            matches.append(match.span())
+
+    start = max(0, matches[0][0] - width // 3) if matches else 0
+    end = min(len(content), start + width)
+    if start > 0:
+        space = content.find(" ", start, matches[0][0]) if matches else -1
+        start = space + 1 if space != -1 else start
+
+    parts = ["…" if start > 0 else ""]
+    cursor = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(html.escape(content[cursor:match_start]))
+        parts.append(f"<mark>{html.escape(content[match_start:match_end])}</mark>")
+        cursor = match_end
+    parts.append(html.escape(content[cursor:end]))
+    parts.append("…" if end < len(content) else "")
+    return "".join(parts)
+
+
+class SearchIndex:
+    """
+    Full-text index over messages, kept in a side table `message_search`.
+
+    PostgreSQL: a tsvector column with a GIN index ('simple' configuration,
+    since the text is normalized here first). SQLite: an FTS5 table whose
+    rowid is the message id. Both store the normalized document, so Arabic
+    matches regardless of tashkeel or alef/yaa/taa-marbuta spelling.
+    """
+
+    TABLE = "message_search"
+
+    def __init__(self, messages_table, conversations_table):
+        self.messages = messages_table
+        self.conversations = conversations_table
+
+    # --- إنشاء الفهرس ---
+    def ensure(self, conn):
+        """Create the index table if needed; returns True if it was just created."""
+        exists = inspect(conn).has_table(self.TABLE)
+        if exists:
+            return False
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(
+                f"CREATE TABLE {self.TABLE} ("
+                f" message_id INTEGER PRIMARY KEY REFERENCES {self.messages.name}(id) ON DELETE CASCADE,"
+                f" document TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text(f"CREATE INDEX ix_{self.TABLE}_document ON {self.TABLE} USING GIN (document)"))
+        else:
+            conn.execute(text(f"CREATE VIRTUAL TABLE {self.TABLE} USING fts5(document)"))
+        logger.info(f"Created full-text index table '{self.TABLE}' ({conn.dialect.name}).")
+        return True
+
+    def rebuild(self, conn):
+        """Drop every index entry and re-index all messages; returns the number indexed."""
+        conn.execute(text(f"DELETE FROM {self.TABLE}"))
+        return self.backfill(conn)
+
+    def backfill(self, conn):
+        """Index messages that have no entry yet (ids above the highest indexed one)."""
+        id_column = "message_id" if conn.dialect.name == "postgresql" else "rowid"
+        last_id = conn.execute(text(f"SELECT COALESCE(MAX({id_column}), 0) FROM {self.TABLE}")).scalar()
+        total = 0
+        while True:
+            rows = conn.execute(
+                self.messages.select().with_only_columns(self.messages.c.id, self.messages.c.content,
+                                                         self.messages.c.content_compressed)
+                .where(self.messages.c.id > last_id).order_by(self.messages.c.id).limit(_BACKFILL_BATCH)
+            ).all()
+            if not rows:
+                break
+            self.index(conn, [(row.id, message_compression.stored_text(row.content, row.content_compressed))
+                              for row in rows])
+            total += len(rows)
+            last_id = rows[-1].id
+        if total:
+            logger.info(f"Indexed {total} messages for full-text search.")
+        return total
+
+    # --- التحديث التدريجي ---
+    def index(self, conn, rows):
+        """Index (message_id, content) pairs, replacing existing entries."""
+        params = [{"id": message_id, "document": document(content)} for message_id, content in rows]
+        if not params:
+            return
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(
+                f"INSERT INTO {self.TABLE} (message_id, document) VALUES (:id, to_tsvector('simple', :document)) "
+                f"ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document"
+            ), params)
+        else:
+            self.unindex(conn, [p["id"] for p in params])
+            conn.execute(text(f"INSERT INTO {self.TABLE} (rowid, document) VALUES (:id, :document)"), params)
+
+    def unindex(self, conn, message_ids):
+        if not message_ids:
+            return
+        id_column = "message_id" if conn.dialect.name == "postgresql" else "rowid"
+        conn.execute(text(f"DELETE FROM {self.TABLE} WHERE {id_column} IN :ids")
+                     .bindparams(bindparam("ids", expanding=True)), {"ids": list(message_ids)})
+
+    def unindex_conversations(self, conn, conversation_ids):
+        """Remove the entries of every message in these conversations, in one statement."""
+        if conn.dialect.name == "postgresql" or not conversation_ids:
+            return # ON DELETE CASCADE على message_id يتكفل بذلك عند حذف الرسائل
+        fts = table(self.TABLE, column("rowid"))
+        message_ids = select(self.messages.c.id).where(self.messages.c.conversation_id.in_(conversation_ids))
+        conn.execute(delete(fts).where(fts.c.rowid.in_(message_ids)))
+
+    def listen(self, model):
+        """Keep the index in step with ORM inserts, content updates and deletes of `model`."""
+        event.listen(model, "after_insert", self._after_insert)
+        event.listen(model, "after_update", self._after_update)
+        event.listen(model, "after_delete", self._after_delete)
+
+    def _after_insert(self, mapper, connection, target):
+        self.index(connection, [(target.id, message_compression.stored_text(target.content, target.content_compressed))])
+
+    def _after_update(self, mapper, connection, target):
+        if inspect(target).attrs.content.history.has_changes():
+            self.index(connection, [(target.id, message_compression.stored_text(target.content, target.content_compressed))])
+
+    def _after_delete(self, mapper, connection, target):
+        self.unindex(connection, [target.id])
+
+    # --- الاستعلام ---
+    def search(self, conn, query, limit, offset=0, conversation_id=None):
+        """
+        Ranked matches for `query` (all words must match; the last one as a
+        prefix). Returns rows with id, conversation_id, role, content,
+        content_compressed, created_at, title and rank (higher is better).
+        """
+        query_tokens = tokens(query)
+        if not query_tokens:
+            return []
+        m, c = self.messages, self.conversations
+        params = {"limit": limit, "offset": offset}
+        where_conversation = ""
+        if conversation_id is not None:
+            where_conversation = "AND m.conversation_id = :conversation_id"
+            params["conversation_id"] = conversation_id
+
+        if conn.dialect.name == "postgresql":
+            params["tsquery"] = " & ".join(query_tokens[:-1] + [query_tokens[-1] + ":*"])
+            sql = (
+                f"SELECT m.id, m.conversation_id, m.role, m.content, m.content_compressed, m.created_at, c.title,"
+                f" ts_rank_cd(s.document, q) AS rank"
+                f" FROM to_tsquery('simple', :tsquery) AS q, {self.TABLE} s"
+                f" JOIN {m.name} m ON m.id = s.message_id JOIN {c.name} c ON c.id = m.conversation_id"
+                f" WHERE s.document @@ q {where_conversation}"
+                f" ORDER BY rank DESC, m.id DESC LIMIT :limit OFFSET :offset"
+            )
+        else:
+            params["match"] = " ".join([f'"{t}"' for t in query_tokens[:-1]] + [f'"{query_tokens[-1]}"*'])
+            sql = (
+                f"SELECT m.id, m.conversation_id, m.role, m.content, m.content_compressed, m.created_at, c.title,"
+                f" -bm25({self.TABLE}) AS rank"
+                f" FROM {self.TABLE} JOIN {m.name} m ON m.id = {self.TABLE}.rowid"
+                f" JOIN {c.name} c ON c.id = m.conversation_id"
+                f" WHERE {self.TABLE} MATCH :match {where_conversation}"
+                f" ORDER BY rank DESC, m.id DESC LIMIT :limit OFFSET :offset"
+            )
+
+        stmt = text(sql).columns(m.c.id, m.c.conversation_id, m.c.role, m.c.content, m.c.content_compressed, m.c.created_at,
+                                 c.c.title, column("rank", Float))
+        if conversation_id is not None:
+            stmt = stmt.bindparams(bindparam("conversation_id", type_=m.c.conversation_id.type))
+        return conn.execute(stmt, params).all()
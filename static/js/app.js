@@ -462,20 +462,36 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // --- Load and Display Conversations ---
-    async function loadConversations() {
+    // Cursor of the next page of conversations (null when everything is loaded)
+    let conversationsCursor = null;
+
+    async function loadConversations(append = false) {
         try {
-            const response = await fetch('/api/conversations');
+            const url = append && conversationsCursor
+                ? `/api/conversations?cursor=${encodeURIComponent(conversationsCursor)}`
+                : '/api/conversations';
+            const response = await fetch(url);
             if (!response.ok) {
                 throw new Error('Failed to load conversations');
             }
-            const conversations = await response.json();
-
-            // Clear the conversations list
-            while (conversationsList.firstChild) {
-                conversationsList.removeChild(conversationsList.firstChild);
+            const page = await response.json();
+            const conversations = page.conversations;
+            conversationsCursor = page.next_cursor;
+
+            if (append) {
+                // Drop the old "load more" button; a new one is added below if needed
+                const loadMore = conversationsList.querySelector('.load-more-conversations');
+                if (loadMore) {
+                    loadMore.remove();
+                }
+            } else {
+                // Clear the conversations list
+                while (conversationsList.firstChild) {
+                    conversationsList.removeChild(conversationsList.firstChild);
+                }
             }
 
-            if (conversations.length === 0) {
+            if (!append && conversations.length === 0) {
                 // No conversations to display
                 const emptyState = document.createElement('div');
                 emptyState.className = 'empty-state';
@@ -486,6 +502,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 conversations.forEach(conversation => {
                     const conversationItem = document.createElement('div');
                     conversationItem.className = 'conversation-item';
+                    conversationItem.dataset.id = conversation.id;
                     if (conversation.id === currentConversationId) {
                         conversationItem.classList.add('active');
                     }
@@ -503,6 +520,19 @@ document.addEventListener('DOMContentLoaded', () => {
                     titleSpan.textContent = conversation.title;
                     titleSpan.title = `${conversation.title} - ${formattedDate}`;
 
+                    // Title plus a one-line preview of the last message
+                    const summaryDiv = document.createElement('div');
+                    summaryDiv.className = 'conversation-summary';
+                    summaryDiv.appendChild(titleSpan);
+                    if (conversation.last_message_preview) {
+                        const preview = document.createElement('small');
+                        preview.className = 'conversation-preview';
+                        const prefix = conversation.last_role === 'assistant' ? '' : 'أنت: ';
+                        preview.textContent = `${prefix}${conversation.last_message_preview}`;
+                        preview.title = `${conversation.message_count} رسالة - ${formattedDate}`;
+                        summaryDiv.appendChild(preview);
+                    }
+
                     // Create action buttons container
                     const actionsDiv = document.createElement('div');
                     actionsDiv.className = 'conversation-actions';
@@ -532,7 +562,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     actionsDiv.appendChild(deleteButton);
 
                     // Add title and actions to conversation item
-                    conversationItem.appendChild(titleSpan);
+                    conversationItem.appendChild(summaryDiv);
                     conversationItem.appendChild(actionsDiv);
 
                     // Set click handler for loading the conversation
@@ -543,6 +573,14 @@ document.addEventListener('DOMContentLoaded', () => {
                     conversationsList.appendChild(conversationItem);
                 });
             }
+
+            if (conversationsCursor) {
+                const loadMoreButton = document.createElement('button');
+                loadMoreButton.className = 'load-more-conversations';
+                loadMoreButton.textContent = 'عرض المزيد';
+                loadMoreButton.onclick = () => loadConversations(true);
+                conversationsList.appendChild(loadMoreButton);
+            }
         } catch (error) {
             console.error('Error loading conversations:', error);
             // Show error state
@@ -554,34 +592,82 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Load a Single Conversation ---
-    async function loadConversation(conversationId) {
+    // Id of the oldest message shown, used to backfill older pages
+    let oldestMessageId = null;
+
+    async function fetchMessagesPage(conversationId, beforeId = null) {
+        const query = beforeId ? `?before=${beforeId}` : '';
+        const response = await fetch(`/api/conversations/${conversationId}/messages${query}`);
+        if (!response.ok) {
+            throw new Error('Failed to load messages');
+        }
+        return response.json();
+    }
+
+    function showLoadOlderButton(conversationId) {
+        const loadOlderButton = document.createElement('button');
+        loadOlderButton.className = 'load-more-conversations load-older-messages';
+        loadOlderButton.textContent = 'عرض الرسائل الأقدم';
+        loadOlderButton.onclick = () => loadOlderMessages(conversationId, loadOlderButton);
+        // Right after the welcome message, above the oldest loaded message
+        messagesContainer.insertBefore(loadOlderButton, messagesContainer.children[1] || null);
+    }
+
+    async function loadOlderMessages(conversationId, loadOlderButton) {
         try {
-            const response = await fetch(`/api/conversations/${conversationId}`);
-            if (!response.ok) {
-                throw new Error('Failed to load conversation');
+            loadOlderButton.disabled = true;
+            const page = await fetchMessagesPage(conversationId, oldestMessageId);
+            if (conversationId !== currentConversationId) {
+                return; // The user switched conversations meanwhile
+            }
+            // Insert the older page where the button was, keeping the scroll position
+            const anchor = loadOlderButton.nextSibling;
+            loadOlderButton.remove();
+            const previousHeight = messagesContainer.scrollHeight;
+            const previousScrollTop = messagesContainer.scrollTop;
+            page.messages.forEach(msg => {
+                const bubble = addMessageToUI(msg.role, msg.content, false);
+                messagesContainer.insertBefore(bubble, anchor);
+            });
+            messages = page.messages.map(msg => ({ role: msg.role, content: msg.content })).concat(messages);
+            if (page.messages.length > 0) {
+                oldestMessageId = page.messages[0].id;
+            }
+            if (page.has_more) {
+                showLoadOlderButton(conversationId);
             }
-            const conversation = await response.json();
+            messagesContainer.scrollTop = previousScrollTop + messagesContainer.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+            loadOlderButton.disabled = false;
+        }
+    }
+
+    async function loadConversation(conversationId) {
+        try {
+            // Load only the tail of the conversation; older messages are backfilled on demand
+            const page = await fetchMessagesPage(conversationId);
 
             // Update UI
             clearMessages();
             currentConversationId = conversationId;
-            messages = conversation.messages.map(msg => ({
+            messages = page.messages.map(msg => ({
                 role: msg.role,
                 content: msg.content
             }));
+            oldestMessageId = page.messages.length > 0 ? page.messages[0].id : null;
 
             // Add messages to UI
             messages.forEach(msg => {
                 addMessageToUI(msg.role, msg.content);
             });
+            if (page.has_more) {
+                showLoadOlderButton(conversationId);
+            }
 
             // Update active state in conversation list
             document.querySelectorAll('.conversation-item').forEach(item => {
-                item.classList.remove('active');
-                const itemTitleSpan = item.querySelector('span');
-                if (itemTitleSpan && itemTitleSpan.textContent === conversation.title) {
-                    item.classList.add('active');
-                }
+                item.classList.toggle('active', item.dataset.id === conversationId);
             });
 
             // Close sidebar on mobile after selecting a conversation
@@ -680,7 +766,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Add Message to UI ---
-    function addMessageToUI(role, content) {
+    function addMessageToUI(role, content, autoSpeak = true) {
         const messageBubble = document.createElement('div');
         messageBubble.className = `message-bubble ${role === 'user' ? 'user-bubble' : 'ai-bubble'} fade-in`;
 
@@ -699,7 +785,7 @@ document.addEventListener('DOMContentLoaded', () => {
             copyButton.title = 'نسخ';
             copyButton.innerHTML = '<i class="fas fa-copy"></i>';
             copyButton.addEventListener('click', () => {
-                navigator.clipboard.writeText(content)
+                navigator.clipboard.writeText(messageContent.textContent)
                     .then(() => {
                         // Show success feedback
                         copyButton.innerHTML = '<i class="fas fa-check"></i>';
@@ -727,7 +813,7 @@ document.addEventListener('DOMContentLoaded', () => {
             messageBubble.appendChild(messageActions);
 
             // If auto-TTS is enabled, speak this message automatically
-            if (ttsToggle && ttsToggle.checked && window.speechSynthesis && typeof speakText === 'function') {
+            if (autoSpeak && ttsToggle && ttsToggle.checked && window.speechSynthesis && typeof speakText === 'function') {
                 setTimeout(() => {
                     speakText(content);
                 }, 500); // Small delay to ensure UI is updated first
@@ -736,6 +822,110 @@ document.addEventListener('DOMContentLoaded', () => {
 
         messagesContainer.appendChild(messageBubble);
         scrollToBottom();
+        return messageBubble;
+    }
+
+    // --- Idempotency keys: a retried request with the same key is answered once ---
+    function newIdempotencyKey() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    // One key per user action: network failures and 5xx answers are retried with the
+    // same key, so an attempt that did reach the server is never run twice
+    const RETRY_DELAYS_MS = [500, 1500];
+
+    async function postIdempotent(url, requestBody) {
+        const idempotencyKey = newIdempotencyKey();
+        const body = JSON.stringify(requestBody);
+        for (let attempt = 0; ; attempt++) {
+            const canRetry = attempt < RETRY_DELAYS_MS.length;
+            try {
+                const response = await fetch(url, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Idempotency-Key': idempotencyKey,
+                    },
+                    body,
+                });
+                if (response.status < 500 || !canRetry) {
+                    return response;
+                }
+            } catch (error) {
+                if (!canRetry) throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, RETRY_DELAYS_MS[attempt]));
+        }
+    }
+
+    // --- Read a Server-Sent Events response body ---
+    // Calls onEvent(eventName, data) for every event as soon as it arrives
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length > 0) {
+                    onEvent(eventName, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
+
+    // --- Stream an assistant reply into a new message bubble ---
+    // Returns the full reply text and the final 'done' payload
+    async function streamAssistantReply(response, onMeta) {
+        let bubble = null;
+        let replyText = '';
+        let donePayload = null;
+        let streamError = null;
+
+        await readEventStream(response, (eventName, data) => {
+            if (eventName === 'meta' && onMeta) {
+                onMeta(data);
+            } else if (eventName === 'delta') {
+                if (!bubble) {
+                    removeTypingIndicator();
+                    bubble = addMessageToUI('assistant', '', false);
+                }
+                replyText += data.content;
+                bubble.querySelector('p').textContent = replyText;
+                scrollToBottom();
+            } else if (eventName === 'done') {
+                donePayload = data;
+            } else if (eventName === 'error') {
+                streamError = data.error;
+            }
+        });
+
+        removeTypingIndicator();
+        if (!replyText) {
+            throw new Error(streamError || 'انقطع البث قبل وصول أي رد');
+        }
+        if (ttsToggle && ttsToggle.checked && window.speechSynthesis && typeof speakText === 'function') {
+            speakText(replyText);
+        }
+        return { content: replyText, done: donePayload };
     }
 
     // --- Create Regenerate Button ---
@@ -798,31 +988,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 conversation_id: currentConversationId,
                 model: modelSelect.value,
                 temperature: parseFloat(temperatureSlider.value),
-                max_tokens: parseInt(maxTokensInput.value, 10)
+                max_tokens: parseInt(maxTokensInput.value, 10),
+                stream: true
             };
 
             // Make the API call
-            const response = await fetch('/api/regenerate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(requestBody),
-            });
-
-            // Remove typing indicator
-            removeTypingIndicator();
+            const response = await postIdempotent('/api/regenerate', requestBody);
 
             if (!response.ok) {
+                removeTypingIndicator();
                 const errorData = await response.json();
                 throw new Error(errorData.error || 'فشل إعادة توليد الرد');
             }
 
-            const data = await response.json();
-            
-            // Add the new AI message to UI and messages array
-            addMessageToUI('assistant', data.content);
-            messages.push({ role: 'assistant', content: data.content });
+            // The new AI message is rendered token by token as it streams in
+            const reply = await streamAssistantReply(response);
+            messages.push({ role: 'assistant', content: reply.content });
             
             // Show regenerate button
             showRegenerateButton();
@@ -830,6 +1011,8 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (error) {
             console.error('Error regenerating response:', error);
             
+            removeTypingIndicator();
+
             // Show error in UI
             addMessageToUI('assistant', `خطأ: ${error.message || 'فشل إعادة توليد الرد'}`);
             
@@ -939,44 +1122,40 @@ document.addEventListener('DOMContentLoaded', () => {
         
         try {
             // Prepare API call
+            // Only the new message is sent; the server rebuilds the history from its own copy
             const requestBody = {
-                history: messages,
+                message: userMessage,
                 conversation_id: currentConversationId,
                 model: modelSelect.value,
                 temperature: parseFloat(temperatureSlider.value),
-                max_tokens: parseInt(maxTokensInput.value, 10)
+                max_tokens: parseInt(maxTokensInput.value, 10),
+                stream: true
             };
             
             // Make API call
-            const response = await fetch('/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(requestBody),
-            });
-            
-            // Remove typing indicator
-            removeTypingIndicator();
+            const response = await postIdempotent('/api/chat', requestBody);
             
             if (!response.ok) {
+                removeTypingIndicator();
                 const errorData = await response.json();
                 throw new Error(errorData.error || 'فشل إرسال الرسالة');
             }
             
-            const data = await response.json();
-            
-            // Update conversation ID for new conversations
-            if (!currentConversationId && data.id) {
-                currentConversationId = data.id;
-                // Refresh conversation list
+            // Render the AI response token by token as it streams in
+            const isNewConversation = !currentConversationId;
+            const reply = await streamAssistantReply(response, meta => {
+                // Update conversation ID for new conversations
+                if (!currentConversationId && meta.id) {
+                    currentConversationId = meta.id;
+                }
+            });
+            messages.push({ role: 'assistant', content: reply.content });
+
+            // Refresh conversation list once the new conversation is saved
+            if (isNewConversation) {
                 loadConversations();
             }
             
-            // Add AI response to UI and messages array
-            addMessageToUI('assistant', data.content);
-            messages.push({ role: 'assistant', content: data.content });
-            
             // Show regenerate button
             showRegenerateButton();
             
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module # noqa: E402
+from models import db # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """A migrated app on a fresh SQLite file (no provider keys: replies come from the offline fallback)."""
+    monkeypatch.setattr(app_module, "DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(app_module, "OPENROUTER_API_KEY", None)
+    monkeypatch.setattr(app_module, "GEMINI_API_KEY", None)
+    flask_app = app_module.create_app()
+    app_module.migrate_database(flask_app)
+    yield flask_app
+    with flask_app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+
+@pytest.fixture
+def reply_with(monkeypatch):
+    """Make the blocking provider chain answer `text`; returns the list of histories it was sent."""
+    sent = []
+
+    def install(text):
+        def generate_ai_reply(messages_for_api, model, temperature, max_tokens):
+            sent.append(list(messages_for_api))
+            return text, None, False, "OpenRouter"
+        monkeypatch.setattr(app_module, "generate_ai_reply", generate_ai_reply)
+        return sent
+    return install
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circuit_breaker # noqa: E402
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker # noqa: E402
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(f"{status}", response=response)
+
+
+@pytest.fixture
+def half_open(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "COOLDOWN_SECONDS", 0)
+    breaker = CircuitBreaker("test")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.record_failure(1.0)
+    assert breaker.state == OPEN
+    assert breaker.allow_request() # يأخذ خانة المسبار
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+@pytest.mark.parametrize("status", [400, 401, 403])
+def test_client_error_during_half_open_keeps_breaker_half_open(half_open, status):
+    half_open.record_error(_http_error(status), latency=0.2)
+    assert half_open.state == HALF_OPEN
+    assert half_open.allow_request() # خانة المسبار تحررت لمسبار جديد
+
+
+def test_client_error_is_not_recorded_as_a_call():
+    breaker = CircuitBreaker("test")
+    breaker.record_error(_http_error(400), latency=0.2)
+    assert breaker.snapshot()["calls"] == 0
+    assert breaker.snapshot()["avg_latency"] is None
+
+
+def test_provider_error_during_half_open_reopens(half_open):
+    half_open.record_error(_http_error(503), latency=0.2)
+    assert half_open.state == OPEN
+
+
+def test_successful_probe_closes(half_open):
+    half_open.record_success(0.2)
+    assert half_open.state == CLOSED
@@ -0,0 +1,71 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import context_builder # noqa: E402
+from context_builder import SUMMARY_PREFIX, build_context # noqa: E402
+
+MODEL = "openai/gpt-3.5-turbo"
+LONG = "x" * 16000 # ~4000 رمز لكل رسالة؛ الميزانية 12000
+
+
+class Conversation:
+    id = 1
+
+    def __init__(self, summary=None, summary_upto_id=None):
+        self.summary = summary
+        self.summary_upto_id = summary_upto_id
+
+
+def _messages(count, content=LONG):
+    return [{"id": i, "role": "user" if i % 2 else "assistant", "content": content} for i in range(1, count + 1)]
+
+
+def test_history_that_fits_is_sent_unchanged():
+    messages = _messages(3, "short")
+    conversation = Conversation()
+    assert build_context(messages, MODEL, 1000, conversation=conversation) == context_builder._strip_ids(messages)
+    assert conversation.summary_upto_id is None
+
+
+def test_oldest_turns_are_folded_into_the_summary():
+    folded = []
+
+    def summarize(previous, messages):
+        folded.extend(messages)
+        return "summary"
+    conversation = Conversation()
+    result = build_context(_messages(6), MODEL, 1000, conversation=conversation, summarize=summarize)
+    assert result[0] == {"role": "system", "content": SUMMARY_PREFIX + "summary"}
+    assert conversation.summary == "summary"
+    assert conversation.summary_upto_id == len(folded)
+    assert len(result) - 1 + len(folded) == 6
+
+
+def test_turns_covered_by_the_summary_are_skipped():
+    conversation = Conversation("earlier", summary_upto_id=4)
+    result = build_context(_messages(6, "short"), MODEL, 1000, conversation=conversation)
+    assert [m["content"] for m in result] == [SUMMARY_PREFIX + "earlier", "short", "short"]
+
+
+def test_unsaved_messages_are_never_folded():
+    folded = []
+
+    def summarize(previous, messages):
+        folded.extend(messages)
+        return "summary"
+    pending = [{"id": None, "role": "assistant", "content": "p" * 30000}, {"id": None, "role": "user", "content": "q"}]
+    conversation = Conversation()
+    result = build_context(_messages(5) + pending, MODEL, 1000, conversation=conversation, summarize=summarize)
+    assert [m["content"] for m in result[-2:]] == ["p" * 30000, "q"]
+    assert all(m["content"] == LONG for m in folded)
+    assert conversation.summary_upto_id == 5
+
+
+def test_failed_summary_truncates_instead():
+    conversation = Conversation()
+    result = build_context(_messages(6), MODEL, 1000, conversation=conversation, summarize=lambda previous, messages: None)
+    assert conversation.summary is None
+    assert 0 < len(result) < 6
+    assert sum(context_builder.message_tokens(m) for m in result) <= context_builder.history_budget(MODEL, 1000)
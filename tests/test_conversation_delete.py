@@ -0,0 +1,62 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+
+import app as app_module
+from models import Conversation, Message, db
+
+
+def _conversation(age_days, messages=2):
+    conversation = Conversation(id=uuid.uuid4(), title="t")
+    db.session.add(conversation)
+    for n in range(messages):
+        conversation.add_message("user", f"kept word{n}")
+    db.session.flush()
+    db.session.execute(update(Conversation).where(Conversation.id == conversation.id)
+                       .values(updated_at=datetime.now(timezone.utc) - timedelta(days=age_days)))
+    return conversation.id
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_API_TOKEN", "secret")
+    return {"X-Admin-Token": "secret"}
+
+
+def test_delete_removes_messages_and_search_entries(app, client):
+    with app.app_context():
+        doomed, kept = _conversation(0), _conversation(0)
+        db.session.commit()
+    assert client.delete(f"/api/conversations/{doomed}").status_code == 200
+    assert client.delete(f"/api/conversations/{doomed}").status_code == 404
+    with app.app_context():
+        remaining = db.session.execute(select(Message.conversation_id).distinct()).scalars().all()
+        assert remaining == [kept]
+    hits = client.get("/api/search", query_string={"q": "kept"}).json["results"]
+    assert {hit["conversation_id"] for hit in hits} == {str(kept)}
+
+
+def test_purge_deletes_only_old_conversations_in_batches(app, client, admin_token):
+    with app.app_context():
+        for _ in range(3):
+            _conversation(40)
+        recent = _conversation(5)
+        db.session.commit()
+    response = client.post("/api/conversations/purge", json={"older_than_days": 30, "batch_size": 2},
+                           headers=admin_token)
+    assert response.json == {"success": True, "deleted_conversations": 3, "deleted_messages": 6}
+    with app.app_context():
+        assert db.session.execute(select(Conversation.id)).scalars().all() == [recent]
+        assert db.session.execute(select(func.count()).select_from(Message)).scalar() == 2
+
+
+@pytest.mark.parametrize("headers, body, status", [
+    ({}, {"older_than_days": 30}, 403),
+    ({"X-Admin-Token": "wrong"}, {"older_than_days": 30}, 403),
+    ({"X-Admin-Token": "secret"}, {}, 400),
+    ({"X-Admin-Token": "secret"}, {"older_than_days": 0}, 400),
+])
+def test_purge_requires_the_admin_token_and_a_valid_age(client, admin_token, headers, body, status):
+    assert client.post("/api/conversations/purge", json=body, headers=headers).status_code == status
@@ -0,0 +1,39 @@
+import uuid
+
+from models import Conversation, db
+
+
+def test_history_is_rebuilt_from_stored_messages(client, reply_with):
+    sent = reply_with("reply")
+    conversation_id = client.post("/api/chat", json={"message": "first"}).json["id"]
+    response = client.post("/api/chat", json={"message": "second", "conversation_id": conversation_id})
+    assert response.status_code == 200
+    assert sent[-1] == [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "reply"},
+        {"role": "user", "content": "second"},
+    ]
+
+
+def test_resent_message_is_not_stored_twice(app, client, reply_with):
+    sent = reply_with("reply")
+    conversation_id = client.post("/api/chat", json={"message": "first"}).json["id"]
+    with app.app_context(): # رسالة وصلت دون رد (انقطع الطلب الأول)
+        db.session.get(Conversation, uuid.UUID(conversation_id)).add_message("user", "again")
+        db.session.commit()
+    client.post("/api/chat", json={"message": "again", "conversation_id": conversation_id})
+    assert [m["content"] for m in sent[-1]] == ["first", "reply", "again"]
+    messages = client.get(f"/api/conversations/{conversation_id}").json["messages"]
+    assert [m["content"] for m in messages] == ["first", "reply", "again", "reply"]
+
+
+def test_full_history_mode_is_still_accepted(client, reply_with):
+    sent = reply_with("reply")
+    history = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"},
+               {"role": "user", "content": "c"}]
+    assert client.post("/api/chat", json={"history": history}).status_code == 200
+    assert sent[-1] == history
+
+
+def test_empty_message_is_rejected(client):
+    assert client.post("/api/chat", json={"message": "   "}).status_code == 400
@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hedging # noqa: E402
+
+DELAY = 0.05
+
+
+def _primary(seconds):
+    def call(cancel_event):
+        if cancel_event.wait(seconds):
+            return None, "cancelled"
+        return "primary reply", None
+    return "primary", call
+
+
+def _backup(cancel_event):
+    return "backup reply", None
+
+
+def test_slow_primary_does_not_ratchet_the_threshold_down():
+    tracker = hedging.LatencyTracker()
+    # ربع الاستدعاءات سريعة والبقية تخسر السباق؛ لو سُجّلت السريعة وحدها لهبطت النسبة إلى 10ms
+    for i in range(40):
+        winner, reply, errors = hedging.race(_primary(0.01 if i % 4 == 0 else 0.5), ("backup", _backup),
+                                             DELAY, latency=tracker)
+        assert reply
+    assert tracker.percentile(95) >= DELAY
+    assert tracker.percentile(50) >= DELAY
+
+
+def test_fast_primary_failure_is_not_a_latency_sample():
+    tracker = hedging.LatencyTracker()
+
+    def failing(cancel_event):
+        return None, "500"
+    winner, reply, errors = hedging.race(("primary", failing), ("backup", _backup), DELAY, latency=tracker)
+    assert winner == "backup" and errors == {"primary": "500"}
+    assert len(tracker._samples) == 0
+
+
+def test_winning_primary_records_its_latency():
+    tracker = hedging.LatencyTracker()
+    winner, reply, errors = hedging.race(_primary(0.01), ("backup", _backup), DELAY, latency=tracker)
+    assert winner == "primary"
+    assert len(tracker._samples) == 1 and tracker._samples[0] < DELAY
@@ -0,0 +1,40 @@
+from sqlalchemy import func, select
+
+from models import Message, db
+
+
+def _message_count(app):
+    with app.app_context():
+        return db.session.execute(select(func.count()).select_from(Message)).scalar()
+
+
+def test_repeated_key_replays_the_stored_response(app, client, reply_with):
+    sent = reply_with("reply")
+    headers = {"Idempotency-Key": "k1"}
+    first = client.post("/api/chat", json={"message": "hi"}, headers=headers)
+    again = client.post("/api/chat", json={"message": "hi"}, headers=headers)
+    assert again.status_code == 200 and again.json == first.json
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert len(sent) == 1 and _message_count(app) == 2
+
+
+def test_key_reused_with_a_different_payload_is_rejected(client, reply_with):
+    reply_with("reply")
+    headers = {"Idempotency-Key": "k1"}
+    client.post("/api/chat", json={"message": "hi"}, headers=headers)
+    assert client.post("/api/chat", json={"message": "other"}, headers=headers).status_code == 422
+
+
+def test_offline_fallback_is_not_stored(client):
+    headers = {"Idempotency-Key": "k1"}
+    client.post("/api/chat", json={"message": "hi"}, headers=headers)
+    again = client.post("/api/chat", json={"message": "hi"}, headers=headers)
+    assert "Idempotent-Replayed" not in again.headers
+
+
+def test_keys_are_scoped_per_endpoint(client, reply_with):
+    reply_with("reply")
+    headers = {"Idempotency-Key": "k1"}
+    conversation_id = client.post("/api/chat", json={"message": "hi"}, headers=headers).json["id"]
+    response = client.post("/api/regenerate", json={"conversation_id": conversation_id}, headers=headers)
+    assert response.status_code == 200 and "Idempotent-Replayed" not in response.headers
@@ -0,0 +1,70 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+import app as app_module
+import message_compression
+from models import Conversation, Message, db
+
+OLD_TEXT = "رسالة قديمة قابلة للضغط " * 20
+LONG_TEXT = "long message text " * 600
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_round_trip(codec):
+    if codec == "zstd" and message_compression.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    blob = message_compression.compress(OLD_TEXT, codec)
+    assert len(blob) < len(OLD_TEXT.encode("utf-8"))
+    assert message_compression.stored_text("", blob) == OLD_TEXT
+    assert message_compression.stored_text(OLD_TEXT, None) == OLD_TEXT
+
+
+def test_only_long_messages_are_compressed_on_write(monkeypatch):
+    assert message_compression.stored_columns(OLD_TEXT) == {"content": OLD_TEXT, "content_compressed": None}
+    columns = message_compression.stored_columns(LONG_TEXT)
+    assert columns["content"] == "" and message_compression.decompress(columns["content_compressed"]) == LONG_TEXT
+    monkeypatch.setattr(message_compression, "COMPRESS_ON_WRITE", False)
+    assert message_compression.stored_columns(LONG_TEXT)["content_compressed"] is None
+
+
+def test_compressed_messages_read_back_transparently(app, client):
+    with app.app_context():
+        conversation = Conversation(id=uuid.uuid4(), title="t")
+        db.session.add(conversation)
+        message = conversation.add_message("user", LONG_TEXT)
+        db.session.commit()
+        assert message.content == LONG_TEXT # الكائن في الذاكرة يبقى بالنص الكامل
+        raw = db.session.execute(select(Message.content, Message.content_compressed)).one()
+        assert raw.content == "" and raw.content_compressed is not None
+        db.session.expire_all()
+        assert db.session.get(Message, message.id).content == LONG_TEXT
+        conversation_id = conversation.id
+    messages = client.get(f"/api/conversations/{conversation_id}/messages").json["messages"]
+    assert messages[0]["content"] == LONG_TEXT
+    assert len(client.get("/api/search", query_string={"q": "long"}).json["results"]) == 1
+
+
+def test_compact_compresses_only_cold_messages(app):
+    with app.app_context():
+        conversation = Conversation(id=uuid.uuid4(), title="t")
+        db.session.add(conversation)
+        old = conversation.add_message("user", OLD_TEXT)
+        recent = conversation.add_message("assistant", OLD_TEXT + "!")
+        short = conversation.add_message("user", "short")
+        db.session.flush()
+        db.session.execute(update(Message).where(Message.id.in_([old.id, short.id]))
+                           .values(created_at=datetime.now(timezone.utc) - timedelta(days=60)))
+        db.session.commit()
+        ids = (old.id, recent.id, short.id)
+
+    totals = message_compression.compact(app_module._database_engine, Message.__table__, older_than_days=30)
+    assert totals["messages"] == 1 and totals["bytes_after"] < totals["bytes_before"]
+    assert message_compression.compact(app_module._database_engine, Message.__table__, older_than_days=30)["messages"] == 0
+    with app.app_context():
+        rows = {row.id: row for row in db.session.execute(select(Message.id, Message.content, Message.content_compressed))}
+        assert rows[ids[0]].content_compressed is not None and rows[ids[0]].content == ""
+        assert rows[ids[1]].content_compressed is None and rows[ids[2]].content_compressed is None
+        assert db.session.get(Message, ids[0]).content == OLD_TEXT
@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+from models import Conversation, db
+
+
+@pytest.fixture
+def conversation(app):
+    """A conversation with ten stored messages "m1".."m10"; returns (id, message ids)."""
+    with app.app_context():
+        conversation = Conversation(id=uuid.uuid4(), title="t")
+        db.session.add(conversation)
+        messages = [conversation.add_message("user" if n % 2 else "assistant", f"m{n}") for n in range(1, 11)]
+        db.session.commit()
+        return str(conversation.id), [m.id for m in messages]
+
+
+def _page(client, conversation_id, **params):
+    response = client.get(f"/api/conversations/{conversation_id}/messages", query_string=params)
+    assert response.status_code == 200
+    return [m["content"] for m in response.json["messages"]], response.json["has_more"]
+
+
+def test_tail_then_backfill_with_before(client, conversation):
+    conversation_id, ids = conversation
+    assert _page(client, conversation_id, limit=4) == (["m7", "m8", "m9", "m10"], True)
+    assert _page(client, conversation_id, limit=4, before=ids[6]) == (["m3", "m4", "m5", "m6"], True)
+    assert _page(client, conversation_id, limit=4, before=ids[2]) == (["m1", "m2"], False)
+
+
+def test_after_pages_forward(client, conversation):
+    conversation_id, ids = conversation
+    assert _page(client, conversation_id, limit=3, after=ids[0]) == (["m2", "m3", "m4"], True)
+    assert _page(client, conversation_id, limit=3, after=ids[7]) == (["m9", "m10"], False)
+
+
+def test_since_returns_only_new_messages(client, conversation):
+    conversation_id, ids = conversation
+    assert _page(client, conversation_id, since=ids[-1]) == ([], False)
+    assert _page(client, conversation_id, since=ids[-3]) == (["m9", "m10"], False)
+
+
+@pytest.mark.parametrize("params", [{"before": "x"}, {"limit": "many"}, {"before": 1, "after": 1}])
+def test_invalid_cursors_are_rejected(client, conversation, params):
+    conversation_id, _ = conversation
+    assert client.get(f"/api/conversations/{conversation_id}/messages", query_string=params).status_code == 400
+
+
+def test_unknown_conversation_is_404(client):
+    assert client.get(f"/api/conversations/{uuid.uuid4()}/messages").status_code == 404
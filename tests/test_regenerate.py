@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+import app as app_module
+from models import Conversation, Message, db
+
+
+@pytest.fixture
+def conversation(app):
+    with app.app_context():
+        conversation = Conversation(id=uuid.uuid4(), title="t")
+        db.session.add(conversation)
+        for role, content in [("user", "q1"), ("assistant", "a1"), ("user", "q2"), ("assistant", "oldreply")]:
+            conversation.add_message(role, content)
+        db.session.commit()
+        return str(conversation.id)
+
+
+def _messages(app):
+    with app.app_context():
+        return [(m.id, m.content) for m in db.session.execute(select(Message).order_by(Message.id)).scalars()]
+
+
+def test_reply_is_swapped_in_place(app, client, conversation, reply_with):
+    sent = reply_with("newreply")
+    before = _messages(app)
+    response = client.post("/api/regenerate", json={"conversation_id": conversation})
+    assert response.status_code == 200 and response.json["content"] == "newreply"
+    assert sent[-1] == [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"},
+                        {"role": "user", "content": "q2"}]
+    assert _messages(app) == before[:-1] + [(before[-1][0], "newreply")]
+    summary = client.get("/api/conversations").json["conversations"][0]
+    assert summary["message_count"] == 4 and summary["last_message_preview"] == "newreply"
+    assert client.get("/api/search", query_string={"q": "oldreply"}).json["results"] == []
+    assert len(client.get("/api/search", query_string={"q": "newreply"}).json["results"]) == 1
+
+
+def test_failed_regeneration_keeps_the_old_reply(app, client, conversation):
+    before = _messages(app)
+    assert client.post("/api/regenerate", json={"conversation_id": conversation}).status_code == 500
+    assert _messages(app) == before
+
+
+def test_only_an_assistant_reply_can_be_regenerated(app, client, conversation, reply_with):
+    reply_with("newreply")
+    with app.app_context():
+        db.session.get(Conversation, uuid.UUID(conversation)).add_message("user", "q3")
+        db.session.commit()
+    assert client.post("/api/regenerate", json={"conversation_id": conversation}).status_code == 400
+
+
+def test_replacing_a_missing_reply_returns_false(app, conversation):
+    with app.app_context():
+        assert app_module.replace_assistant_reply(uuid.UUID(conversation), 10**6, "x") is False
@@ -0,0 +1,50 @@
+import uuid
+
+import pytest
+
+import search
+from models import Conversation, db
+
+
+def test_normalization_ignores_tashkeel_tatweel_and_letter_variants():
+    assert search.tokens("الْمَدْرَسَةُ") == search.tokens("المدرسه") == ["مدرسه"]
+    assert search.tokens("إسلام") == search.tokens("اسلام")
+    assert search.tokens("مـــرحبا") == ["مرحبا"]
+    assert search.tokens("مستشفى") == search.tokens("مستشفي")
+
+
+def test_article_is_stripped_only_from_long_enough_words():
+    assert search.stem("والكتاب") == "كتاب"
+    assert search.stem("الم") == "الم"
+
+
+def test_snippet_highlights_the_original_words_and_escapes_html():
+    snippet = search.snippet("<b>قرأتُ الكتابَ</b>", search.tokens("كتاب"))
+    assert "<mark>الكتابَ</mark>" in snippet and "&lt;b&gt;" in snippet
+
+
+@pytest.fixture
+def conversation(app):
+    with app.app_context():
+        conversation = Conversation(id=uuid.uuid4(), title="t")
+        db.session.add(conversation)
+        conversation.add_message("user", "ذهبتُ إلى المدرسةِ صباحًا")
+        conversation.add_message("assistant", "Schools open early")
+        db.session.commit()
+        return str(conversation.id)
+
+
+def test_search_matches_normalized_forms(client, conversation):
+    results = client.get("/api/search", query_string={"q": "مدرسه"}).json["results"]
+    assert [r["conversation_id"] for r in results] == [conversation]
+    assert "<mark>" in results[0]["snippet"]
+    assert len(client.get("/api/search", query_string={"q": "SCHOOLS"}).json["results"]) == 1
+
+
+def test_search_can_be_limited_to_a_conversation(client, conversation):
+    other = str(uuid.uuid4())
+    assert client.get("/api/search", query_string={"q": "مدرسه", "conversation_id": other}).json["results"] == []
+
+
+def test_empty_query_is_rejected(client):
+    assert client.get("/api/search", query_string={"q": " ؟ "}).status_code == 400
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+import app as app_module
+from models import Message, db
+
+
+def _events(body):
+    """Parse a Server-Sent Events body into (event, data) pairs."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _stored(app):
+    with app.app_context():
+        return [(m.role, m.content) for m in db.session.execute(select(Message).order_by(Message.id)).scalars()]
+
+
+@pytest.fixture
+def stream_deltas(monkeypatch):
+    """Make the streaming provider chain yield the given deltas, running `on_delta(i)` before each one."""
+    def install(deltas, on_delta=None):
+        def stream_ai_reply(messages_for_api, model, temperature, max_tokens, result):
+            result['api_source'] = "OpenRouter"
+            for i, delta in enumerate(deltas):
+                if on_delta:
+                    on_delta(i)
+                yield delta
+        monkeypatch.setattr(app_module, "stream_ai_reply", stream_ai_reply)
+    return install
+
+
+def test_stream_sends_deltas_and_saves_the_reply(app, client, stream_deltas):
+    stream_deltas(["مرح", "بًا", " بك"])
+    response = client.post("/api/chat", json={"message": "مرحبا", "stream": True})
+    assert response.mimetype == "text/event-stream"
+    events = _events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ["meta", "delta", "delta", "delta", "done"]
+    assert "".join(data["content"] for name, data in events if name == "delta") == "مرحبًا بك"
+    assert _stored(app) == [("user", "مرحبا"), ("assistant", "مرحبًا بك")]
+
+
+def test_cancelled_stream_saves_the_partial_reply(app, client, stream_deltas):
+    stream_deltas(["first ", "second ", "never sent"])
+    response = client.post("/api/chat", json={"message": "hi", "stream": True}, buffered=False)
+    chunks = iter(response.response)
+    next(chunks) # meta
+    next(chunks) # أول جزء من الرد
+    response.close() # العميل أغلق الاتصال
+    assert _stored(app) == [("user", "hi"), ("assistant", "first")]
+
+
+def test_conversation_deleted_mid_stream_discards_the_reply(app, client, stream_deltas):
+    def delete_conversation(i):
+        if i == 1:
+            conversation_id = db.session.execute(select(Message.conversation_id)).scalar_one()
+            app_module.delete_conversations([conversation_id])
+            db.session.commit()
+    stream_deltas(["a", "b"], on_delta=delete_conversation)
+    response = client.post("/api/chat", json={"message": "hi", "stream": True})
+    assert [name for name, _ in _events(response.get_data(as_text=True))][-1] == "done"
+    assert _stored(app) == []
+    assert client.get("/api/conversations").status_code == 200 # الجلسة تراجعت ولم تبقَ معلقة
+
+
+def test_stream_regenerate_replaces_the_reply_in_place(app, client, stream_deltas):
+    stream_deltas(["old reply"])
+    events = _events(client.post("/api/chat", json={"message": "hi", "stream": True}).get_data(as_text=True))
+    conversation_id = events[0][1]["id"]
+    with app.app_context():
+        old_id = db.session.execute(select(Message.id).filter_by(role="assistant")).scalar_one()
+
+    stream_deltas(["new ", "reply"])
+    events = _events(client.post("/api/regenerate", json={"conversation_id": conversation_id, "stream": True})
+                     .get_data(as_text=True))
+    assert [name for name, _ in events] == ["delta", "delta", "done"]
+    assert _stored(app) == [("user", "hi"), ("assistant", "new reply")]
+    with app.app_context():
+        assert db.session.execute(select(Message.id).filter_by(role="assistant")).scalar_one() == old_id
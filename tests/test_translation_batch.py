@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from translation_service import TranslationService # noqa: E402
+
+
+@pytest.fixture
+def service():
+    return TranslationService()
+
+
+def _answer(service, *replies):
+    """Make the provider chain return `replies` in order (None = every provider failed); returns the prompts."""
+    prompts = []
+    replies = list(replies)
+
+    def complete(prompt, max_tokens=1000, timeout=10):
+        prompts.append(prompt)
+        reply = replies.pop(0)
+        return (reply, "OpenRouter", 1) if reply is not None else (None, None, 2)
+    service._complete = complete
+    return prompts
+
+
+def test_segments_share_one_call_and_keep_their_order(service):
+    prompts = _answer(service, json.dumps({"1": "واحد", "2": "اثنان"}, ensure_ascii=False))
+    result = service.translate_batch(["one", "two", "one"], source_lang="en")
+    assert [r["translated_text"] for r in result["results"]] == ["واحد", "اثنان", "واحد"]
+    assert result["success"] and result["provider_calls"] == 1
+    assert len(prompts) == 1 and prompts[0].count('"one"') == 1 # المكرر يُرسل مرة واحدة
+
+
+def test_reply_wrapped_in_a_code_fence_is_parsed(service):
+    _answer(service, '```json\n{"1": "واحد"}\n```')
+    assert service.translate_batch(["one"], source_lang="en")["results"][0]["translated_text"] == "واحد"
+
+
+def test_missing_and_non_string_values_are_translated_individually(service):
+    prompts = _answer(service, json.dumps({"1": "واحد", "2": {"text": "اثنان"}, "4": "زائد"}, ensure_ascii=False),
+                      "اثنان", "ثلاثة")
+    result = service.translate_batch(["one", "two", "three"], source_lang="en")
+    assert [r["translated_text"] for r in result["results"]] == ["واحد", "اثنان", "ثلاثة"]
+    assert result["provider_calls"] == 3
+    assert "two" in prompts[1] and "three" in prompts[2]
+
+
+def test_failed_batch_call_uses_the_single_segment_fallback(service):
+    _answer(service, None)
+    result = service.translate_batch(["Hello", "Something else"], source_lang="en")
+    first, second = result["results"]
+    assert first == {"success": True, "translated_text": "مرحبا", "provider": "Fallback"}
+    assert not second["success"] and not result["success"]
+    assert result["provider_calls"] == 2
+
+
+def test_empty_segments_fail_without_a_call(service):
+    prompts = _answer(service)
+    result = service.translate_batch(["  "], source_lang="en")
+    assert result["results"][0]["success"] is False and prompts == []
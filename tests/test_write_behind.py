@@ -0,0 +1,57 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+import app as app_module
+import write_behind
+from models import Conversation, Message, db
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    """Turn WRITE_BEHIND on with a queue that only writes when flushed explicitly."""
+    monkeypatch.setattr(write_behind, "ENABLED", True)
+    queue = write_behind.WriteBehindQueue(app_module._database_engine, Message.__table__, Conversation.__table__,
+                                          on_insert=app_module.search_index.index,
+                                          preview=app_module.message_preview, flush_interval=3600)
+    monkeypatch.setattr(app_module, "write_behind_queue", queue)
+    yield queue
+    queue.close()
+
+
+def _stored(app):
+    with app.app_context():
+        return [(m.role, m.content) for m in db.session.execute(select(Message).order_by(Message.id)).scalars()]
+
+
+def test_queued_messages_are_part_of_the_next_history(app, client, queue, reply_with):
+    sent = reply_with("reply")
+    conversation_id = client.post("/api/chat", json={"message": "first"}).json["id"]
+    assert _stored(app) == [] and queue.depth() == 2
+    client.post("/api/chat", json={"message": "second", "conversation_id": conversation_id})
+    assert [m["content"] for m in sent[-1]] == ["first", "reply", "second"]
+
+
+def test_reads_flush_the_queue_first(app, client, queue, reply_with):
+    reply_with("reply")
+    conversation_id = client.post("/api/chat", json={"message": "first"}).json["id"]
+    response = client.get(f"/api/conversations/{conversation_id}/messages")
+    assert [m["content"] for m in response.json["messages"]] == ["first", "reply"]
+    assert queue.depth() == 0
+    summary = client.get("/api/conversations").json["conversations"][0]
+    assert summary["message_count"] == 2 and summary["last_role"] == "assistant"
+
+
+def test_flush_keeps_the_order_messages_were_queued_in(app, queue):
+    queue.batch_size = 3 # عدة دفعات
+    with app.app_context():
+        conversations = [Conversation(id=uuid.uuid4(), title=f"c{n}") for n in range(2)]
+        db.session.add_all(conversations)
+        db.session.commit()
+        ids = [c.id for c in conversations]
+    for n in range(8):
+        queue.enqueue(ids[n % 2], "user", f"m{n}")
+    queue.flush()
+    assert [content for _, content in _stored(app)] == [f"m{n}" for n in range(8)]
+    assert queue.stats()["flushes"] == 3 and queue.stats()["flushed"] == 8
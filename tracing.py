@@ -0,0 +1,118 @@
+import os
+import re
+import cProfile
+import time
+import random
+import logging
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+try:
+    import pyinstrument # اختياري: بديل أوضح من cProfile عند PROFILER=pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# --- تتبع مراحل الطلب (Server-Timing) ---
+SLOW_REQUEST_MS = float(os.environ.get("TRACE_SLOW_REQUEST_MS", 2000)) # تُسجَّل مراحل الطلبات الأبطأ من هذا
+# --- التحليل الاختياري (profiling) لعينة من الطلبات ---
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0)) # 0 = معطل، 0.01 = طلب من كل 100
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/dzgpt-profiles")
+PROFILER = os.environ.get("PROFILER", "cprofile").lower() # cprofile أو pyinstrument
+
+_UNSAFE_FILENAME_RE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+@contextmanager
+def span(name):
+    """
+    Time a phase of the current request under `name` (repeated names add up).
+    Outside a request, e.g. in worker threads, it does nothing.
+    """
+    if not has_request_context():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record(name, seconds):
+    """Add an already measured duration to the current request's span `name`."""
+    if has_request_context():
+        spans = g.setdefault("trace_spans", {})
+        spans[name] = spans.get(name, 0.0) + seconds * 1000
+
+
+def _start_request():
+    g.trace_started = time.perf_counter()
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        g.trace_profiler = _start_profiler()
+
+
+def _server_timing(response):
+    """Add a Server-Timing header with the request's spans (for streams: those before the body starts)."""
+    started = g.get("trace_started")
+    if started is None:
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    spans = g.get("trace_spans", {})
+    entries = [f"{name};dur={ms:.1f}" for name, ms in spans.items()] + [f"total;dur={total_ms:.1f}"]
+    response.headers["Server-Timing"] = ", ".join(entries)
+    if total_ms >= SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in spans.items()) or "no spans"
+        logger.warning(f"Slow request {request.method} {request.path}: {total_ms:.0f} ms ({breakdown})")
+    return response
+
+
+def _finish_request(exc):
+    # teardown يعمل بعد انتهاء البث أيضًا، فيشمل التحليل توليد الاستجابة كاملة
+    profiler = g.pop("trace_profiler", None)
+    if profiler is not None:
+        _dump_profile(profiler, (time.perf_counter() - g.trace_started) * 1000)
+
+
+def _start_profiler():
+    try:
+        if PROFILER == "pyinstrument" and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+    except (RuntimeError, ValueError) as e: # مُحلل آخر يعمل بالفعل في هذا الخيط
+        logger.warning(f"Could not start request profiler: {e}")
+        return None
+
+
+def _dump_profile(profiler, total_ms):
+    route = request.url_rule.rule if request.url_rule else request.path
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.method}-{_UNSAFE_FILENAME_RE.sub('_', route).strip('_')}-{total_ms:.0f}ms"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if pyinstrument is not None and isinstance(profiler, pyinstrument.Profiler):
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, name + ".html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, name + ".prof") # python -m pstats / snakeviz
+            profiler.dump_stats(path)
+        logger.info(f"Wrote request profile {path}")
+    except (OSError, RuntimeError) as e:
+        logger.error(f"Could not write request profile: {e}")
+
+
+def init_app(app):
+    """Collect spans for every request, emit Server-Timing, and profile a sample of requests."""
+    app.before_request(_start_request)
+    app.after_request(_server_timing)
+    app.teardown_request(_finish_request)
+    if PROFILE_SAMPLE_RATE > 0:
+        logger.info(f"Request profiling enabled ({PROFILER}, sample rate {PROFILE_SAMPLE_RATE}, dir {PROFILE_DIR}).")
@@ -0,0 +1,139 @@
+import os
+import logging
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات ذاكرة الترجمة المؤقتة ---
+MEMORY_MAX_ENTRIES = int(os.environ.get("TRANSLATION_CACHE_SIZE", 2048))
+MEMORY_TTL_SECONDS = float(os.environ.get("TRANSLATION_CACHE_TTL_SECONDS", 3600))
+DB_TTL_DAYS = float(os.environ.get("TRANSLATION_CACHE_DB_TTL_DAYS", 30))
+
+
+def normalize_text(text):
+    """NFC-normalize and collapse whitespace so trivially different inputs share an entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(text, source_lang, target_lang):
+    """SHA-256 of the normalized (text, source_lang, target_lang) triple."""
+    raw = "\x1f".join([source_lang.strip().lower(), target_lang.strip().lower(), normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DatabaseTranslationStore:
+    """Persistent tier: one row per key in the app's SQLAlchemy database, shared by all workers."""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get(self, key):
+        # اتصال مستقل عن جلسة الطلب حتى لا تتداخل مع معاملاته
+        with self.db.engine.connect() as conn:
+            row = conn.execute(
+                select(self.model.translated_text, self.model.provider, self.model.created_at)
+                .where(self.model.key == key)
+            ).first()
+        if not row:
+            return None
+        created_at = row.created_at if row.created_at.tzinfo else row.created_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - created_at > timedelta(days=DB_TTL_DAYS):
+            return None
+        return {"translated_text": row.translated_text, "provider": row.provider}
+
+    def set(self, key, source_lang, target_lang, translated_text, provider):
+        table = self.model.__table__
+        values = {
+            "key": key,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "translated_text": translated_text,
+            "provider": provider,
+            "created_at": datetime.now(timezone.utc),
+        }
+        with self.db.engine.begin() as conn:
+            # حذف ثم إدراج: upsert محمول بين PostgreSQL و SQLite
+            conn.execute(delete(table).where(table.c.key == key))
+            conn.execute(table.insert().values(**values))
+
+
+class TranslationCache:
+    """
+    Two-tier cache for translations: a bounded in-process LRU with TTL in front
+    of an optional persistent store. Store errors are logged and treated as misses.
+    """
+
+    def __init__(self, store=None, max_entries=MEMORY_MAX_ENTRIES, ttl_seconds=MEMORY_TTL_SECONDS):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # إخراج الأقدم استخدامًا
+
+    def get(self, text, source_lang, target_lang):
+        """Return {'translated_text', 'provider'} or None."""
+        key = make_key(text, source_lang, target_lang)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key] # منتهي الصلاحية
+
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except SQLAlchemyError as e:
+                logger.error(f"Translation cache store read failed: {e}")
+                value = None
+            if value:
+                self._remember(key, value)
+                with self._lock:
+                    self.store_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, text, source_lang, target_lang, translated_text, provider):
+        key = make_key(text, source_lang, target_lang)
+        self._remember(key, {"translated_text": translated_text, "provider": provider})
+        if self.store is not None:
+            try:
+                self.store.set(key, source_lang, target_lang, translated_text, provider)
+            except SQLAlchemyError as e:
+                logger.error(f"Translation cache store write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "memory_max_entries": self.max_entries,
+            }
@@ -1,15 +1,40 @@
-import requests
 import logging
 import os
 import json
+import re
+import time
+
+import circuit_breaker
+import json_provider
+import metrics
+import language_detector
+import provider_client
+import tracing
+from context_builder import estimate_tokens
 
 # إعداد السجل للخطأ
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# إعدادات الترجمة الدفعية: حجم كل استدعاء للنموذج
+BATCH_MAX_INPUT_TOKENS = int(os.environ.get("TRANSLATION_BATCH_MAX_INPUT_TOKENS", 1500))
+BATCH_MAX_SEGMENTS = int(os.environ.get("TRANSLATION_BATCH_MAX_SEGMENTS", 40))
+BATCH_MAX_OUTPUT_TOKENS = int(os.environ.get("TRANSLATION_BATCH_MAX_OUTPUT_TOKENS", 4000))
+BATCH_TIMEOUT = float(os.environ.get("TRANSLATION_BATCH_TIMEOUT", 30))
+
+# ترجمات عربية جاهزة لعبارات شائعة، تُستخدم فقط عند فشل كل المزودين
+COMMON_PHRASES = {
+    "Hello": "مرحبا",
+    "Thank you": "شكرا لك",
+    "Yes": "نعم",
+    "No": "لا",
+    "Good morning": "صباح الخير",
+    "Good evening": "مساء الخير"
+}
+
 # خدمة الترجمة
 class TranslationService:
-    def __init__(self):
+    def __init__(self, cache=None):
         # القائمة الثابتة من اللغات المدعومة
         self.supported_languages = {
             'ar': 'العربية',
@@ -35,6 +60,9 @@ class TranslationService:
         # عنوان API لخدمة OpenAI - سنستخدمها كمحرك ترجمة
         self.openrouter_api_key = os.environ.get("OPENROUTER_API_KEY")
         self.gemini_api_key = os.environ.get("GEMINI_API_KEY")
+
+        # ذاكرة مؤقتة للترجمات (TranslationCache) - اختيارية
+        self.cache = cache
         
     def get_supported_languages(self):
         """الحصول على اللغات المدعومة بتنسيق مناسب للعرض"""
@@ -60,6 +88,21 @@ class TranslationService:
             if target_lang not in self.supported_languages and target_lang != 'auto':
                 return {"success": False, "error": f"اللغة {target_lang} غير مدعومة", "translated_text": ""}
             
+            # البحث في ذاكرة الترجمة أولاً لتجنب استدعاء النموذج لنفس النص
+            if self.cache is not None:
+                with tracing.span("translation_cache"):
+                    cached = self.cache.get(text, source_lang, target_lang)
+                if cached:
+                    return {
+                        "success": True,
+                        "translated_text": cached["translated_text"],
+                        "source_language": source_lang,
+                        "target_language": target_lang,
+                        "original_text": text,
+                        "provider": cached["provider"],
+                        "cached": True
+                    }
+
             # تحديد اللغة المصدر واللغة الهدف للاستخدام في الدليل
             source_lang_name = "اللغة المناسبة" if source_lang == 'auto' else self.supported_languages.get(source_lang, source_lang)
             target_lang_name = self.supported_languages.get(target_lang, target_lang)
@@ -72,118 +115,25 @@ class TranslationService:
             
             الترجمة:"""
             
-            # باستخدام OpenRouter
-            translated_text = ""
-            provider_used = ""
-            
-            if self.openrouter_api_key:
-                try:
-                    response = requests.post(
-                        url="https://openrouter.ai/api/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.openrouter_api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "mistralai/mistral-7b-instruct",  # نموذج أصغر وأسرع
-                            "messages": [
-                                {"role": "system", "content": "أنت مترجم محترف ودقيق."},
-                                {"role": "user", "content": prompt}
-                            ],
-                            "temperature": 0.3, 
-                            "max_tokens": 1000
-                        },
-                        timeout=10  # تحديد وقت للتنفيذ
-                    )
-                    
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
-                        translated_text = result['choices'][0]['message']['content'].strip()
-                        provider_used = "OpenRouter (Mistral)"
-                    else:
-                        logger.error("OpenRouter response format unexpected")
-                        # سننتقل إلى استخدام Gemini
-                except Exception as e:
-                    logger.error(f"OpenRouter translation error: {str(e)}")
-                    # سننتقل إلى استخدام Gemini
-            
-            # استخدام Gemini كبديل
-            if not translated_text and self.gemini_api_key:
-                try:
-                    response = requests.post(
-                        url=f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={self.gemini_api_key}",
-                        headers={"Content-Type": "application/json"},
-                        json={
-                            "contents": [{
-                                "role": "user",
-                                "parts": [{"text": prompt}]
-                            }],
-                            "generationConfig": {
-                                "temperature": 0.2,
-                                "maxOutputTokens": 1000
-                            }
-                        },
-                        timeout=10
-                    )
-                    
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if 'candidates' in result and len(result['candidates']) > 0:
-                        candidate = result['candidates'][0]
-                        if 'content' in candidate and 'parts' in candidate['content']:
-                            parts = candidate['content']['parts']
-                            if parts and 'text' in parts[0]:
-                                translated_text = parts[0]['text'].strip()
-                                provider_used = "Gemini"
-                    
-                    if not translated_text:
-                        logger.error(f"Unexpected Gemini response format: {json.dumps(result)}")
-                except Exception as e:
-                    logger.error(f"Gemini translation error: {str(e)}")
-                
+            translated_text, provider_used, provider_calls = self._complete(prompt)
+
+            # حفظ ترجمات النماذج فقط (وليس الردود الاحتياطية) في الذاكرة المؤقتة
+            if translated_text and self.cache is not None:
+                self.cache.set(text, source_lang, target_lang, translated_text, provider_used)
+
             # استخدام ترجمة احتياطية بسيطة إذا فشلت كل المحاولات
             if not translated_text:
-                if source_lang == target_lang:
-                    translated_text = text  # إرجاع النص الأصلي إذا كانت اللغتان متطابقتان
-                    provider_used = "Direct"
-                else:
-                    # محاولة أخيرة
-                    try:
-                        # استخدام ترجمة بسيطة يدوية لبعض العبارات الشائعة
-                        common_phrases = {
-                            "Hello": "مرحبا", 
-                            "Thank you": "شكرا لك",
-                            "Yes": "نعم",
-                            "No": "لا",
-                            "Good morning": "صباح الخير",
-                            "Good evening": "مساء الخير"
-                        }
-                        
-                        if text in common_phrases and target_lang == 'ar':
-                            translated_text = common_phrases[text]
-                            provider_used = "Fallback"
-                        else:
-                            return {
-                                "success": False, 
-                                "error": "فشلت جميع محاولات الترجمة", 
-                                "translated_text": "",
-                                "source_language": source_lang,
-                                "target_language": target_lang,
-                                "original_text": text
-                            }
-                    except Exception as e:
-                        logger.error(f"Fallback translation error: {str(e)}")
-                        return {
-                            "success": False, 
-                            "error": str(e),
-                            "translated_text": "", 
-                            "source_language": source_lang,
-                            "target_language": target_lang,
-                            "original_text": text
-                        }
+                translated_text, provider_used = self._fallback_translation(text, source_lang, target_lang)
+                if not translated_text:
+                    return {
+                        "success": False, 
+                        "error": "فشلت جميع محاولات الترجمة", 
+                        "translated_text": "",
+                        "source_language": source_lang,
+                        "target_language": target_lang,
+                        "original_text": text,
+                        "provider_calls": provider_calls
+                    }
             
             return {
                 "success": True,
@@ -191,7 +141,8 @@ class TranslationService:
                 "source_language": source_lang,
                 "target_language": target_lang,
                 "original_text": text,
-                "provider": provider_used
+                "provider": provider_used,
+                "provider_calls": provider_calls
             }
             
         except Exception as e:
@@ -205,9 +156,251 @@ class TranslationService:
                 "target_language": target_lang
             }
     
+    def translate_batch(self, segments, source_lang='auto', target_lang='ar'):
+        """
+        ترجمة قائمة من المقاطع بأقل عدد ممكن من استدعاءات النموذج
+
+        تُجمع المقاطع في طلبات بصيغة JSON ضمن ميزانية الرموز، ثم تُطابق الترجمات
+        مع مقاطعها عبر المفاتيح. المقاطع التي لا يمكن مطابقة ترجمتها فقط
+        تُترجم فرديًا عبر translate_text.
+
+        المعلمات:
+            segments (list[str]): المقاطع المراد ترجمتها
+            source_lang (str): رمز لغة المصدر (افتراضيًا: auto)
+            target_lang (str): رمز اللغة المستهدفة (افتراضيًا: ar)
+
+        الإرجاع:
+            dict: نتيجة لكل مقطع بنفس الترتيب، وعدد استدعاءات النموذج
+        """
+        if target_lang not in self.supported_languages:
+            return {"success": False, "error": f"اللغة {target_lang} غير مدعومة", "results": []}
+
+        results = [None] * len(segments)
+        pending = {}  # نص المقطع -> مواضعه (المقاطع المكررة تُترجم مرة واحدة)
+        for index, segment in enumerate(segments):
+            if not segment.strip():
+                results[index] = {"success": False, "error": "النص فارغ", "translated_text": ""}
+                continue
+            with tracing.span("translation_cache"):
+                cached = self.cache.get(segment, source_lang, target_lang) if self.cache is not None else None
+            if cached:
+                results[index] = {"success": True, "translated_text": cached["translated_text"],
+                                  "provider": cached["provider"], "cached": True}
+                continue
+            pending.setdefault(segment, []).append(index)
+
+        source_lang_name = "اللغة المناسبة" if source_lang == 'auto' else self.supported_languages.get(source_lang, source_lang)
+        target_lang_name = self.supported_languages.get(target_lang, target_lang)
+
+        provider_calls = 0
+        unaligned = []
+        for chunk in self._pack_segments(list(pending)):
+            numbered = {str(n): segment for n, segment in enumerate(chunk, start=1)}
+            prompt = f"""ترجم قيم كائن JSON التالي من {source_lang_name} إلى {target_lang_name}.
+            أعد كائن JSON فقط بنفس المفاتيح تمامًا، وقيمة كل مفتاح هي ترجمة النص المقابل، بدون أي تفسيرات.
+
+            {json.dumps(numbered, ensure_ascii=False)}"""
+            input_tokens = sum(estimate_tokens(segment) for segment in chunk)
+            max_tokens = min(BATCH_MAX_OUTPUT_TOKENS, 2 * input_tokens + 20 * len(chunk) + 100)
+
+            reply, provider_used, calls = self._complete(prompt, max_tokens=max_tokens, timeout=BATCH_TIMEOUT)
+            provider_calls += calls
+            if not reply:
+                # فشل المزودون كليًا: لا فائدة من تكرار المحاولة لكل مقطع، لكن نطبق نفس الترجمة الاحتياطية
+                for segment in chunk:
+                    translated, provider = self._fallback_translation(segment, source_lang, target_lang)
+                    result = {"success": True, "translated_text": translated, "provider": provider} if translated \
+                        else {"success": False, "error": "فشلت جميع محاولات الترجمة", "translated_text": ""}
+                    for index in pending[segment]:
+                        results[index] = dict(result)
+                continue
+
+            translations = self._parse_batch_reply(reply)
+            unknown_keys = set(translations) - set(numbered)
+            if unknown_keys:
+                logger.warning(f"Batch translation reply has {len(unknown_keys)} unknown key(s); ignoring them")
+            for key, segment in numbered.items():
+                translated = translations.get(key)
+                # فقط النصوص تُقبل؛ الكائنات المتداخلة والأرقام وما شابه تُترجم فرديًا
+                if not isinstance(translated, str) or not translated.strip():
+                    unaligned.append(segment)
+                    continue
+                translated = translated.strip()
+                if self.cache is not None:
+                    self.cache.set(segment, source_lang, target_lang, translated, provider_used)
+                for index in pending[segment]:
+                    results[index] = {"success": True, "translated_text": translated, "provider": provider_used}
+
+        if unaligned:
+            logger.warning(f"Batch translation: {len(unaligned)} segment(s) could not be aligned, translating individually")
+        for segment in unaligned:
+            single = self.translate_text(segment, source_lang, target_lang)
+            provider_calls += single.get("provider_calls", 0)
+            for index in pending[segment]:
+                results[index] = {key: single[key] for key in ("success", "translated_text", "provider", "error") if key in single}
+
+        return {
+            "success": all(result["success"] for result in results),
+            "results": results,
+            "source_language": source_lang,
+            "target_language": target_lang,
+            "provider_calls": provider_calls
+        }
+
+    @staticmethod
+    def _fallback_translation(text, source_lang, target_lang):
+        """
+        ترجمة احتياطية بدون نموذج عند فشل كل المزودين
+
+        الإرجاع:
+            tuple: (النص، "Direct" أو "Fallback") أو (None, None) إذا لم تتوفر
+        """
+        if source_lang == target_lang:
+            return text, "Direct"  # إرجاع النص الأصلي إذا كانت اللغتان متطابقتان
+        # ترجمة بسيطة يدوية لبعض العبارات الشائعة
+        if target_lang == 'ar' and text in COMMON_PHRASES:
+            return COMMON_PHRASES[text], "Fallback"
+        return None, None
+
+    def _pack_segments(self, segments):
+        """تقسيم المقاطع إلى مجموعات لا تتجاوز ميزانية الرموز أو عدد المقاطع لكل استدعاء"""
+        chunk, chunk_tokens = [], 0
+        for segment in segments:
+            tokens = estimate_tokens(segment)
+            if chunk and (chunk_tokens + tokens > BATCH_MAX_INPUT_TOKENS or len(chunk) >= BATCH_MAX_SEGMENTS):
+                yield chunk
+                chunk, chunk_tokens = [], 0
+            chunk.append(segment)
+            chunk_tokens += tokens
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _parse_batch_reply(reply):
+        """استخراج كائن JSON من رد النموذج (مع تجاهل أسوار ``` وأي نص محيط)"""
+        start, end = reply.find('{'), reply.rfind('}')
+        if start == -1 or end <= start:
+            logger.error(f"Batch translation reply has no JSON object: {reply[:200]}")
+            return {}
+        try:
+            data = json.loads(reply[start:end + 1])
+        except json.JSONDecodeError as e:
+            logger.error(f"Batch translation reply is not valid JSON: {e}")
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {str(key): value for key, value in data.items()}
+
+    def _complete(self, prompt, max_tokens=1000, timeout=10):
+        """
+        إرسال الطلب إلى OpenRouter ثم Gemini كبديل
+
+        الإرجاع:
+            tuple: (النص المُعاد أو "" عند الفشل، اسم المزود المستخدم،
+                    عدد الطلبات المرسلة فعلاً إلى المزودين — 0 إذا كانت كل الدوائر مفتوحة)
+        """
+        # باستخدام OpenRouter
+        translated_text = ""
+        provider_used = ""
+        calls = 0
+        
+        # قواطع الدائرة مشتركة مع مسار المحادثة: إذا كان المزود معطلاً نتخطاه فورًا
+        openrouter_breaker = circuit_breaker.get_breaker("openrouter")
+        gemini_breaker = circuit_breaker.get_breaker("gemini")
+
+        if self.openrouter_api_key and openrouter_breaker.allow_request():
+            started = time.monotonic()
+            calls += 1
+            try:
+                response = provider_client.post(
+                    url=provider_client.OPENROUTER_CHAT_URL,
+                    headers={
+                        "Authorization": f"Bearer {self.openrouter_api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": "mistralai/mistral-7b-instruct",  # نموذج أصغر وأسرع
+                        "messages": [
+                            {"role": "system", "content": "أنت مترجم محترف ودقيق."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        "temperature": 0.3, 
+                        "max_tokens": max_tokens
+                    },
+                    timeout=timeout  # تحديد وقت للتنفيذ
+                )
+                
+                response.raise_for_status()
+                result = json_provider.loads(response.content)
+                openrouter_breaker.record_success(time.monotonic() - started)
+                usage = result.get('usage') or {}
+                metrics.record_usage("openrouter", "mistralai/mistral-7b-instruct",
+                                     usage.get('prompt_tokens'), usage.get('completion_tokens'))
+                
+                if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
+                    translated_text = result['choices'][0]['message']['content'].strip()
+                    provider_used = "OpenRouter (Mistral)"
+                else:
+                    logger.error("OpenRouter response format unexpected")
+                    # سننتقل إلى استخدام Gemini
+            except Exception as e:
+                logger.error(f"OpenRouter translation error: {str(e)}")
+                openrouter_breaker.record_error(e, time.monotonic() - started)
+            metrics.observe_provider("openrouter", "mistralai/mistral-7b-instruct",
+                                     "success" if translated_text else "error", time.monotonic() - started)
+            tracing.record("translate_openrouter", time.monotonic() - started)
+                # سننتقل إلى استخدام Gemini
+        
+        # استخدام Gemini كبديل
+        if not translated_text and self.gemini_api_key and gemini_breaker.allow_request():
+            started = time.monotonic()
+            calls += 1
+            try:
+                response = provider_client.post(
+                    url=provider_client.gemini_url("gemini-2.0-flash", "generateContent", self.gemini_api_key),
+                    headers={"Content-Type": "application/json"},
+                    json={
+                        "contents": [{
+                            "role": "user",
+                            "parts": [{"text": prompt}]
+                        }],
+                        "generationConfig": {
+                            "temperature": 0.2,
+                            "maxOutputTokens": max_tokens
+                        }
+                    },
+                    timeout=timeout
+                )
+                
+                response.raise_for_status()
+                result = json_provider.loads(response.content)
+                gemini_breaker.record_success(time.monotonic() - started)
+                usage = result.get('usageMetadata') or {}
+                metrics.record_usage("gemini", "gemini-2.0-flash",
+                                     usage.get('promptTokenCount'), usage.get('candidatesTokenCount'))
+                
+                if 'candidates' in result and len(result['candidates']) > 0:
+                    candidate = result['candidates'][0]
+                    if 'content' in candidate and 'parts' in candidate['content']:
+                        parts = candidate['content']['parts']
+                        if parts and 'text' in parts[0]:
+                            translated_text = parts[0]['text'].strip()
+                            provider_used = "Gemini"
+                
+                if not translated_text:
+                    logger.error(f"Unexpected Gemini response format: {json.dumps(result)}")
+            except Exception as e:
+                logger.error(f"Gemini translation error: {str(e)}")
+                gemini_breaker.record_error(e, time.monotonic() - started)
+            metrics.observe_provider("gemini", "gemini-2.0-flash",
+                                     "success" if translated_text else "error", time.monotonic() - started)
+            tracing.record("translate_gemini", time.monotonic() - started)
+
+        return translated_text, provider_used, calls
+
     def detect_language(self, text):
         """
-        الكشف عن لغة النص باستخدام نموذج الذكاء الاصطناعي
+        الكشف عن لغة النص محليًا، مع اللجوء إلى نموذج الذكاء الاصطناعي فقط عند ضعف الثقة
         
         المعلمات:
             text (str): النص المراد الكشف عن لغته
@@ -218,104 +411,105 @@ class TranslationService:
         try:
             if not text.strip():
                 return "unknown"
-            
-            prompt = "اكتشف لغة النص التالي وأعط الرمز فقط (مثل 'ar' للعربية، 'en' للإنجليزية، إلخ.) دون أي تفسير:\n\n" + text
-            
-            lang_code = "unknown"  # القيمة الافتراضية
-            
-            # محاولة استخدام OpenRouter أولاً
-            if self.openrouter_api_key:
-                try:
-                    response = requests.post(
-                        url="https://openrouter.ai/api/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.openrouter_api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "mistralai/mistral-7b-instruct",
-                            "messages": [
-                                {"role": "system", "content": "أنت خبير في اكتشاف اللغات. أجب برمز اللغة فقط مثل 'ar' أو 'en'."},
-                                {"role": "user", "content": prompt}
-                            ],
-                            "temperature": 0.1,
-                            "max_tokens": 10
-                        },
-                        timeout=5
-                    )
-                    
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
-                        detected = result['choices'][0]['message']['content'].strip().lower()
-                        
-                        # استخراج رمز اللغة من الإجابة
-                        for code in self.supported_languages.keys():
-                            if code in detected:
-                                lang_code = code
-                                break
-                        
-                        # إذا كانت الإجابة قصيرة (2-3 أحرف)، فمن المحتمل أنها رمز لغة
-                        if len(detected) <= 3 and len(detected) >= 2:
-                            lang_code = detected
-                except Exception as e:
-                    logger.error(f"OpenRouter language detection error: {str(e)}")
-            
-            # استخدام Gemini كبديل
-            if lang_code == "unknown" and self.gemini_api_key:
-                try:
-                    response = requests.post(
-                        url=f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={self.gemini_api_key}",
-                        headers={"Content-Type": "application/json"},
-                        json={
-                            "contents": [{
-                                "role": "user",
-                                "parts": [{"text": prompt}]
-                            }],
-                            "generationConfig": {
-                                "temperature": 0.1,
-                                "maxOutputTokens": 10
-                            }
-                        },
-                        timeout=5
-                    )
-                    
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if 'candidates' in result and len(result['candidates']) > 0:
-                        candidate = result['candidates'][0]
-                        if 'content' in candidate and 'parts' in candidate['content']:
-                            parts = candidate['content']['parts']
-                            if parts and 'text' in parts[0]:
-                                detected = parts[0]['text'].strip().lower()
-                                
-                                # استخراج رمز اللغة من الإجابة
-                                for code in self.supported_languages.keys():
-                                    if code in detected:
-                                        lang_code = code
-                                        break
-                                
-                                # إذا كانت الإجابة قصيرة، فمن المحتمل أنها رمز لغة
-                                if len(detected) <= 3 and len(detected) >= 2:
-                                    lang_code = detected
-                except Exception as e:
-                    logger.error(f"Gemini language detection error: {str(e)}")
-            
-            # محاولة تحليل النص يدويًا في حالة الفشل
-            if lang_code == "unknown":
-                # اكتشاف بسيط للغة بناءً على الأحرف
-                arabic_chars = len([c for c in text if '\u0600' <= c <= '\u06FF'])
-                english_chars = len([c for c in text if 'a' <= c.lower() <= 'z'])
-                
-                if arabic_chars > len(text) * 0.3:
-                    lang_code = 'ar'
-                elif english_chars > len(text) * 0.3:
-                    lang_code = 'en'
-            
-            return lang_code
-            
+
+            with tracing.span("detect_language"):
+                lang_code, confidence = language_detector.detect(text)
+            if confidence >= language_detector.MIN_CONFIDENCE:
+                return lang_code
+
+            logger.info(f"Local language detection unsure ({lang_code}, {confidence:.2f}); asking the model")
+            with tracing.span("detect_language_remote"):
+                return self._detect_language_remote(text) or lang_code
+
         except Exception as e:
             logger.error(f"خطأ في الكشف عن اللغة: {str(e)}")
             return "unknown"
+
+    def _parse_language_code(self, reply):
+        """استخراج رمز لغة مدعوم من رد النموذج (مطابقة كلمة كاملة وليس جزءًا من كلمة)"""
+        for token in re.findall(r"\b[a-z]{2}\b", reply.strip().lower()):
+            if token in self.supported_languages:
+                return token
+        return None
+
+    def _detect_language_remote(self, text):
+        """
+        الكشف عن لغة النص باستخدام نموذج الذكاء الاصطناعي
+        
+        الإرجاع:
+            str | None: رمز اللغة المكتشفة أو None في حالة الفشل
+        """
+        prompt = "اكتشف لغة النص التالي وأعط الرمز فقط (مثل 'ar' للعربية، 'en' للإنجليزية، إلخ.) دون أي تفسير:\n\n" + text
+
+        lang_code = None
+        
+        openrouter_breaker = circuit_breaker.get_breaker("openrouter")
+        gemini_breaker = circuit_breaker.get_breaker("gemini")
+
+        # محاولة استخدام OpenRouter أولاً
+        if self.openrouter_api_key and openrouter_breaker.allow_request():
+            started = time.monotonic()
+            try:
+                response = provider_client.post(
+                    url=provider_client.OPENROUTER_CHAT_URL,
+                    headers={
+                        "Authorization": f"Bearer {self.openrouter_api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": "mistralai/mistral-7b-instruct",
+                        "messages": [
+                            {"role": "system", "content": "أنت خبير في اكتشاف اللغات. أجب برمز اللغة فقط مثل 'ar' أو 'en'."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        "temperature": 0.1,
+                        "max_tokens": 10
+                    },
+                    timeout=5
+                )
+                
+                response.raise_for_status()
+                result = json_provider.loads(response.content)
+                openrouter_breaker.record_success(time.monotonic() - started)
+                
+                if 'choices' in result and len(result['choices']) > 0 and 'message' in result['choices'][0]:
+                    lang_code = self._parse_language_code(result['choices'][0]['message']['content'])
+            except Exception as e:
+                logger.error(f"OpenRouter language detection error: {str(e)}")
+                openrouter_breaker.record_error(e, time.monotonic() - started)
+        
+        # استخدام Gemini كبديل
+        if lang_code is None and self.gemini_api_key and gemini_breaker.allow_request():
+            started = time.monotonic()
+            try:
+                response = provider_client.post(
+                    url=provider_client.gemini_url("gemini-2.0-flash", "generateContent", self.gemini_api_key),
+                    headers={"Content-Type": "application/json"},
+                    json={
+                        "contents": [{
+                            "role": "user",
+                            "parts": [{"text": prompt}]
+                        }],
+                        "generationConfig": {
+                            "temperature": 0.1,
+                            "maxOutputTokens": 10
+                        }
+                    },
+                    timeout=5
+                )
+                
+                response.raise_for_status()
+                result = json_provider.loads(response.content)
+                gemini_breaker.record_success(time.monotonic() - started)
+                
+                if 'candidates' in result and len(result['candidates']) > 0:
+                    candidate = result['candidates'][0]
+                    if 'content' in candidate and 'parts' in candidate['content']:
+                        parts = candidate['content']['parts']
+                        if parts and 'text' in parts[0]:
+                            lang_code = self._parse_language_code(parts[0]['text'])
+            except Exception as e:
+                logger.error(f"Gemini language detection error: {str(e)}")
+                gemini_breaker.record_error(e, time.monotonic() - started)
+
+        return lang_code
@@ -0,0 +1,235 @@
+import os
+import atexit
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import message_compression
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات الكتابة المؤجلة (Write-Behind) ---
+# عند التفعيل: تُضاف رسائل المحادثة إلى طابور داخل العملية بدلاً من إدراجها أثناء الطلب،
+# ويكتبها خيط خلفي على دفعات (INSERT متعدد الصفوف) عند امتلاء الدفعة أو مرور المهلة.
+ENABLED = os.environ.get("WRITE_BEHIND", "off").lower() in ("1", "true", "on", "yes")
+MAX_QUEUE = int(os.environ.get("WRITE_BEHIND_MAX_QUEUE", 5000))
+BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 200))
+FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", 0.5))
+MAX_ATTEMPTS = 3 # محاولات الكتابة قبل إسقاط مجموعة رسائل محادثة واحدة
+
+# رسالة في الطابور لم تُكتب بعد (id دائمًا None، وتُلحق بصفوف load_context_tail في app.py)
+PendingMessage = namedtuple("PendingMessage", ["id", "conversation_id", "role", "content", "created_at"])
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue of message inserts, drained by a background flusher.
+
+    Each flush writes a batch in one transaction: a multi-row INSERT into the
+    messages table plus one UPDATE per touched conversation (updated_at,
+    message_count, last_message_preview, last_role). When
+    the queue is full the caller flushes inline (back-pressure) instead of
+    dropping. Queued messages stay visible through pending() until committed.
+    """
+
+    def __init__(self, get_engine, messages_table, conversations_table, on_insert=None, preview=None,
+                 max_size=MAX_QUEUE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.get_engine = get_engine
+        self.messages_table = messages_table
+        self.conversations_table = conversations_table
+        self.on_insert = on_insert # on_insert(conn, [(message_id, content)]) داخل نفس المعاملة
+        self.preview = preview or (lambda content: content) # نص last_message_preview من محتوى الرسالة
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._items = deque() # (PendingMessage, attempts)
+        self._inflight = []   # الدفعة التي تُكتب الآن (تبقى مرئية حتى الالتزام)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock() # دفعة واحدة في كل مرة للحفاظ على ترتيب الرسائل
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._atexit_registered = False
+        # المقاييس
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def _ensure_started(self):
+        """Start the flusher thread lazily (and again after a fork)."""
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == pid:
+                return
+            self._pid = pid
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close) # لا تضيع الرسائل المعلقة عند إيقاف العامل
+                self._atexit_registered = True
+
+    def enqueue(self, conversation_id, role, content, created_at=None):
+        """Queue one message insert; returns the PendingMessage."""
+        self._ensure_started()
+        message = PendingMessage(None, conversation_id, role, content, created_at or datetime.now(timezone.utc))
+        while True:
+            with self._cond:
+                if len(self._items) < self.max_size:
+                    self._items.append((message, 0))
+                    self.enqueued += 1
+                    if len(self._items) >= self.batch_size:
+                        self._cond.notify()
+                    return message
+            logger.warning(f"Write-behind queue full ({self.max_size}); flushing inline.")
+            self.flush()
+
+    def pending(self, conversation_id):
+        """Messages of a conversation that are queued or being written, oldest first."""
+        with self._cond:
+            items = list(self._inflight) + [message for message, _ in self._items]
+        return [message for message in items if message.conversation_id == conversation_id]
+
+    def flush(self):
+        """Write everything queued so far, synchronously."""
+        while self._flush_batch():
+            pass
+
+    def close(self):
+        """Stop the flusher and write what is left (called at interpreter exit)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        if self.depth():
+            logger.error(f"Write-behind shutdown left {self.depth()} message(s) unwritten.")
+
+    def depth(self):
+        with self._cond:
+            return len(self._items) + len(self._inflight)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or len(self._items) >= self.batch_size,
+                                    timeout=self.flush_interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e: # لا يجب أن يتوقف الخيط الخلفي
+                logger.error(f"Write-behind flusher error: {e}", exc_info=True)
+
+    def _flush_batch(self):
+        """Write one batch; returns False once the queue is empty."""
+        with self._flush_lock:
+            with self._cond:
+                if not self._items:
+                    return False
+                batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+                self._inflight = [message for message, _ in batch]
+
+            started = time.monotonic()
+            try:
+                self._write([message for message, _ in batch])
+                failed = []
+            except SQLAlchemyError as e:
+                logger.error(f"Write-behind batch of {len(batch)} failed ({e}); retrying per conversation.")
+                with self._cond:
+                    self.failed_flushes += 1
+                failed = self._write_per_conversation(batch)
+            elapsed_ms = (time.monotonic() - started) * 1000
+
+            with self._cond:
+                retry = [(message, attempts + 1) for message, attempts in failed if attempts + 1 < MAX_ATTEMPTS]
+                dropped = len(failed) - len(retry)
+                self._items.extendleft(reversed(retry)) # تعود إلى مقدمة الطابور بنفس الترتيب
+                self._inflight = []
+                self.flushed += len(batch) - len(failed)
+                self.dropped += dropped
+                self.flush_count += 1
+                self.last_flush_ms = round(elapsed_ms, 2)
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self._total_flush_ms += elapsed_ms
+            if dropped:
+                logger.error(f"Write-behind dropped {dropped} message(s) after {MAX_ATTEMPTS} failed attempts.")
+            return not retry # لا نعيد المحاولة فورًا في نفس الاستدعاء
+
+    def _write_per_conversation(self, batch):
+        """Write each conversation's messages separately; returns the (message, attempts) pairs that failed."""
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[0].conversation_id, []).append(item)
+        failed = []
+        for conversation_id, items in groups.items():
+            try:
+                self._write([message for message, _ in items])
+            except SQLAlchemyError as e:
+                logger.error(f"Write-behind write for conversation {conversation_id} failed: {e}")
+                failed.extend(items)
+        return failed
+
+    def _write(self, messages):
+        rows = [
+            {"conversation_id": m.conversation_id, "role": m.role, "created_at": m.created_at,
+             **message_compression.stored_columns(m.content)}
+            for m in messages
+        ]
+        bumps = {} # conversation_id -> (عدد الرسائل، آخر رسالة)
+        for m in messages:
+            count, last = bumps.get(m.conversation_id, (0, m))
+            bumps[m.conversation_id] = (count + 1, m if m.created_at >= last.created_at else last)
+        conversations = self.conversations_table
+        messages_table = self.messages_table
+        with self.get_engine().begin() as conn:
+            # executemany -> INSERT متعدد الصفوف، مع إرجاع المعرفات بنفس ترتيب الصفوف
+            ids = conn.execute(
+                messages_table.insert().returning(messages_table.c.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            if self.on_insert is not None:
+                self.on_insert(conn, [(message_id, m.content) for message_id, m in zip(ids, messages)])
+            conn.execute(
+                update(conversations)
+                .where(conversations.c.id == bindparam("b_id"))
+                .values(
+                    updated_at=bindparam("b_updated_at"),
+                    message_count=conversations.c.message_count + bindparam("b_count"),
+                    last_message_preview=bindparam("b_preview"),
+                    last_role=bindparam("b_role"),
+                ),
+                [
+                    {"b_id": cid, "b_updated_at": last.created_at, "b_count": count,
+                     "b_preview": self.preview(last.content), "b_role": last.role}
+                    for cid, (count, last) in bumps.items()
+                ],
+            )
+
+    def stats(self):
+        with self._cond:
+            return {
+                "enabled": True,
+                "depth": len(self._items) + len(self._inflight),
+                "max_size": self.max_size,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "flushes": self.flush_count,
+                "failed_flushes": self.failed_flushes,
+                "last_flush_ms": self.last_flush_ms,
+                "avg_flush_ms": round(self._total_flush_ms / self.flush_count, 2) if self.flush_count else None,
+                "max_flush_ms": round(self.max_flush_ms, 2),
+            }